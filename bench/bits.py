@@ -0,0 +1,236 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import getopt
+import json
+import random
+import sys
+
+from pseudocode import bits
+from pseudocode.bits import Bits
+from . import run
+
+# Micro-benchmarks for pseudocode/bits.py
+#
+# Each operation is applied to a batch of BATCH_SIZE random operands
+# of the widths in WIDTHS, so one "op" below is one batch; the rate is
+# also reported per single operation.  Results can be saved and
+# compared like those of bench.run.
+
+BATCH_SIZE = 1000
+WIDTHS = [1, 4, 12, 32, 64, 128]
+
+def operands(seed = 1):
+    r = random.Random(seed)
+    xs = []
+    ys = []
+    for i in range(BATCH_SIZE):
+        width = WIDTHS[i % len(WIDTHS)]
+        xs.append(Bits(r.getrandbits(width), width))
+        ys.append(Bits(r.getrandbits(width), width))
+    return xs, ys
+
+def pairs(f):
+    xs, ys = operands()
+    items = list(zip(xs, ys))
+    def op():
+        for x, y in items:
+            f(x, y)
+    return op
+
+def singles(f):
+    xs, ys = operands()
+    def op():
+        for x in xs:
+            f(x)
+    return op
+
+def bench_construct():
+    items = [(x.value, x.width) for x in operands()[0]]
+    def op():
+        for value, width in items:
+            Bits(value, width)
+    return op
+
+def bench_make():
+    items = [(x.value, x.width) for x in operands()[0]]
+    make = bits.make
+    def op():
+        for value, width in items:
+            make(value, width)
+    return op
+
+def bench_literal():
+    texts = [bits.to_string(x) for x in operands()[0]]
+    # the literal cache would make this a dict lookup
+    from_string = bits.from_string
+    def op():
+        for text in texts:
+            from_string(text)
+    return op
+
+def bench_str():
+    return singles(str)
+
+def bench_pattern():
+    xs, ys = operands()
+    patterns = [bits.Pattern(''.join('x' if i % 3 == 0 else c
+                                     for i, c in enumerate(bits.to_string(y))))
+                for y in ys]
+    items = list(zip(patterns, xs))
+    def op():
+        for p, x in items:
+            p.matches(x)
+    return op
+
+def bench_extract():
+    xs, ys = operands()
+    items = [(x, x.width - 1, x.width // 2) for x in xs]
+    extract = bits.extract
+    def op():
+        for x, hi, lo in items:
+            extract(x, hi, lo)
+    return op
+
+def bench_insert():
+    xs, ys = operands()
+    items = [(x, x.width - 1, x.width // 2,
+              Bits(y.value, x.width - x.width // 2))
+             for x, y in zip(xs, ys)]
+    insert = bits.insert
+    def op():
+        for x, hi, lo, y in items:
+            insert(x, hi, lo, y)
+    return op
+
+def bench_replicate():
+    xs, ys = operands()
+    replicate = bits.replicate
+    def op():
+        for x in xs:
+            replicate(x, 4)
+    return op
+
+def bench_sign_extend():
+    sign_extend = bits.sign_extend
+    return singles(lambda x: sign_extend(x, 256))
+
+BENCHMARKS = [
+    ('construct', bench_construct),
+    ('make', bench_make),
+    ('from_string', bench_literal),
+    ('str', bench_str),
+    ('eq', lambda: pairs(lambda x, y: x == y)),
+    ('hash', lambda: singles(hash)),
+    ('and', lambda: pairs(lambda x, y: x & y)),
+    ('or', lambda: pairs(lambda x, y: x | y)),
+    ('eor', lambda: pairs(lambda x, y: x ^ y)),
+    ('not', lambda: singles(lambda x: ~x)),
+    ('add', lambda: pairs(lambda x, y: x + y)),
+    ('sub', lambda: pairs(lambda x, y: x - y)),
+    ('lsl', lambda: singles(lambda x: x << 3)),
+    ('lsr', lambda: singles(lambda x: x >> 3)),
+    ('ror', lambda: singles(lambda x: bits.ror(x, 3))),
+    ('concat', lambda: pairs(bits.concat)),
+    ('extract', bench_extract),
+    ('insert', bench_insert),
+    ('replicate', bench_replicate),
+    ('sint', lambda: singles(bits.sint)),
+    ('sign_extend', bench_sign_extend),
+    ('pattern', bench_pattern),
+]
+
+def run_benchmarks(patterns, min_time, repeat):
+    results = {}
+    for name, func in BENCHMARKS:
+        name = 'bits.' + name
+        if patterns and not any(pattern in name for pattern in patterns):
+            continue
+        op = func()
+        op()
+        ops = run.time_op(op, min_time, repeat)
+        peak, retained = run.measure_memory(op)
+        results[name] = {
+            'ops_per_sec': ops,
+            'peak_bytes': peak,
+            'retained_bytes': retained
+        }
+        sys.stderr.write('%-20s %10.1f ops/s  %7.1f ns per operation\n' % (
+            name, ops, 1e9 / (ops * BATCH_SIZE)))
+    return results
+
+def usage():
+    sys.stderr.write(
+        "Usage: python3 -m bench.bits [OPTIONS] [PATTERN]...\n")
+    sys.stderr.write('''
+Runs the bitvector micro-benchmarks whose names contain one of the
+PATTERNs (default: all of them).
+
+Options:
+  --min-time=SECONDS
+                run each benchmark for at least SECONDS per round
+                (default: 0.2)
+  --repeat=N    report the best of N rounds (default: 3)
+  --save=FILE   write the results to FILE as JSON
+  --compare=FILE
+                compare the results against a baseline written with
+                --save, and exit with status 1 on a regression
+  --tolerance=PERCENT
+                allowed slowdown or memory growth (default: 10)
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', [
+            'min-time=', 'repeat=', 'save=', 'compare=', 'tolerance='])
+    except getopt.GetoptError as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    min_time = .2
+    repeat = 3
+    save_fn = None
+    compare_fn = None
+    tolerance = 10.
+    try:
+        for opt, arg in opts:
+            if opt == '--min-time':
+                min_time = float(arg)
+            elif opt == '--repeat':
+                repeat = int(arg)
+            elif opt == '--save':
+                save_fn = arg
+            elif opt == '--compare':
+                compare_fn = arg
+            elif opt == '--tolerance':
+                tolerance = float(arg)
+    except ValueError:
+        sys.stderr.write('%s: invalid argument for %s: %s\n' % (
+            sys.argv[0], opt, arg))
+        usage()
+
+    results = run_benchmarks(args, min_time, repeat)
+
+    if save_fn is not None:
+        with open(save_fn, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+            f.write('\n')
+
+    if compare_fn is not None:
+        with open(compare_fn) as f:
+            baseline = json.load(f)
+        if run.compare(results, baseline, tolerance / 100.):
+            sys.exit(1)
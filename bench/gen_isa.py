@@ -0,0 +1,178 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import getopt
+import os
+import sys
+
+from . import synth
+
+# Writes a fake ISA specification directory for end-to-end tests
+#
+#     python3 -m bench.gen_isa [--seed=N] DIR DECLARATIONS INSTRUCTIONS
+#
+# DIR/shared_pseudocode.xml gets a few fixed declarations (an
+# enumeration, a struct type, registers, an accessor) plus
+# DECLARATIONS synthetic library functions, and DIR gets INSTRUCTIONS
+# instruction files, each with an encoding condition, a decode and an
+# execute section calling the library functions.  The markup (ps,
+# pstext, a and anchor tags) is what main.py's FileProcessor expects.
+
+# markers for links and anchors, replaced after escaping the text
+LINK, ANCHOR, END = '\x01', '\x03', '\x02'
+
+class MarkupGenerator(synth.Generator):
+    def reference(self, name):
+        return LINK + name + END
+
+    def definition(self, name):
+        return ANCHOR + name + END
+
+def markup(text):
+    out = []
+    for i, part in enumerate(text.split(END)):
+        name = None
+        if LINK in part:
+            part, name = part.split(LINK)
+            tag = 'a'
+            attributes = ' file="shared_pseudocode.xml"'
+        elif ANCHOR in part:
+            part, name = part.split(ANCHOR)
+            tag = 'anchor'
+            attributes = ''
+        out.append(escape_xml(part))
+        if name is not None:
+            out.append('<%s link="impl-shared.%s"%s hover="%s">%s</%s>' % (
+                tag, name, attributes, name, name, tag))
+    return ''.join(out)
+
+def escape_xml(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def ps(name, text, secttype = 'Library'):
+    section, rep_section = {
+        'Library': ('Functions', 'functions'),
+        'noheading': ('Decode', 'decode'),
+        'Operation': ('Execute', 'execute')
+    }[secttype]
+    if secttype == 'Operation':
+        mylink = 'commonps'
+    else:
+        mylink = name.replace('/', '.')
+    return ('<ps name="%s" mylink="%s" enclabels="" sections="1" '
+            'secttype="%s">\n<pstext mayhavelinks="1" section="%s" '
+            'rep_section="%s">%s</pstext>\n</ps>\n' % (
+                name, mylink, secttype, section, rep_section, markup(text)))
+
+def fixed_declarations(g):
+    r = g.reference
+    d = g.definition
+    return [
+        ('shared/functions/system/Kind',
+         'enumeration %s {Kind_A, Kind_B, Kind_C};\n' % d('Kind')),
+        ('shared/functions/system/ProcState',
+         'type %s is (\n    bits (2) EL,\n    bits (4) NZCV\n)\n'
+             % d('ProcState')),
+        ('shared/functions/system/PSTATE', '%s PSTATE;\n' % r('ProcState')),
+        ('shared/functions/registers/R',
+         'array bits(64) _R[0..30];\n'
+         'bits(64) SP_EL0;\n'
+         'constant integer MaxBits = 64;\n'),
+        ('shared/functions/common/Replicate',
+         'bits(M*N) %s(bits(M) x, integer N)\n'
+         '    bits(M*N) result;\n'
+         '    for i = 0 to N-1\n'
+         '        result<i*M+:M> = x;\n'
+         '    return result;\n' % d('Replicate')),
+        ('shared/functions/common/Zeros',
+         '// Zeros()\n// =======\n\n'
+         'bits(N) %s(integer N)\n'
+         "    return %s('0', N);\n" % (d('Zeros'), r('Replicate'))),
+        ('shared/functions/registers/X',
+         'bits(width) %s[integer n]\n'
+         '    assert n >= 0 && n <= 31;\n'
+         '    if n == 31 then\n'
+         '        return %s(width);\n'
+         '    else\n'
+         '        return _R[n]<width-1:0>;\n\n'
+         '%s[integer n] = bits(width) value\n'
+         '    if n != 31 then\n'
+         '        _R[n] = %s(value, 64);\n'
+         '    return;\n' % (d('X'), r('Zeros'), d('X'), r('Replicate'))),
+    ]
+
+def write_isa(path, declarations, instructions, seed = 0):
+    os.makedirs(path, exist_ok = True)
+    g = MarkupGenerator(seed)
+
+    with open(os.path.join(path, 'shared_pseudocode.xml'), 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                '<instructionsection id="shared_pseudocode" '
+                'title="Shared Pseudocode Functions" type="pseudocode">\n'
+                '<ps_section howmany="%d">\n' % (declarations + 7))
+        for name, text in fixed_declarations(g):
+            f.write(ps(name, text))
+        for i in range(declarations):
+            name = 'Func%d' % i
+            f.write(ps('shared/functions/synth/%s' % name, g.function(name)))
+        f.write('</ps_section>\n</instructionsection>\n')
+
+    for i in range(instructions):
+        name = 'instr%05d' % i
+        with open(os.path.join(path, name + '.xml'), 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                    '<instructionsection id="%s" title="%s" '
+                    'type="instruction">\n' % (name, name.upper()))
+            f.write('<classes>\n<iclass name="%s">\n<regdiagram form="32">\n'
+                    '<box hibit="31" width="32" name="op"><c colspan="32">'
+                    '</c></box>\n</regdiagram>\n</iclass>\n</classes>\n'
+                    % name)
+            f.write('<encoding name="%s_enc">\n' % name)
+            f.write('<pstext mayhavelinks="1">%s</pstext>\n' % markup(
+                g.expression(1)))
+            f.write('</encoding>\n')
+            f.write(ps('aarch64/instrs/synth/%s/decode' % name,
+                       g.instruction(), 'noheading'))
+            f.write(ps('aarch64/instrs/synth/%s/execute' % name,
+                       g.instruction(), 'Operation'))
+            f.write('</instructionsection>\n')
+
+def usage():
+    sys.stderr.write(
+        "Usage: python3 -m bench.gen_isa [OPTIONS] DIR DECLARATIONS "
+        "INSTRUCTIONS\n")
+    sys.stderr.write('''
+Options:
+  --seed=N      seed for the random generator (default: 0)
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', ['seed='])
+        seed = 0
+        for opt, arg in opts:
+            if opt == '--seed':
+                seed = int(arg)
+        if len(args) != 3:
+            usage()
+        path = args[0]
+        declarations = int(args[1])
+        instructions = int(args[2])
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    write_isa(path, declarations, instructions, seed)
@@ -0,0 +1,364 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gc
+import getopt
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from pseudocode import *
+from . import synth
+
+# Micro-benchmarks for the main paths of the parser and the resolver
+#
+# Each benchmark repeats one operation (tokenizing a set of fragments,
+# parsing a set of expressions, resolving a namespace, ...) for at
+# least --min-time seconds, several times over, and reports the best
+# rate.  The operation is then run once more under tracemalloc to
+# record the peak of the memory it allocated and how much of that was
+# still allocated afterwards.
+#
+# There are two corpora: the hand-written snippets in bench/snippets/,
+# which look like the real specification, and source produced by
+# bench/synth.py, which is bigger and exercises deeper nesting.
+
+SNIPPETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'snippets')
+
+class Corpus:
+    def __init__(self, name, library, instructions, expressions):
+        self.name = name
+        # one string per pstext, as they appear in the XML files
+        self.library = library
+        self.instructions = instructions
+        self.expressions = expressions
+
+def read_snippet(fn):
+    with open(os.path.join(SNIPPETS_DIR, fn)) as f:
+        return f.read()
+
+def snippets_corpus():
+    # declarations are separated by blank lines
+    library = [chunk + '\n'
+               for chunk in read_snippet('library.asl').split('\n\n')]
+    return Corpus('snippets', library,
+                  [read_snippet('instruction.asl')],
+                  read_snippet('expressions.asl').splitlines())
+
+def synthetic_corpus():
+    return Corpus('synthetic', synth.library(200),
+                  synth.instructions(50, 200), synth.expressions(500))
+
+def tokenize(text):
+    tokenizer = token.Tokenizer()
+    tokenizer.process(text)
+    tokenizer.process_end()
+    return tokenizer.tokens
+
+def parse_library(corpus):
+    declarations = []
+    for text in corpus.library:
+        declarations += stmt.parse_block(tokenize(text), decl.parse)
+    return declarations
+
+def build_namespace(declarations):
+    ns.global_ns = ns.Namespace()
+    for declaration in declarations:
+        ns.process(declaration)
+    return ns.global_ns
+
+# Each benchmark takes a corpus, does any preparation that shouldn't be
+# measured and returns the operation to time.
+
+def bench_tokenize(corpus):
+    texts = corpus.library + corpus.instructions + \
+            [text + '\n' for text in corpus.expressions]
+    def op():
+        for text in texts:
+            tokenizer = token.Tokenizer()
+            tokenizer.process(text)
+            tokenizer.process_end()
+    return op
+
+def bench_parse_ternary(corpus):
+    token_lists = [tokenize(text + '\n') for text in corpus.expressions]
+    def op():
+        for tokens in token_lists:
+            tstream.parse(tokens, 0, len(tokens) - 1, expr.parse_ternary)
+    return op
+
+def bench_parse_block(corpus):
+    token_lists = [tokenize(text) for text in corpus.instructions]
+    def op():
+        for tokens in token_lists:
+            stmt.parse_block(tokens, stmt.parse_statement)
+    return op
+
+def bench_decl_parse(corpus):
+    token_lists = [tokenize(text) for text in corpus.library]
+    def op():
+        for tokens in token_lists:
+            stmt.parse_block(tokens, decl.parse)
+    return op
+
+def bench_ns_process(corpus):
+    declarations = parse_library(corpus)
+    def op():
+        build_namespace(declarations)
+    return op
+
+def bench_process_namespace(corpus):
+    namespace = build_namespace(parse_library(corpus))
+    def op():
+        ns.global_ns = namespace
+        # the corpora are meant to resolve cleanly, but don't let
+        # diagnostics end up in the timing output
+        scope.process_namespace(namespace, io.StringIO())
+    return op
+
+def bench_similar_names(corpus):
+    namespace = build_namespace(parse_library(corpus))
+    ns.finalize(namespace)
+    # every name with one character dropped, as a typo would
+    queries = [name[:len(name) // 2] + name[len(name) // 2 + 1:]
+               for name in namespace.names.names]
+    def op():
+        for query in queries:
+            ns.similar_names(query, 5, namespace)
+    return op
+
+# the synthetic source isn't meant to be executed, so these only run
+# on the snippets: one operation executes the add/subtract instruction
+# in bench/snippets/execute.asl for 64 encodings
+
+EXECUTE_INPUTS = ['sf', 'op', 'S', 'sh', 'imm12', 'Rn', 'Rd']
+
+def execute_setup(corpus):
+    namespace = ns.Namespace()
+    for declaration in parse_library(corpus):
+        ns.process(declaration, namespace)
+    body = stmt.parse_block(tokenize(read_snippet('execute.asl')),
+                            stmt.parse_statement)
+    Bits = bits.Bits
+    encodings = [(Bits(i >> 5, 1), Bits(i >> 4, 1), Bits(i >> 3, 1),
+                  Bits(i >> 2, 1), Bits(i * 123, 12), Bits(i, 5),
+                  Bits(i + 1, 5))
+                 for i in range(64)]
+    return namespace, body, encodings
+
+def bench_evaluate(corpus):
+    if corpus.name != 'snippets':
+        return None
+    namespace, body, encodings = execute_setup(corpus)
+    evaluator = evaluate.Evaluator(namespace)
+    code = evaluator.compile_code([body], EXECUTE_INPUTS)
+    def op():
+        for encoding in encodings:
+            code.run(*encoding)
+    return op
+
+def bench_codegen(corpus):
+    if corpus.name != 'snippets':
+        return None
+    namespace, body, encodings = execute_setup(corpus)
+    semantics = codegen.load(namespace, [('execute', [body])])
+    function, inputs = semantics.instruction('execute')
+    assert list(inputs) == sorted(EXECUTE_INPUTS, key = inputs.index)
+    encodings = [{data: value for data, value
+                              in zip(EXECUTE_INPUTS, encoding)}
+                 for encoding in encodings]
+    def op():
+        for encoding in encodings:
+            function(**encoding)
+    return op
+
+def bench_codegen_generate(corpus):
+    namespace = ns.Namespace()
+    for declaration in parse_library(corpus):
+        ns.process(declaration, namespace)
+    def op():
+        codegen.generate(namespace)
+    return op
+
+def bench_dump(corpus):
+    declarations = parse_library(corpus)
+    bodies = [stmt.parse_block(tokenize(text), stmt.parse_statement)
+              for text in corpus.instructions]
+    def op():
+        for declaration in declarations:
+            declaration.dump()
+        for body in bodies:
+            for statement in body:
+                statement.dump()
+    return op
+
+BENCHMARKS = [
+    ('tokenize', bench_tokenize),
+    ('expr.parse_ternary', bench_parse_ternary),
+    ('stmt.parse_block', bench_parse_block),
+    ('decl.parse', bench_decl_parse),
+    ('ns.process', bench_ns_process),
+    ('scope.process_namespace', bench_process_namespace),
+    ('ns.similar_names', bench_similar_names),
+    ('evaluate', bench_evaluate),
+    ('codegen', bench_codegen),
+    ('codegen.generate', bench_codegen_generate),
+    ('dump', bench_dump),
+]
+
+def time_op(op, min_time, repeat):
+    best = None
+    for i in range(repeat):
+        n = 0
+        start = time.perf_counter()
+        while True:
+            op()
+            n += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        if best is None or n / elapsed > best:
+            best = n / elapsed
+    return best
+
+def measure_memory(op):
+    gc.collect()
+    tracemalloc.start()
+    start, peak = tracemalloc.get_traced_memory()
+    op()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - start, current - start
+
+def run(patterns, min_time, repeat):
+    results = {}
+    saved_ns = ns.global_ns
+    try:
+        for corpus in [snippets_corpus(), synthetic_corpus()]:
+            for name, func in BENCHMARKS:
+                name = '%s/%s' % (name, corpus.name)
+                if patterns and not any(pattern in name
+                                        for pattern in patterns):
+                    continue
+                op = func(corpus)
+                if op is None:
+                    continue
+                # warm up
+                op()
+                ops = time_op(op, min_time, repeat)
+                peak, retained = measure_memory(op)
+                results[name] = {
+                    'ops_per_sec': ops,
+                    'peak_bytes': peak,
+                    'retained_bytes': retained
+                }
+                sys.stderr.write(
+                    '%-36s %10.1f ops/s  peak %8.1f KiB  retained %8.1f KiB\n'
+                    % (name, ops, peak / 1024., retained / 1024.))
+    finally:
+        ns.global_ns = saved_ns
+    return results
+
+# A benchmark has regressed if its rate dropped, or its peak memory
+# grew, by more than the tolerance.  Retained memory is only recorded:
+# it is mostly caches filling up, and too noisy to compare.
+
+def compare(results, baseline, tolerance):
+    regressions = 0
+    for name, result in sorted(results.items()):
+        try:
+            base = baseline[name]
+        except KeyError:
+            sys.stderr.write('%-36s  (not in baseline)\n' % name)
+            continue
+        speed = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        memory = result['peak_bytes'] / max(base['peak_bytes'], 1) - 1
+        failed = speed < -tolerance or memory > tolerance
+        if failed:
+            regressions += 1
+        sys.stderr.write('%-36s %+7.1f%% speed %+7.1f%% memory%s\n' % (
+            name, 100 * speed, 100 * memory, '  REGRESSION' if failed else ''))
+    for name in sorted(set(baseline) - set(results)):
+        sys.stderr.write('%-36s  (not run)\n' % name)
+    return regressions
+
+def usage():
+    sys.stderr.write(
+        "Usage: python3 -m bench.run [OPTIONS] [PATTERN]...\n")
+    sys.stderr.write('''
+Runs the benchmarks whose names contain one of the PATTERNs (default:
+all of them).
+
+Options:
+  --min-time=SECONDS
+                run each benchmark for at least SECONDS per round
+                (default: 0.2)
+  --repeat=N    report the best of N rounds (default: 3)
+  --save=FILE   write the results to FILE as JSON
+  --compare=FILE
+                compare the results against a baseline written with
+                --save, and exit with status 1 on a regression
+  --tolerance=PERCENT
+                allowed slowdown or memory growth (default: 10)
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', [
+            'min-time=', 'repeat=', 'save=', 'compare=', 'tolerance='])
+    except getopt.GetoptError as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    min_time = .2
+    repeat = 3
+    save_fn = None
+    compare_fn = None
+    tolerance = 10.
+    try:
+        for opt, arg in opts:
+            if opt == '--min-time':
+                min_time = float(arg)
+            elif opt == '--repeat':
+                repeat = int(arg)
+            elif opt == '--save':
+                save_fn = arg
+            elif opt == '--compare':
+                compare_fn = arg
+            elif opt == '--tolerance':
+                tolerance = float(arg)
+    except ValueError:
+        sys.stderr.write('%s: invalid argument for %s: %s\n' % (
+            sys.argv[0], opt, arg))
+        usage()
+
+    results = run(args, min_time, repeat)
+
+    if save_fn is not None:
+        with open(save_fn, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+            f.write('\n')
+
+    if compare_fn is not None:
+        with open(compare_fn) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, tolerance / 100.):
+            sys.exit(1)
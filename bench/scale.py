@@ -0,0 +1,188 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import getopt
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import gen_isa
+
+# End-to-end scaling harness
+#
+# Generates fake ISA directories at several multiples of a base size,
+# runs main.py over each of them with --stats=json and records the
+# wall time and peak RSS of the run, plus the wall time of each phase.
+# For every step from one size to the next, the growth exponent
+# log(t2 / t1) / log(s2 / s1) is printed: 1 means linear, anything
+# clearly above 1 points at a superlinear stage.
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'main.py')
+
+PHASES = ['xml', 'tokenize', 'parse', 'ns.process', 'resolve', 'output']
+
+def run_main(isa_dir, run_dir, options):
+    os.makedirs(run_dir, exist_ok = True)
+    with open(os.path.join(run_dir, 'stdout.txt'), 'w') as stdout, \
+         open(os.path.join(run_dir, 'stderr.txt'), 'w') as stderr:
+        start = time.perf_counter()
+        p = subprocess.Popen([sys.executable, MAIN, '--stats=json'] +
+                             options + [isa_dir],
+                             cwd = run_dir, stdout = stdout, stderr = stderr)
+        pid, status, rusage = os.wait4(p.pid, 0)
+        wall = time.perf_counter() - start
+    if status != 0:
+        sys.stderr.write('%s: main.py failed, see %s\n' % (
+            sys.argv[0], os.path.join(run_dir, 'stderr.txt')))
+        sys.exit(1)
+    with open(os.path.join(run_dir, 'stats.json')) as f:
+        phases = json.load(f)['phases']
+    return {
+        'wall': wall,
+        # kilobytes on Linux
+        'max_rss': rusage.ru_maxrss * 1024,
+        'phases': dict((name, phases[name]['wall']) for name in PHASES
+                                                    if name in phases)
+    }
+
+def input_size(isa_dir):
+    return sum(os.path.getsize(os.path.join(isa_dir, fn))
+               for fn in os.listdir(isa_dir))
+
+def measure(scales, declarations, instructions, work_dir, options):
+    results = []
+    for scale in scales:
+        isa_dir = os.path.join(work_dir, 'isa-%g' % scale)
+        n = max(1, int(round(declarations * scale)))
+        m = max(1, int(round(instructions * scale)))
+        sys.stderr.write('scale %g: generating %d declarations, '
+                         '%d instructions ...\n' % (scale, n, m))
+        gen_isa.write_isa(isa_dir, n, m)
+        size = input_size(isa_dir)
+        sys.stderr.write('scale %g: running main.py on %.1f MB ...\n' % (
+            scale, size / 1e6))
+        result = run_main(isa_dir, os.path.join(work_dir, 'run-%g' % scale),
+                          options)
+        result.update({
+            'scale': scale,
+            'declarations': n,
+            'instructions': m,
+            'input_bytes': size
+        })
+        results.append(result)
+        # the directories get big, don't keep them around
+        shutil.rmtree(isa_dir)
+    return results
+
+def exponent(a, b, s1, s2):
+    if a <= 0 or b <= 0 or s1 == s2:
+        return float('nan')
+    return math.log(b / a) / math.log(s2 / s1)
+
+def report(results):
+    phases = [name for name in PHASES
+              if any(name in result['phases'] for result in results)]
+    sys.stdout.write('%8s %10s %9s %9s' % ('scale', 'input MB', 'wall s',
+                                           'RSS MB'))
+    for name in phases:
+        sys.stdout.write(' %10s' % name)
+    sys.stdout.write('\n')
+    for result in results:
+        sys.stdout.write('%8g %10.1f %9.2f %9.1f' % (
+            result['scale'], result['input_bytes'] / 1e6, result['wall'],
+            result['max_rss'] / 1e6))
+        for name in phases:
+            sys.stdout.write(' %10.2f' % result['phases'].get(name, 0.))
+        sys.stdout.write('\n')
+
+    if len(results) < 2:
+        return
+    sys.stdout.write('\ngrowth exponents (1 = linear)\n')
+    for r1, r2 in zip(results, results[1:]):
+        s1 = r1['input_bytes']
+        s2 = r2['input_bytes']
+        sys.stdout.write('%8s %10s %9.2f %9.2f' % (
+            '%g-%g' % (r1['scale'], r2['scale']), '',
+            exponent(r1['wall'], r2['wall'], s1, s2),
+            exponent(r1['max_rss'], r2['max_rss'], s1, s2)))
+        for name in phases:
+            sys.stdout.write(' %10.2f' % exponent(
+                r1['phases'].get(name, 0.), r2['phases'].get(name, 0.),
+                s1, s2))
+        sys.stdout.write('\n')
+
+def usage():
+    sys.stderr.write(
+        "Usage: python3 -m bench.scale [OPTIONS] [-- MAIN-OPTIONS]\n")
+    sys.stderr.write('''
+Options:
+  --scales=LIST multiples of the base size to run (default: 1,2,10,50)
+  --declarations=N
+                library functions at scale 1 (default: 2000)
+  --instructions=N
+                instruction files at scale 1 (default: 1000)
+  --work-dir=DIR
+                generate and run in DIR instead of a temporary directory
+  --json=FILE   also write the results to FILE
+
+MAIN-OPTIONS are passed on to main.py, e.g. --stream or --jobs=4.
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', [
+            'scales=', 'declarations=', 'instructions=', 'work-dir=',
+            'json='])
+        scales = [1, 2, 10, 50]
+        declarations = 2000
+        instructions = 1000
+        work_dir = None
+        json_fn = None
+        for opt, arg in opts:
+            if opt == '--scales':
+                scales = [float(scale) for scale in arg.split(',')]
+            elif opt == '--declarations':
+                declarations = int(arg)
+            elif opt == '--instructions':
+                instructions = int(arg)
+            elif opt == '--work-dir':
+                work_dir = arg
+            elif opt == '--json':
+                json_fn = arg
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+
+    if work_dir is None:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = measure(scales, declarations, instructions,
+                              work_dir, args)
+    else:
+        results = measure(scales, declarations, instructions,
+                          os.path.abspath(work_dir), args)
+
+    report(results)
+    if json_fn is not None:
+        with open(json_fn, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+            f.write('\n')
@@ -0,0 +1,183 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+
+# Synthetic ASL source for the benchmarks
+#
+# The generated code only has to look like the real thing to the
+# parser and the resolver: names are made up, widths don't match, and
+# nothing is meant to be executed.  The output only depends on the
+# seed, so the same sizes always produce the same source.
+
+BINARY_OPERATORS = [
+    '+', '-', '*', 'DIV', 'MOD', '==', '!=', '<', '>=', '&&', '||',
+    'AND', 'OR', 'EOR', ':'
+]
+
+PARAMETERS = ['op1', 'op2', 'shift', 'flag']
+
+class Generator:
+    def __init__(self, seed = 0):
+        self.random = random.Random(seed)
+        self.functions = []
+        self.locals = []
+
+    # hooks for adding markup to global names
+    def reference(self, name):
+        return name
+
+    def definition(self, name):
+        return name
+
+    def name(self):
+        names = PARAMETERS + self.locals
+        if self.functions and self.random.random() < .05:
+            names = ['%s.EL' % self.reference('PSTATE')]
+        return self.random.choice(names)
+
+    def call(self, depth):
+        if not self.functions:
+            return self.name()
+        return '%s(%s, %s)' % (self.reference(
+                                   self.random.choice(self.functions)),
+                               self.expression(depth - 1),
+                               self.expression(depth - 1))
+
+    def operand(self, depth):
+        r = self.random.random()
+        if depth <= 0 or r < .3:
+            return self.random.choice([
+                self.name(), self.name(), str(self.random.randrange(64)),
+                "'%s'" % ''.join(self.random.choice('01')
+                                 for i in range(self.random.randrange(1, 9)))
+            ])
+        if r < .5:
+            return self.call(depth)
+        if r < .6:
+            hi = self.random.randrange(1, 64)
+            return '%s<%d:%d>' % (self.name(), hi, self.random.randrange(hi))
+        if r < .7:
+            return '(if %s then %s else %s)' % (
+                self.expression(depth - 1), self.expression(depth - 1),
+                self.expression(depth - 1))
+        if r < .8:
+            return '%s%s' % (self.random.choice(['!', '-', 'NOT ']),
+                             self.operand(depth - 1))
+        if r < .85:
+            return '%s IN {%s}' % (self.name(), ', '.join(
+                "'%s'" % format(i, '02b') for i in range(
+                    self.random.randrange(1, 4))))
+        return '(%s)' % self.expression(depth - 1)
+
+    def expression(self, depth = 2):
+        parts = [self.operand(depth)]
+        for i in range(self.random.randrange(3)):
+            parts.append(self.random.choice(BINARY_OPERATORS))
+            parts.append(self.operand(depth - 1))
+        return ' '.join(parts)
+
+    def statement(self, indent, depth):
+        prefix = '    ' * indent
+        r = self.random.random()
+        if depth <= 0 or r < .35:
+            if self.random.random() < .3 or not self.locals:
+                name = 'v%d' % len(self.locals)
+                self.locals.append(name)
+                return ['%sinteger %s = %s;' % (
+                    prefix, name, self.expression())]
+            return ['%s%s = %s;' % (prefix, self.random.choice(self.locals),
+                                    self.expression())]
+        if r < .45 and self.functions:
+            return ['%s%s;' % (prefix, self.call(2))]
+        if r < .65:
+            lines = ['%sif %s then' % (prefix, self.expression(2))]
+            lines += self.block(indent + 1, depth - 1)
+            if self.random.random() < .4:
+                lines.append('%selsif %s then' % (prefix,
+                                                  self.expression(2)))
+                lines += self.block(indent + 1, depth - 1)
+            if self.random.random() < .5:
+                lines.append('%selse' % prefix)
+                lines += self.block(indent + 1, depth - 1)
+            return lines
+        if r < .75:
+            var = 'i%d' % depth
+            lines = ['%sfor %s = 0 to %s' % (prefix, var, self.expression(1))]
+            self.locals.append(var)
+            lines += self.block(indent + 1, depth - 1)
+            self.locals.remove(var)
+            return lines
+        if r < .85:
+            lines = ['%scase %s of' % (prefix, self.name())]
+            for i in range(self.random.randrange(1, 5)):
+                lines.append("%s    when '%s'" % (prefix, format(i, '02b')))
+                lines += self.block(indent + 2, depth - 1)
+            lines.append('%s    otherwise' % prefix)
+            lines += self.block(indent + 2, depth - 1)
+            return lines
+        if r < .93:
+            lines = ['%swhile %s do' % (prefix, self.expression(2))]
+            lines += self.block(indent + 1, depth - 1)
+            return lines
+        lines = ['%srepeat' % prefix]
+        lines += self.block(indent + 1, depth - 1)
+        lines.append('%suntil %s;' % (prefix, self.expression(2)))
+        return lines
+
+    def block(self, indent, depth):
+        lines = []
+        for i in range(self.random.randrange(1, 4)):
+            lines += self.statement(indent, depth)
+        return lines
+
+    def function(self, name):
+        self.locals = []
+        lines = ['bits(64) %s(bits(64) op1, bits(64) op2, integer shift, '
+                 'boolean flag)' % self.definition(name)]
+        for i in range(self.random.randrange(2, 6)):
+            lines += self.statement(1, 2)
+        lines.append('    return %s;' % self.expression())
+        self.functions.append(name)
+        return '\n'.join(lines) + '\n'
+
+    def instruction(self):
+        self.locals = []
+        lines = []
+        for i in range(self.random.randrange(4, 10)):
+            lines += self.statement(0, 2)
+        return '\n'.join(lines) + '\n'
+
+# one fragment per declaration, like a pstext in shared_pseudocode.xml
+def library(n, seed = 0):
+    g = Generator(seed)
+    fragments = ['type ProcState is (\n    bits (2) EL\n)\n',
+                 'ProcState PSTATE;\n']
+    for i in range(n):
+        fragments.append(g.function('Func%d' % i))
+    return fragments
+
+# instruction bodies calling the library functions
+def instructions(n, library_size, seed = 0):
+    g = Generator(seed)
+    g.functions = ['Func%d' % i for i in range(library_size)]
+    return [g.instruction() for i in range(n)]
+
+def expressions(n, seed = 0):
+    g = Generator(seed)
+    g.functions = ['Func%d' % i for i in range(10)]
+    g.locals = ['x', 'y', 'z']
+    return [g.expression(3) for i in range(n)]
@@ -0,0 +1,112 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import getopt
+import sys
+import time
+
+import main
+
+# Thread-scaling benchmark for main.Spec
+#
+# Loads the specification in DIR with each of the given numbers of
+# threads and reports the best wall time and the speedup over one
+# thread, then loads two independent specifications at the same time,
+# each in its own thread, and checks that their namespaces don't share
+# anything.  Parsing is pure Python, so on an interpreter with a GIL,
+# more threads can't make it faster; the numbers show what the thread
+# pool costs there, and what it gains on a free-threaded build.
+
+def gil_enabled():
+    try:
+        return sys._is_gil_enabled()
+    except AttributeError:
+        return True
+
+def time_load(base_dir, threads, repeat):
+    best = None
+    for i in range(repeat):
+        spec = main.Spec(base_dir)
+        start = time.perf_counter()
+        spec.load(threads)
+        wall = time.perf_counter() - start
+        if best is None or wall < best:
+            best = wall
+    return best
+
+def load_side_by_side(base_dirs):
+    with concurrent.futures.ThreadPoolExecutor(len(base_dirs)) as executor:
+        start = time.perf_counter()
+        specs = list(executor.map(main.load_spec, base_dirs))
+        wall = time.perf_counter() - start
+    return specs, wall
+
+def usage():
+    sys.stderr.write(
+        "Usage: python3 -m bench.threads [OPTIONS] DIR [DIR2]\n")
+    sys.stderr.write('''
+Loads the specification in DIR with a growing number of threads.  If
+DIR2 is given, it is loaded alongside DIR for the isolation check
+(default: DIR again).
+
+Options:
+  --threads=LIST
+                numbers of threads to run (default: 1,2,4)
+  --repeat=N    report the best of N runs (default: 3)
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', ['threads=', 'repeat='])
+        thread_counts = [1, 2, 4]
+        repeat = 3
+        for opt, arg in opts:
+            if opt == '--threads':
+                thread_counts = [int(n) for n in arg.split(',')]
+            elif opt == '--repeat':
+                repeat = int(arg)
+    except (getopt.GetoptError, ValueError) as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    if len(args) not in [1, 2]:
+        usage()
+
+    main.Progress.enabled = False
+    sys.stdout.write('GIL %s\n' % ('enabled' if gil_enabled()
+                                   else 'disabled'))
+    sys.stdout.write('%8s %9s %8s\n' % ('threads', 'wall s', 'speedup'))
+    base = None
+    for threads in thread_counts:
+        wall = time_load(args[0], threads, repeat)
+        if base is None:
+            base = wall
+        sys.stdout.write('%8d %9.3f %7.2fx\n' % (threads, wall, base / wall))
+
+    base_dirs = [args[0], args[-1]]
+    specs, wall = load_side_by_side(base_dirs)
+    a, b = specs
+    shared = [name for name, value in a.namespace.index.items()
+              if b.namespace.index.get(name) is value]
+    sys.stdout.write('\ntwo specifications side by side: %.3fs, '
+                     '%d and %d names, %d shared\n' % (
+                         wall, len(a.namespace.index),
+                         len(b.namespace.index), len(shared)))
+    if shared or a.namespace is b.namespace:
+        sys.stderr.write('%s: specifications share namespace entries\n'
+                         % sys.argv[0])
+        sys.exit(1)
@@ -15,22 +15,36 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import fnmatch
+import getopt
+import hashlib
+import io
+import json
+import multiprocessing
 import os
+import pickle
 import sys
+import time
 import xml.parsers.expat
 
 from pseudocode import *
 
 class Progress:
-    def __init__(self, msg):
+    enabled = True
+
+    def __init__(self, msg, show = True):
         self.msg = msg
+        self.show = show and self.enabled
 
     def __enter__(self):
-        sys.stderr.write(self.msg + ' ...')
-        sys.stderr.flush()
+        if self.show:
+            sys.stderr.write(self.msg + ' ...')
+            sys.stderr.flush()
 
     def __exit__(self, *exc_info):
-        sys.stderr.write('\x1b[u\x1b[K')
+        if self.show:
+            sys.stderr.write('\x1b[u\x1b[K')
 
 class Fragment:
     def __init__(self, file_processor,
@@ -54,23 +68,27 @@ class Fragment:
         assert mayhavelinks == '1'
         self.section = section
 
-        self.tokenizer = token.Tokenizer()
         self.buf = []
         self.inside_element = None
+        # character data and contents of a/anchor tags, in order, so the
+        # fragment can be tokenized and parsed somewhere else
+        self.events = []
+        # identifies the fragment's source text for incremental rebuilds
+        self.digest = hashlib.sha1(repr((self.name, section)).encode())
+        # line and (0-based) column in the file at which the text starts
+        self.start = None
 
         self.body = None
         self.expression = None
 
     def character_data(self, data):
         self.buf.append(data)
+        self.digest.update(data.encode())
 
     def start_element(self, name, link, hover, file = None):
+        self.digest.update(('\0<%s>' % name).encode())
         if self.buf:
-            try:
-                self.tokenizer.process(''.join(self.buf))
-            except LexError as e:
-                e.report()
-                sys.exit(1)
+            self.events.append((None, ''.join(self.buf)))
             del self.buf[:]
 
         if name != 'a' and name != 'anchor':
@@ -83,49 +101,94 @@ class Fragment:
     def end_element(self, name):
         assert self.inside_element == name
         self.inside_element = None
+        self.digest.update(('\0</%s>' % name).encode())
 
-        try:
-            if name == 'a':
-                self.tokenizer.process_a(''.join(self.buf))
-            elif name == 'anchor':
-                self.tokenizer.process_anchor(''.join(self.buf))
-        except LexError as e:
-            e.report()
-            sys.exit(1)
+        self.events.append((name, ''.join(self.buf)))
+        del self.buf[:]
+
+    def end(self):
+        self.events.append((None, ''.join(self.buf) + '\n'))
         del self.buf[:]
+        self.digest = self.digest.hexdigest()
 
-    def end(self, is_shared_pseudocode):
+    def export(self):
+        return (self.name, self.section, self.digest,
+                self.body, self.expression)
+
+def tokenize_fragment(events, fn, fragment_name = None, start = None):
+    with stats.phase('tokenize', fn) as ph:
+        tokenizer = token.Tokenizer()
         try:
-            self.tokenizer.process(''.join(self.buf) + '\n')
-            self.tokenizer.process_end()
+            for name, data in events:
+                ph.count('bytes', len(data))
+                if name is None:
+                    tokenizer.process(data)
+                elif name == 'a':
+                    tokenizer.process_a(data)
+                elif name == 'anchor':
+                    tokenizer.process_anchor(data)
+            tokenizer.process_end()
         except LexError as e:
+            e.locate(fn, fragment_name, fragment_text(events),
+                     tokenizer.start + e.pos, tokenizer.line, start)
             e.report()
             sys.exit(1)
-        del self.buf[:]
+        if stats.recorder is not None:
+            ph.count('tokens', stats.count_tokens(tokenizer.tokens))
+    return tokenizer
 
-        #print('{')
-        #for token in self.tokens:
-        #    print('\t' + str(token))
-        #print('}')
+# source text of a fragment, for error messages
+def fragment_text(events):
+    return ''.join(data for name, data in events)
 
-        tokens = self.tokenizer.tokens
+def parse_fragment(events, fn, is_shared_pseudocode, fragment_name,
+                   start = None):
+    tokenizer = tokenize_fragment(events, fn, fragment_name, start)
+    tokens = tokenizer.tokens
 
+    #print('{')
+    #for token in tokens:
+    #    print('\t' + str(token))
+    #print('}')
+
+    body = None
+    expression = None
+    with stats.phase('parse', fn) as ph:
         try:
             if not tokens:
                 pass
             elif is_shared_pseudocode:
-                self.body = stmt.parse_block(tokens, decl.parse)
-                for declaration in self.body:
-                    ns.process(declaration)
-            elif self.name is not None:
-                self.body = stmt.parse_block(tokens, stmt.parse_statement)
+                body = stmt.parse_block(tokens, decl.parse)
+                ph.count('declarations', len(body))
+            elif fragment_name is not None:
+                body = stmt.parse_block(tokens, stmt.parse_statement)
+                ph.count('statements', stats.count_statements(body))
             else:
                 assert tokens[-1] == token.NEWLINE
-                self.expression = tstream.parse(tokens, 0, len(tokens) - 1,
-                                                expr.parse_ternary)
+                expression = tstream.parse(tokens, 0, len(tokens) - 1,
+                                           expr.parse_ternary)
+                ph.count('expressions', 1)
         except ParseError as e:
+            text = fragment_text(events)
+            offset, line = tstream.source_offset(text, tokenizer.positions,
+                                                 e.ts)
+            e.locate(fn, fragment_name, text, offset, line, start)
             e.report()
             sys.exit(1)
+    return body, expression
+
+# a fragment restored from the parse cache
+class CachedFragment:
+    def __init__(self, name, section, digest, body, expression):
+        self.name = name
+        self.section = section
+        self.digest = digest
+        self.body = body
+        self.expression = expression
+
+    def export(self):
+        return (self.name, self.section, self.digest,
+                self.body, self.expression)
 
 class Container:
     def __init__(self, name, mylink, enclabels, sections, secttype):
@@ -153,18 +216,125 @@ class FileProcessor:
         self.container = None
         self.fragment = None
         self.fragments = []
+        self.errors = 0
+        self.futures = None
+        # whether to show progress messages
+        self.progress = True
+
+    def load(self, parse_cache = None, data = None):
+        with Progress('processing %s' % self.fn, self.progress):
+            if data is None:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+
+            if self.prepare(data, parse_cache):
+                self.finish([parse_fragment(*work)
+                             for work in self.pending_fragments()],
+                            parse_cache)
+
+    # Parsing is done in two steps: prepare() runs expat (or restores the
+    # file from the parse cache) and returns whether there is anything
+    # left to do; the fragments can then be tokenized and parsed here or
+    # somewhere else, and the results are put back in order by finish().
+
+    def prepare(self, data, parse_cache = None):
+        self.start = time.perf_counter()
+        if parse_cache is not None:
+            self.key = parse_cache.key(self.fn, data)
+            cached = parse_cache.load(self.key)
+            if cached is not None:
+                self.restore(cached)
+                return False
 
+        with stats.phase('xml', self.fn) as ph:
+            ph.count('bytes', len(data))
+            self.parse(data)
+            ph.count('fragments', len(self.fragments))
+        return True
+
+    def pending_fragments(self):
+        work = []
+        for fragment in self.fragments:
+            work.append((fragment.events, self.fn, self.is_shared_pseudocode,
+                         fragment.name, fragment.start))
+            fragment.events = None
+        return work
+
+    def finish(self, results, parse_cache = None):
+        for fragment, (body, expression) in zip(self.fragments, results):
+            fragment.body = body
+            fragment.expression = expression
+        # don't cache files with errors so they are reported again
+        if parse_cache is not None and not self.errors:
+            parse_cache.store(self.key, self.export(),
+                              time.perf_counter() - self.start)
+
+    # Parse the file in a process pool: expat runs here, and the
+    # fragments are tokenized and parsed in batches by the workers.
+
+    def submit(self, executor, parse_cache = None):
+        with Progress('reading %s' % self.fn, self.progress):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if not self.prepare(data, parse_cache):
+                return
+
+            self.futures = []
+            batch = []
+            size = 0
+            for item in self.pending_fragments():
+                batch.append(item)
+                events = item[0]
+                size += sum(len(data) for name, data in events)
+                if size >= FRAGMENT_BATCH_SIZE:
+                    self.futures.append(
+                        executor.submit(parse_fragments_worker, batch))
+                    batch = []
+                    size = 0
+            if batch:
+                self.futures.append(
+                    executor.submit(parse_fragments_worker, batch))
+
+    def collect(self, parse_cache = None):
+        if self.futures is None:
+            return
+        with Progress('processing %s' % self.fn, self.progress):
+            results = []
+            for future in self.futures:
+                batch_results, records = future.result()
+                results += batch_results
+                merge_stats(records)
+            self.futures = None
+            self.finish(results, parse_cache)
+
+    # compact picklable representation of the parsed fragments
+    def export(self):
+        return [fragment.export() for fragment in self.fragments]
+
+    def restore(self, states):
+        self.fragments = [CachedFragment(*state) for state in states]
+
+    def process_declarations(self, namespace = None):
+        if not self.is_shared_pseudocode:
+            return
+        with stats.phase('ns.process', self.fn) as ph:
+            for fragment in self.fragments:
+                if fragment.body is not None:
+                    for declaration in fragment.body:
+                        ns.process(declaration, namespace)
+                    ph.count('declarations', len(fragment.body))
+
+    def parse(self, data):
         self.p = xml.parsers.expat.ParserCreate()
         self.p.StartElementHandler = self.StartElementHandler
         self.p.EndElementHandler = self.EndElementHandler
         self.p.CharacterDataHandler = self.CharacterDataHandler
 
-        with Progress('processing %s' % fn):
-            with open(self.path, 'rb') as f:
-                try:
-                    self.p.ParseFile(f)
-                except xml.parsers.expat.ExpatError as e:
-                    self.error(str(e), lineno = e.lineno - 1)
+        try:
+            self.p.Parse(data, True)
+        except xml.parsers.expat.ExpatError as e:
+            self.error(str(e), lineno = e.lineno - 1)
+        self.p = None
 
     def StartElementHandler(self, name, attributes):
         if name == 'ps':
@@ -186,6 +356,7 @@ class FileProcessor:
         elif self.fragment is not None:
             if name != 'a' and name != 'anchor':
                 raise ParseError
+            self.mark_start()
             self.fragment.start_element(name, **attributes)
 
     def EndElementHandler(self, name):
@@ -198,11 +369,17 @@ class FileProcessor:
         elif name == 'pstext':
             if self.fragment is None:
                 self.error('closing pstext tag without opening tag')
-            self.fragment.end(self.is_shared_pseudocode)
+            self.fragment.end()
             self.fragment = None
         elif self.fragment is not None:
             self.fragment.end_element(name)
 
+    # remember where the text of the current fragment starts
+    def mark_start(self):
+        if self.fragment.start is None:
+            self.fragment.start = (self.p.CurrentLineNumber,
+                                   self.p.CurrentColumnNumber)
+
     def CharacterDataHandler(self, data):
         # some files contain indentation errors
         if self.path.endswith('/mrs_br.xml'):
@@ -215,9 +392,11 @@ class FileProcessor:
             data = data.replace('     when ',
                                 '    when ')
         if self.fragment is not None:
+            self.mark_start()
             self.fragment.character_data(data)
 
     def error(self, msg, lineno = None):
+        self.errors += 1
         if lineno is None:
             lineno = self.p.CurrentLineNumber - 1
         sys.stderr.write('%s: error: %s\n' % (lineno + 1, msg))
@@ -226,23 +405,8 @@ def escape_html(s):
     return s.replace('&', '&amp;').replace('"', '&quot;') \
             .replace('<', '&lt;').replace('>', '&gt;')
 
-def main(base_dir):
-    sys.stderr.write('\x1b[s')
-
-    file_processors = [FileProcessor(base_dir, fn)
-                       for fn in sorted(os.listdir(base_dir))
-                       if fn[0] != '.' and fn.endswith('.xml')
-                                       and fn != 'onebigfile.xml']
-
-    #for l in ns.global_ns.dump():
-    #    print('| ' + l)
-
-    with Progress('resolving library'):
-        scope.process_namespace(ns.global_ns)
-
-    with Progress('writing output'):
-        with open('output.html', 'w') as f:
-            f.write('''\
+def write_header(f):
+    f.write('''\
 <!DOCTYPE html>
 <html>
   <head>
@@ -252,31 +416,819 @@ def main(base_dir):
   </head>
   <body>
 ''')
+
+def render_fragment(fragment):
+    out = []
+    if fragment.name is not None:
+        out.append('%s<br>\n' % escape_html(fragment.name))
+    out.append('<pre class="sect_%s">' % str(fragment.section).lower())
+    if fragment.body is not None:
+        for statement in fragment.body:
+            for l in statement.dump():
+                out.append(escape_html(l) + '\n')
+    elif fragment.expression is not None:
+        s = str(fragment.expression)
+        out.append(escape_html(s) + '\n')
+    else:
+        out.append('// empty\n')
+    out.append('</pre>\n')
+    return ''.join(out)
+
+def write_file(f, file_processor, fragments = None):
+    if fragments is None:
+        fragments = file_processor.fragments
+    with stats.phase('output', file_processor.fn) as ph:
+        f.write('<h3>%s</h3>\n' % file_processor.fn)
+        for fragment in fragments:
+            f.write(render_fragment(fragment))
+        ph.count('fragments', len(fragments))
+
+def write_footer(f):
+    f.write('</body></html>\n')
+
+def list_files(base_dir):
+    return [fn for fn in sorted(os.listdir(base_dir))
+            if fn[0] != '.' and fn.endswith('.xml')
+                            and fn != 'onebigfile.xml']
+
+def load_file(base_dir, fn, parse_cache = None, data = None):
+    file_processor = FileProcessor(base_dir, fn)
+    file_processor.load(parse_cache, data)
+    file_processor.process_declarations()
+    return file_processor
+
+# minimum amount of pseudocode (in characters) sent to a worker at once
+FRAGMENT_BATCH_SIZE = 16384
+
+# The workers send their metrics records back along with the results.
+
+def init_worker(record_stats, diagnostics_file):
+    Progress.enabled = False
+    stats.recorder = stats.Recorder() if record_stats else None
+    error.diagnostics_file = diagnostics_file
+
+def take_stats():
+    if stats.recorder is None:
+        return []
+    return stats.recorder.take()
+
+def merge_stats(records):
+    if stats.recorder is not None:
+        stats.recorder.records += records
+
+def parse_fragments_worker(batch):
+    return [parse_fragment(*work) for work in batch], take_stats()
+
+def parse_worker(base_dir, fn, parse_cache):
+    file_processor = FileProcessor(base_dir, fn)
+    if parse_cache is None:
+        file_processor.load()
+        return file_processor.export(), None, take_stats()
+    hits = parse_cache.hits
+    misses = parse_cache.misses
+    time_saved = parse_cache.time_saved
+    file_processor.load(parse_cache)
+    return file_processor.export(), (parse_cache.hits - hits,
+                                     parse_cache.misses - misses,
+                                     parse_cache.time_saved - time_saved), \
+           take_stats()
+
+# Load the given files and yield them in the order given.  With more
+# than one job, the files are parsed in a process pool, largest first,
+# and only the declarations are processed here, in the original order.
+# The shared pseudocode is on the critical path and much larger than
+# any other file, so its fragments are handed out individually, before
+# any other file.  If bounded is set, the files are parsed in the order
+# given instead, with at most two files per job in flight, so parsed
+# files don't pile up while the caller is busy with earlier ones.
+
+def load_files(base_dir, fns, parse_cache = None, jobs = 1,
+               pipelined = False, bounded = False):
+    if pipelined:
+        yield from load_files_pipelined(base_dir, fns, parse_cache)
+        return
+    if jobs == 1:
+        for fn in fns:
+            yield load_file(base_dir, fn, parse_cache)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer = init_worker,
+            initargs = (stats.recorder is not None,
+                        error.diagnostics_file)) as executor:
+        shared = None
+        if 'shared_pseudocode.xml' in fns:
+            shared = FileProcessor(base_dir, 'shared_pseudocode.xml')
+            shared.submit(executor, parse_cache)
+        others = [fn for fn in fns if fn != 'shared_pseudocode.xml']
+        if bounded:
+            limit = 2 * jobs
+        else:
+            others.sort(key = lambda fn: (
+                -os.path.getsize(os.path.join(base_dir, fn)), fn))
+            limit = len(others)
+        others.reverse()
+        futures = {}
+        def submit():
+            while others and len(futures) < limit:
+                fn = others.pop()
+                futures[fn] = executor.submit(
+                    parse_worker, base_dir, fn, parse_cache)
+        submit()
+        for fn in fns:
+            if fn == 'shared_pseudocode.xml':
+                shared.collect(parse_cache)
+                shared.process_declarations()
+                yield shared
+                continue
+            future = futures.pop(fn)
+            submit()
+            with Progress('processing %s' % fn):
+                states, cache_stats, records = future.result()
+            merge_stats(records)
+            file_processor = FileProcessor(base_dir, fn)
+            file_processor.restore(states)
+            file_processor.process_declarations()
+            if cache_stats is not None:
+                hits, misses, time_saved = cache_stats
+                parse_cache.hits += hits
+                parse_cache.misses += misses
+                parse_cache.time_saved += time_saved
+            yield file_processor
+
+def count_lookups(ph):
+    ph.count('lookup_cache_hits', ns.global_ns.cache_hits)
+    ph.count('lookup_cache_misses', ns.global_ns.cache_misses)
+
+# Resolving a function only reads the namespace, so with more than one
+# job, the library functions are resolved in forked worker processes
+# which inherit the namespace as it is after parsing.  The functions are
+# dealt out to the shards by size, and each worker captures the output
+# per function so it can be written here in the same order as when
+# resolving serially.  The workers send back the bindings they found,
+# which are then attached to the identifiers here.
+
+# number of shards per job
+RESOLVE_SHARDS = 4
+
+# a rough measure of the work it takes to resolve a function
+def function_size(function):
+    return sum(len(declaration.body)
+               for declaration in function.declarations
+               if declaration.body is not None)
+
+def resolve_worker(names):
+    hits = ns.global_ns.cache_hits
+    misses = ns.global_ns.cache_misses
+    results = []
+    with stats.phase('resolve') as ph:
+        for name in names:
+            out = io.StringIO()
+            function = ns.global_ns.members[name]
+            scope.process_declaration(function, out = out)
+            results.append((name, out.getvalue(), [
+                scope.pack_bindings(declaration.bindings)
+                for declaration in function.declarations]))
+        ph.count('functions', len(names))
+        ph.count('lookup_cache_hits', ns.global_ns.cache_hits - hits)
+        ph.count('lookup_cache_misses', ns.global_ns.cache_misses - misses)
+    return results, take_stats()
+
+def resolve_library(jobs = 1):
+    if jobs == 1:
+        with Progress('resolving library'), stats.phase('resolve') as ph:
+            scope.process_namespace(ns.global_ns)
+            count_lookups(ph)
+        return
+
+    names = [name for name, value in ns.global_ns.members.items()
+             if isinstance(value, ns.Function)]
+    shards = [[] for i in range(min(jobs * RESOLVE_SHARDS, len(names)))]
+    loads = [0] * len(shards)
+    for size, name in sorted(((function_size(ns.global_ns.members[name]),
+                               name) for name in names), reverse = True):
+        i = loads.index(min(loads))
+        shards[i].append(name)
+        loads[i] += size + 1
+
+    # build the name index once instead of in each worker
+    if scope.suggestions:
+        ns.finalize()
+
+    output = {}
+    with Progress('resolving library'):
+        with concurrent.futures.ProcessPoolExecutor(
+                jobs, mp_context = multiprocessing.get_context('fork'),
+                initializer = init_worker,
+                initargs = (stats.recorder is not None,
+                            error.diagnostics_file)) as executor:
+            for results, records in executor.map(resolve_worker, shards):
+                merge_stats(records)
+                for name, out, bindings in results:
+                    output[name] = out
+                    for declaration, packed in zip(
+                            ns.global_ns.members[name].declarations,
+                            bindings):
+                        scope.attach_bindings(
+                            declaration, scope.unpack_bindings(packed))
+    for name in sorted(output):
+        sys.stdout.write(output[name])
+
+# add the instruction fragments of a file to the call graph; the
+# library functions are added from the namespace
+def add_to_call_graph(graph, file_processor):
+    if file_processor.is_shared_pseudocode:
+        return
+    for fragment in file_processor.fragments:
+        name = fragment.name
+        if name is None:
+            name = file_processor.fn
+        if fragment.body is not None:
+            graph.add_body(name, fragment.body)
+        elif fragment.expression is not None:
+            graph.add_expression(name, fragment.expression)
+
+def main(base_dir, parse_cache = None, jobs = 1, pipelined = False,
+         graph = None):
+    sys.stderr.write('\x1b[s')
+    memprofile.checkpoint('start')
+
+    file_processors = list(load_files(base_dir, list_files(base_dir),
+                                      parse_cache, jobs, pipelined))
+    memprofile.checkpoint('parsed')
+    if graph is not None:
+        graph.add_namespace(ns.global_ns)
+        for file_processor in file_processors:
+            add_to_call_graph(graph, file_processor)
+
+    #for l in ns.global_ns.dump():
+    #    print('| ' + l)
+
+    resolve_library(jobs)
+    memprofile.checkpoint('resolved')
+
+    with Progress('writing output'):
+        with open('output.html', 'w') as f:
+            write_header(f)
             for file_processor in file_processors:
-                f.write('<h3>%s</h3>\n' % file_processor.fn)
-                for fragment in file_processor.fragments:
-                    if fragment.name is not None:
-                        f.write('%s<br>\n' % escape_html(fragment.name))
-                    f.write('<pre class="sect_%s">'
-                              % str(fragment.section).lower())
-                    if fragment.body is not None:
-                        for statement in fragment.body:
-                            for l in statement.dump():
-                                f.write(escape_html(l) + '\n')
-                    elif fragment.expression is not None:
-                        s = str(fragment.expression)
-                        f.write(escape_html(s) + '\n')
-                    else:
-                        f.write('// empty\n')
-                    f.write('</pre>\n')
-
-            f.write('</body></html>\n')
+                write_file(f, file_processor)
+            write_footer(f)
+    memprofile.checkpoint('written')
+
+# Only shared_pseudocode.xml takes part in resolution, so it is parsed
+# first and kept; every other file is written out as soon as it has
+# been parsed and dropped again.  The output is the same as above.
+# The other files are only loaded after resolving: with more than one
+# job, resolve_library() forks, which mustn't happen while the worker
+# threads of another process pool are running.
+
+def main_stream(base_dir, parse_cache = None, jobs = 1, pipelined = False,
+                graph = None):
+    sys.stderr.write('\x1b[s')
+    memprofile.checkpoint('start')
+
+    fns = list_files(base_dir)
+    others = [fn for fn in fns if fn != 'shared_pseudocode.xml']
+    shared = None
+    if 'shared_pseudocode.xml' in fns:
+        shared, = load_files(base_dir, ['shared_pseudocode.xml'],
+                             parse_cache, jobs, pipelined)
+    memprofile.checkpoint('parsed shared pseudocode')
+    if graph is not None:
+        graph.add_namespace(ns.global_ns)
+
+    resolve_library(jobs)
+    memprofile.checkpoint('resolved')
+
+    file_processors = load_files(base_dir, others, parse_cache, jobs,
+                                 pipelined, bounded = True)
+
+    with open('output.html', 'w') as f:
+        write_header(f)
+        for fn in fns:
+            if fn == 'shared_pseudocode.xml':
+                write_file(f, shared)
+            else:
+                file_processor = next(file_processors)
+                if graph is not None:
+                    add_to_call_graph(graph, file_processor)
+                write_file(f, file_processor)
+            f.flush()
+        write_footer(f)
+
+    # let the loader finish up (and shut down its workers)
+    rest = list(file_processors)
+    assert not rest
+    memprofile.checkpoint('written')
+
+# Only the instruction files matching one of the given patterns are
+# parsed, and only those library functions are resolved and written
+# which can be reached from them through function calls and accessors.
+# Other library declarations (variables, types, accessors, ...) are
+# always written.
+
+def reached_fragment(fragment, reached):
+    if fragment.body is None:
+        return True
+    for declaration in fragment.body:
+        if not isinstance(declaration, decl.Function) or \
+           declaration.functype != decl.FUNCTION or \
+           '.'.join(str(part) for part in declaration.name) in reached:
+            return True
+    return False
+
+def main_select(base_dir, patterns, parse_cache = None, jobs = 1,
+                pipelined = False):
+    sys.stderr.write('\x1b[s')
+    start = time.perf_counter()
+    memprofile.checkpoint('start')
+
+    fns = list_files(base_dir)
+    selected = [fn for fn in fns
+                if fn == 'shared_pseudocode.xml' or
+                   any(fnmatch.fnmatch(fn, pattern) for pattern in patterns)]
+    file_processors = list(load_files(base_dir, selected,
+                                      parse_cache, jobs, pipelined))
+    memprofile.checkpoint('parsed')
+
+    calls = set()
+    shared = None
+    for file_processor in file_processors:
+        if file_processor.is_shared_pseudocode:
+            shared = file_processor
+            continue
+        for fragment in file_processor.fragments:
+            if fragment.body is not None:
+                calls |= callgraph.body_calls(fragment.body)
+            elif fragment.expression is not None:
+                callgraph.expression_calls(fragment.expression, calls)
+    reached = callgraph.reachable(calls)
+
+    functions = [(name, value)
+                 for name, value in sorted(ns.global_ns.members.items())
+                 if isinstance(value, ns.Function)]
+    with Progress('resolving library'), stats.phase('resolve') as ph:
+        for name, value in functions:
+            if name in reached:
+                scope.process_declaration(value)
+        count_lookups(ph)
+    memprofile.checkpoint('resolved')
+
+    shared_fragments = []
+    if shared is not None:
+        shared_fragments = [fragment for fragment in shared.fragments
+                            if reached_fragment(fragment, reached)]
+
+    with Progress('writing output'):
+        with open('output.html', 'w') as f:
+            write_header(f)
+            for file_processor in file_processors:
+                if file_processor is shared:
+                    write_file(f, shared, shared_fragments)
+                else:
+                    write_file(f, file_processor)
+            write_footer(f)
+    memprofile.checkpoint('written')
+
+    skipped_bytes = sum(os.path.getsize(os.path.join(base_dir, fn))
+                        for fn in fns if fn not in selected)
+    resolved = sum(1 for name, value in functions if name in reached)
+    total_fragments = len(shared.fragments) if shared is not None else 0
+    sys.stderr.write(
+        'select: parsed %d of %d instruction files (%d bytes skipped), '
+        'resolved %d of %d library functions, wrote %d of %d shared '
+        'pseudocode fragments (%d%% skipped), %.2fs\n' % (
+            len(selected) - (shared is not None),
+            len(fns) - ('shared_pseudocode.xml' in fns), skipped_bytes,
+            resolved, len(functions),
+            len(shared_fragments), total_fragments,
+            100 * (total_fragments - len(shared_fragments))
+                // total_fragments if total_fragments else 0,
+            time.perf_counter() - start))
+
+# Threaded pipeline: one stage reads the files, one runs expat over
+# them and one tokenizes and parses the fragments, connected by bounded
+# queues, so reading can overlap with parsing.
+
+def load_files_pipelined(base_dir, fns, parse_cache = None):
+    def read(fn):
+        with open(os.path.join(base_dir, fn), 'rb') as f:
+            return fn, f.read()
+
+    def run_expat(item):
+        fn, data = item
+        file_processor = FileProcessor(base_dir, fn)
+        if file_processor.prepare(data, parse_cache):
+            return file_processor, file_processor.pending_fragments()
+        return file_processor, None
+
+    def parse(item):
+        file_processor, work = item
+        if work is not None:
+            file_processor.finish([parse_fragment(*args) for args in work],
+                                  parse_cache)
+        return file_processor
+
+    p = pipeline.Pipeline(fns, [
+        ('read', read, 16, 1),
+        ('xml', run_expat, 4, 1),
+        ('parse', parse, 4, 1),
+    ])
+    for file_processor in p:
+        file_processor.process_declarations()
+        yield file_processor
+    p.report()
+
+# Incremental rebuilds
+#
+# The state directory holds a manifest of all input files (content hash
+# plus rendered HTML), the rendered HTML of each shared pseudocode
+# fragment keyed by its source digest, a fingerprint of every name in
+# the namespace, and for each library function the fingerprint of its
+# declarations, the global names its resolution looked up (found or
+# not) and the diagnostics it printed.
+#
+# Only files whose contents changed are reparsed.  If the shared
+# pseudocode changed, the namespace is rebuilt from it, and only those
+# functions are resolved again whose own declarations changed or which
+# depend on a name whose definition changed; for the others, the stored
+# diagnostics are replayed.  Only fragments with new source text are
+# rendered again.
+
+def describe_namespace(namespace, prefix = ''):
+    names = {}
+    for name, value in namespace.members.items():
+        if isinstance(value, ns.Namespace):
+            names.update(describe_namespace(value, prefix + name + '.'))
+        elif isinstance(value, ns.Function):
+            names[prefix + name] = ('function', tuple(
+                ns.signature(declaration)
+                for declaration in value.declarations))
+        elif isinstance(value, ns.Accessor):
+            names[prefix + name] = ('accessor', value.getter is not None,
+                                                value.setter is not None)
+        else:
+            names[prefix + name] = value.__class__.__name__
+    return names
+
+def fingerprint_function(function):
+    h = hashlib.sha1()
+    for declaration in function.declarations:
+        for l in declaration.dump():
+            h.update(l.encode() + b'\n')
+    return h.hexdigest()
+
+def main_incremental(base_dir, state_dir):
+    sys.stderr.write('\x1b[s')
+    memprofile.checkpoint('start')
+
+    version = cache.source_version(__file__)
+    state_path = os.path.join(state_dir, 'state.pickle')
+    try:
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        state = None
+    if state is None or state['version'] != version:
+        state = {
+            'version': version,
+            'files': {},
+            'fragments': {},
+            'names': {},
+            'resolution': {},
+        }
+
+    fns = list_files(base_dir)
+    files = {}
+    shared = None
+    reparsed = 0
+    for fn in fns:
+        with open(os.path.join(base_dir, fn), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        if fn in state['files'] and state['files'][fn][0] == digest:
+            files[fn] = state['files'][fn]
+            continue
+        reparsed += 1
+        file_processor = load_file(base_dir, fn, data = data)
+        if file_processor.is_shared_pseudocode:
+            shared = file_processor
+            files[fn] = digest, None
+        else:
+            with Progress('writing %s' % fn):
+                out = io.StringIO()
+                write_file(out, file_processor)
+            files[fn] = digest, out.getvalue()
+    memprofile.checkpoint('parsed')
+
+    if shared is None and 'shared_pseudocode.xml' in files:
+        # library unchanged
+        fragments = state['fragments']
+        names = state['names']
+        resolution = state['resolution']
+        for name, (fingerprint, dependencies, diagnostics) \
+                in sorted(resolution.items()):
+            sys.stdout.write(diagnostics)
+        resolved = 0
+        rendered = 0
+    else:
+        names = describe_namespace(ns.global_ns)
+        changed = set(name for name in names.keys() | state['names'].keys()
+                      if names.get(name) != state['names'].get(name))
+
+        resolution = {}
+        resolved = 0
+        with Progress('resolving library'), stats.phase('resolve') as ph:
+            for name, value in sorted(ns.global_ns.members.items()):
+                if not isinstance(value, ns.Function):
+                    continue
+                fingerprint = fingerprint_function(value)
+                try:
+                    old_fingerprint, dependencies, diagnostics = \
+                        state['resolution'][name]
+                except KeyError:
+                    pass
+                else:
+                    if old_fingerprint == fingerprint and \
+                       dependencies.isdisjoint(changed):
+                        sys.stdout.write(diagnostics)
+                        resolution[name] = \
+                            fingerprint, dependencies, diagnostics
+                        continue
+                resolved += 1
+                out = io.StringIO()
+                dependencies = scope.process_declaration(value, out = out)
+                sys.stdout.write(out.getvalue())
+                resolution[name] = fingerprint, dependencies, out.getvalue()
+            count_lookups(ph)
+
+        fragments = {}
+        rendered = 0
+        if shared is not None:
+            with Progress('writing shared_pseudocode.xml'):
+                for fragment in shared.fragments:
+                    try:
+                        fragments[fragment.digest] = \
+                            state['fragments'][fragment.digest]
+                    except KeyError:
+                        fragments[fragment.digest] = render_fragment(fragment)
+                        rendered += 1
+            files['shared_pseudocode.xml'] = \
+                files['shared_pseudocode.xml'][0], \
+                '<h3>shared_pseudocode.xml</h3>\n' + ''.join(
+                    fragments[fragment.digest]
+                    for fragment in shared.fragments)
+    memprofile.checkpoint('resolved')
+
+    with Progress('writing output'):
+        with open('output.html', 'w') as f:
+            write_header(f)
+            for fn in fns:
+                f.write(files[fn][1])
+            write_footer(f)
+
+    state = {
+        'version': version,
+        'files': files,
+        'fragments': fragments,
+        'names': names,
+        'resolution': resolution,
+    }
+    os.makedirs(state_dir, exist_ok = True)
+    with open(state_path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(state_path + '.tmp', state_path)
+    memprofile.checkpoint('written')
+
+    sys.stderr.write(
+        'incremental: reparsed %d of %d files, resolved %d of %d functions, '
+        'rendered %d of %d fragments\n' % (
+            reparsed, len(fns), resolved, len(resolution),
+            rendered, len(fragments)))
+
+# A specification loaded as a library, with its own namespace and
+# resolution results, so several of them can be loaded in one process:
+#
+#     spec = load_spec('path/to/ISA_v85A_A64_xml_00bet9/', threads = 4)
+#     spec.namespace.index[('AArch64', 'TakeReset')]
+#     dependencies, diagnostics = spec.resolution['ConditionHolds']
+#
+# With more than one thread, the files are parsed in a thread pool;
+# the declarations are still added to the namespace in file order.
+# Nothing is shared between Spec objects, so they can be loaded and
+# resolved in different threads at the same time.
+
+class Spec:
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.namespace = ns.Namespace()
+        self.file_processors = []
+        self.resolution = {}
+
+    def load(self, threads = 1, parse_cache = None):
+        def load(fn):
+            file_processor = FileProcessor(self.base_dir, fn)
+            # the messages of several threads would get mixed up
+            file_processor.progress = threads == 1
+            file_processor.load(parse_cache)
+            return file_processor
+
+        fns = list_files(self.base_dir)
+        if threads == 1:
+            self.file_processors = [load(fn) for fn in fns]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+                self.file_processors = list(executor.map(load, fns))
+        for file_processor in self.file_processors:
+            file_processor.process_declarations(self.namespace)
+        ns.finalize(self.namespace)
+
+    def resolve(self):
+        for name, value in sorted(self.namespace.members.items()):
+            if not isinstance(value, ns.Function):
+                continue
+            out = io.StringIO()
+            dependencies = scope.process_declaration(value, self.namespace,
+                                                     out)
+            self.resolution[name] = dependencies, out.getvalue()
+
+    # a hash over the source text of all fragments
+    def digest(self):
+        h = hashlib.sha1()
+        for file_processor in self.file_processors:
+            h.update(file_processor.fn.encode() + b'\0')
+            for fragment in file_processor.fragments:
+                h.update(fragment.digest.encode())
+        return h.hexdigest()
+
+    # (name, bodies) for each decode fragment, the bodies being the
+    # decode fragment followed by the postdecode and execute fragments
+    # of the same file; repeated names get '#2', '#3', ... appended
+    def instructions(self):
+        instructions = []
+        names = {}
+        for file_processor in self.file_processors:
+            fragments = file_processor.fragments
+            shared = [fragment.body for fragment in fragments
+                      if fragment.section in {'Postdecode', 'Execute'}
+                         and fragment.body is not None]
+            for fragment in fragments:
+                if fragment.section == 'Decode' and \
+                   fragment.body is not None:
+                    n = names[fragment.name] = \
+                        names.get(fragment.name, 0) + 1
+                    name = fragment.name if n == 1 \
+                                         else '%s#%d' % (fragment.name, n)
+                    instructions.append((name, [fragment.body] + shared))
+        return instructions
+
+    # the library functions and instructions translated to Python (see
+    # pseudocode/codegen.py), cached in the directory path if given
+    def semantics(self, path = None, state = None):
+        return codegen.load(self.namespace, self.instructions(),
+                            self.digest(), path, state)
+
+def load_spec(base_dir, threads = 1, parse_cache = None):
+    spec = Spec(base_dir)
+    spec.load(threads, parse_cache)
+    spec.resolve()
+    return spec
+
+def usage():
+    sys.stderr.write(
+        "Usage: %s [OPTIONS] path/to/ISA_v85A_AArch32_xml_00bet9/\n"
+            % sys.argv[0])
+    sys.stderr.write(
+        "       %s [OPTIONS] path/to/ISA_v85A_A64_xml_00bet9/\n"
+            % sys.argv[0])
+    sys.stderr.write('''
+Options:
+  --stream      write each file as soon as it has been parsed
+  --cache=DIR   keep parsed files in DIR and reuse them on later runs
+  --incremental=DIR
+                keep build state in DIR and only redo what changed
+  --jobs=N      parse files and resolve the library in N worker processes
+  --pipeline    read, run expat on and parse files in separate threads
+  --stats=json  write per-phase and per-file metrics to stats.json
+  --trace=FILE  write a Chrome trace event file of all phases to FILE
+  --memprofile  report memory use and live objects between phases
+  --diagnostics=FILE
+                append a JSON record of lex and parse errors to FILE
+  --bindings=FILE
+                write what each name in each library function refers to
+                to FILE (as JSON)
+  --callgraph=FILE
+                write the call graph of the library functions and the
+                instruction fragments to FILE, see pseudocode/callgraph.py
+  --select=PATTERN
+                only process the instruction files matching PATTERN
+                (e.g. 'sve*'; can be given more than once) and the
+                library functions they can reach
+  --suggest=N   list up to N similar names when a name can't be looked up
+''')
+    sys.exit(1)
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2 or sys.argv[1].startswith('-'):
-        sys.stderr.write(
-            "Usage: %s path/to/ISA_v85A_AArch32_xml_00bet9/\n" % sys.argv[0])
-        sys.stderr.write(
-            "       %s path/to/ISA_v85A_A64_xml_00bet9/\n" % sys.argv[0])
-        sys.exit(1)
-    main(sys.argv[1])
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', [
+            'stream', 'cache=', 'incremental=', 'jobs=', 'pipeline',
+            'stats=', 'trace=', 'memprofile', 'diagnostics=', 'bindings=',
+            'callgraph=', 'select=', 'suggest='])
+    except getopt.GetoptError as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    if len(args) != 1:
+        usage()
+    stream = False
+    parse_cache = None
+    state_dir = None
+    jobs = 1
+    pipelined = False
+    stats_fn = None
+    trace_fn = None
+    bindings_fn = None
+    graph_fn = None
+    patterns = []
+    for opt, arg in opts:
+        if opt == '--stream':
+            stream = True
+        elif opt == '--cache':
+            parse_cache = cache.Cache(arg, cache.source_version(__file__))
+        elif opt == '--incremental':
+            state_dir = arg
+        elif opt == '--jobs':
+            try:
+                jobs = int(arg)
+            except ValueError:
+                jobs = 0
+            if jobs < 1:
+                sys.stderr.write('%s: invalid number of jobs: %s\n' % (
+                    sys.argv[0], arg))
+                usage()
+        elif opt == '--pipeline':
+            pipelined = True
+        elif opt == '--stats':
+            if arg != 'json':
+                sys.stderr.write('%s: unsupported stats format: %s\n' % (
+                    sys.argv[0], arg))
+                usage()
+            stats_fn = 'stats.json'
+        elif opt == '--trace':
+            trace_fn = arg
+        elif opt == '--memprofile':
+            memprofile.profiler = memprofile.Profiler()
+        elif opt == '--diagnostics':
+            error.diagnostics_file = arg
+        elif opt == '--bindings':
+            bindings_fn = arg
+        elif opt == '--callgraph':
+            graph_fn = arg
+        elif opt == '--select':
+            patterns.append(arg)
+        elif opt == '--suggest':
+            try:
+                scope.suggestions = int(arg)
+            except ValueError:
+                scope.suggestions = -1
+            if scope.suggestions < 0:
+                sys.stderr.write('%s: invalid number of suggestions: %s\n'
+                                 % (sys.argv[0], arg))
+                usage()
+    if state_dir is not None and (bindings_fn is not None or
+                                  graph_fn is not None or
+                                  scope.suggestions):
+        sys.stderr.write('%s: --bindings, --callgraph and --suggest can\'t '
+                         'be used with --incremental\n' % sys.argv[0])
+        usage()
+    if patterns and (state_dir is not None or stream or
+                     graph_fn is not None):
+        sys.stderr.write('%s: --select can\'t be used with --incremental, '
+                         '--stream or --callgraph\n' % sys.argv[0])
+        usage()
+    if stats_fn is not None or trace_fn is not None:
+        stats.recorder = stats.Recorder()
+    graph = callgraph.CallGraph() if graph_fn is not None else None
+    if state_dir is not None:
+        main_incremental(args[0], state_dir)
+    elif patterns:
+        main_select(args[0], patterns, parse_cache, jobs, pipelined)
+    elif stream:
+        main_stream(args[0], parse_cache, jobs, pipelined, graph)
+    else:
+        main(args[0], parse_cache, jobs, pipelined, graph)
+    if graph is not None:
+        with stats.phase('callgraph'):
+            graph.finish()
+        graph.save(graph_fn)
+    if bindings_fn is not None:
+        with open(bindings_fn, 'w') as f:
+            json.dump(scope.binding_table(ns.global_ns), f, indent = 1)
+            f.write('\n')
+    if parse_cache is not None:
+        parse_cache.report()
+    if memprofile.profiler is not None:
+        memprofile.profiler.report()
+    if stats_fn is not None:
+        stats.recorder.write_json(stats_fn)
+    if trace_fn is not None:
+        stats.recorder.write_trace(trace_fn)
@@ -19,12 +19,24 @@ from .error import LexError, ParseError
 __all__ = [
     'LexError',
     'ParseError',
+    'bits',
+    'cache',
+    'callgraph',
+    'codegen',
     'decl',
     'dtype',
+    'error',
+    'evaluate',
     'expr',
+    'memprofile',
     'ns',
+    'pipeline',
+    'runtime',
     'scope',
+    'stats',
     'stmt',
     'token',
+    'trigram',
     'tstream',
+    'xref',
 ]
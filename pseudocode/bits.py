@@ -0,0 +1,197 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Fixed-width bitvectors for bits(N)
+#
+# A Bits is an unsigned Python int together with its width; the value
+# is always masked to the width, so equal bitvectors have equal
+# values and the operations never go through strings.  The masks for
+# the widths which occur in practice are looked up in a table instead
+# of being computed for each operation.
+#
+# Operations whose result is known to fit (AND, slices, concatenation,
+# ...) build the result with make(), which skips the masking.
+#
+# Bitvector literals may contain 'x' for "don't care" bits; these are
+# Pattern objects, which can only be matched against.
+
+# (1 << n) - 1 for all widths up to MASK_TABLE_SIZE
+MASK_TABLE_SIZE = 1024
+MASKS = [(1 << n) - 1 for n in range(MASK_TABLE_SIZE + 1)]
+
+def mask(n):
+    if 0 <= n <= MASK_TABLE_SIZE:
+        return MASKS[n]
+    if n < 0:
+        raise ValueError('negative width %d' % n)
+    return (1 << n) - 1
+
+class Bits:
+    __slots__ = ('value', 'width')
+
+    def __init__(self, value, width):
+        self.value = value & (MASKS[width] if 0 <= width <= MASK_TABLE_SIZE
+                                           else mask(width))
+        self.width = width
+
+    def __eq__(self, other):
+        return isinstance(other, Bits) and self.value == other.value \
+                                       and self.width == other.width
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.value, self.width))
+
+    # arithmetic wraps around; the other operand may be an integer
+
+    def __add__(self, other):
+        if isinstance(other, Bits):
+            other = other.value
+        return Bits(self.value + other, self.width)
+
+    def __sub__(self, other):
+        if isinstance(other, Bits):
+            other = other.value
+        return Bits(self.value - other, self.width)
+
+    def __and__(self, other):
+        return make(self.value & other.value, self.width)
+
+    def __or__(self, other):
+        return make(self.value | other.value, self.width)
+
+    def __xor__(self, other):
+        return make(self.value ^ other.value, self.width)
+
+    def __invert__(self):
+        return make(self.value ^ mask(self.width), self.width)
+
+    def __lshift__(self, n):
+        return Bits(self.value << n, self.width)
+
+    def __rshift__(self, n):
+        return make(self.value >> n, self.width)
+
+    def __str__(self):
+        return "'%s'" % to_string(self)
+
+    __repr__ = __str__
+
+    def __reduce__(self):
+        return make, (self.value, self.width)
+
+# a Bits whose value is known to fit into the width
+def make(value, width, new = object.__new__, cls = Bits):
+    x = new(cls)
+    x.value = value
+    x.width = width
+    return x
+
+# the bits as a string of '0' and '1'
+def to_string(x):
+    return format(x.value, '0%db' % x.width) if x.width else ''
+
+def from_string(data):
+    data = data.replace(' ', '')
+    return make(int(data, 2) if data else 0, len(data))
+
+class Pattern:
+    __slots__ = ('mask', 'value', 'width')
+
+    def __init__(self, data):
+        data = data.replace(' ', '')
+        self.mask = 0
+        self.value = 0
+        self.width = len(data)
+        for ch in data:
+            self.mask <<= 1
+            self.value <<= 1
+            if ch != 'x':
+                self.mask |= 1
+                self.value |= ch == '1'
+
+    def matches(self, x):
+        return x.width == self.width and x.value & self.mask == self.value
+
+    def __str__(self):
+        return "'%s'" % ''.join(
+            'x' if not self.mask >> i & 1 else '01'[self.value >> i & 1]
+            for i in range(self.width - 1, -1, -1))
+
+    __repr__ = __str__
+
+literals = {}
+
+# the Bits or Pattern for the text of a token.Bitvector
+def literal(data):
+    try:
+        return literals[data]
+    except KeyError:
+        pass
+    if 'x' in data:
+        value = Pattern(data)
+    else:
+        value = from_string(data)
+    literals[data] = value
+    return value
+
+# x<hi:lo>; x may also be an integer
+def extract(x, hi, lo):
+    if isinstance(x, Bits):
+        x = x.value
+    width = hi - lo + 1
+    return make(x >> lo & mask(width), width)
+
+# x<hi:lo> = y; x may also be an integer
+def insert(x, hi, lo, y):
+    m = mask(hi - lo + 1) << lo
+    if isinstance(x, Bits):
+        return make(x.value & ~m | y.value << lo & m, x.width)
+    return x & ~m | y.value << lo & m
+
+def concat(x, y):
+    return make(x.value << y.width | y.value, x.width + y.width)
+
+def replicate(x, n):
+    if n < 0:
+        raise ValueError('negative count %d' % n)
+    value = 0
+    if x.width == 1:
+        if x.value:
+            value = mask(n)
+    else:
+        for i in range(n):
+            value = value << x.width | x.value
+    return make(value, x.width * n)
+
+def sint(x):
+    if x.width and x.value >> x.width - 1:
+        return x.value - (1 << x.width)
+    return x.value
+
+def zero_extend(x, n):
+    return Bits(x.value, n)
+
+def sign_extend(x, n):
+    return Bits(sint(x), n)
+
+def ror(x, n):
+    if x.width == 0:
+        return x
+    n %= x.width
+    return Bits(x.value >> n | x.value << x.width - n, x.width)
@@ -0,0 +1,91 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+# Entries are keyed by a hash over the file name, the file contents and
+# the parser version.  The parser version is a hash over the source of
+# this package (plus any additional files the caller passes, e.g. the
+# main program), so changing the parser invalidates the whole cache.
+
+def source_version(*extra_files):
+    h = hashlib.sha1()
+    d = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(d, fn) for fn in sorted(os.listdir(d))
+                                 if fn.endswith('.py')]
+    for path in paths + list(extra_files):
+        with open(path, 'rb') as f:
+            h.update(os.path.basename(path).encode() + b'\0')
+            h.update(f.read())
+    return h.hexdigest()
+
+class Cache:
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.
+
+    def key(self, fn, data):
+        h = hashlib.sha1()
+        h.update(self.version.encode() + b'\0')
+        h.update(os.path.basename(fn).encode() + b'\0')
+        h.update(data)
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.pickle')
+
+    def load(self, key):
+        start = time.perf_counter()
+        try:
+            with open(self._entry_path(key), 'rb') as f:
+                parse_time, value = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, ValueError):
+            # treat damaged or stale entries as a miss
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.time_saved += parse_time - (time.perf_counter() - start)
+        return value
+
+    def store(self, key, value, parse_time):
+        path = self._entry_path(key)
+        try:
+            data = pickle.dumps((parse_time, value), pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        # write to a temporary file first so concurrent readers never
+        # see a partially written entry
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def report(self):
+        sys.stderr.write('parse cache: %d hits, %d misses, %.2fs saved\n' % (
+            self.hits, self.misses, self.time_saved))
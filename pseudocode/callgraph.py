@@ -0,0 +1,360 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import getopt
+import os
+import pickle
+import sys
+
+from . import expr, stmt, dtype, ns
+
+# Call graph of the library functions and the instruction fragments
+#
+# The nodes are the library functions (one node for all overloads of a
+# name), the accessors (one node for the getter and setter) and the
+# fragments added by the caller; there is an edge for each function
+# called from a body by a function call statement or a '()' call
+# expression whose name can be found in the namespace, and for each
+# accessor which is read or assigned to.
+#
+# After all nodes have been added, finish() computes for each node the
+# set of nodes it can reach, as an int with one bit per node.  This is
+# done once per strongly connected component, in the order in which
+# Tarjan's algorithm finds them, which is callees first, so queries are
+# just a few bit operations.
+
+class CallGraph:
+    def __init__(self):
+        self.names = []
+        self.is_function = []
+        self.index = {}
+        self.edges = []
+        self.reach = None
+
+    def node(self, name, is_function = False):
+        try:
+            return self.index[name]
+        except KeyError:
+            pass
+        i = len(self.names)
+        self.index[name] = i
+        self.names.append(name)
+        self.is_function.append(is_function)
+        self.edges.append(set())
+        return i
+
+    def add_namespace(self, namespace, prefix = ''):
+        for name, value in sorted(namespace.members.items()):
+            if isinstance(value, ns.Namespace):
+                self.add_namespace(value, prefix + name + '.')
+            elif isinstance(value, ns.Function) or \
+                 isinstance(value, ns.Accessor):
+                i = self.node(prefix + name, True)
+                for declaration in declarations(value):
+                    if declaration.body is not None:
+                        self.add_calls(i, body_calls(declaration.body))
+
+    def add_body(self, name, body):
+        self.add_calls(self.node(name), body_calls(body))
+
+    def add_expression(self, name, expression):
+        calls = set()
+        expression_calls(expression, calls)
+        self.add_calls(self.node(name), calls)
+
+    def add_calls(self, i, calls):
+        # sorted, so the node numbers don't depend on string hashing
+        for name in sorted(calls):
+            self.edges[i].add(self.node(name, True))
+
+    def finish(self):
+        self.reach = [0] * len(self.names)
+        for component in strongly_connected_components(self.edges):
+            bits = 0
+            for i in component:
+                for j in self.edges[i]:
+                    bits |= self.reach[j] | 1 << j
+            for i in component:
+                self.reach[i] = bits
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((self.names, self.is_function,
+                         [sorted(e) for e in self.edges], self.reach),
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def callees(self, name):
+        return self.nodes(self.reach[self.index[name]])
+
+    # nodes which call the given node, directly or indirectly
+    def callers(self, name, functions = True, fragments = True):
+        bit = 1 << self.index[name]
+        return [self.names[i] for i, bits in enumerate(self.reach)
+                if bits & bit and (functions if self.is_function[i]
+                                             else fragments)]
+
+    def reaches(self, caller, callee):
+        return bool(self.reach[self.index[caller]] >> self.index[callee] & 1)
+
+    def nodes(self, bits):
+        names = []
+        while bits:
+            low = bits & -bits
+            names.append(self.names[low.bit_length() - 1])
+            bits ^= low
+        return names
+
+def load(path):
+    graph = CallGraph()
+    with open(path, 'rb') as f:
+        graph.names, graph.is_function, edges, graph.reach = pickle.load(f)
+    graph.edges = [set(e) for e in edges]
+    graph.index = {name: i for i, name in enumerate(graph.names)}
+    return graph
+
+# Tarjan's algorithm, without recursion since call chains can be long
+def strongly_connected_components(edges):
+    index = [None] * len(edges)
+    lowlink = [0] * len(edges)
+    on_stack = [False] * len(edges)
+    stack = []
+    components = []
+    counter = 0
+    for root in range(len(edges)):
+        if index[root] is not None:
+            continue
+        work = [(root, iter(edges[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            v, successors = work[-1]
+            for w in successors:
+                if index[w] is None:
+                    index[w] = lowlink[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, iter(edges[w])))
+                    break
+                if on_stack[w]:
+                    lowlink[v] = min(lowlink[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    lowlink[u] = min(lowlink[u], lowlink[v])
+                if lowlink[v] == index[v]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component.append(w)
+                        if w == v:
+                            break
+                    components.append(component)
+    return components
+
+# The library functions and accessors which can be reached from the
+# given calls (qualified names as returned by callee()).  Unlike
+# CallGraph, this only looks at the bodies of the functions it reaches.
+def reachable(calls):
+    reached = set()
+    pending = list(calls)
+    while pending:
+        name = pending.pop()
+        if name in reached:
+            continue
+        reached.add(name)
+        for declaration in declarations(ns.lookup(name.split('.'))):
+            if declaration.body is not None:
+                pending.extend(body_calls(declaration.body) - reached)
+    return reached
+
+# the declarations of a function, or the getter and setter of an accessor
+def declarations(value):
+    if isinstance(value, ns.Accessor):
+        return [declaration for declaration in [value.getter, value.setter]
+                if declaration is not None]
+    return value.declarations
+
+# the qualified name of the function called by a call expression, or
+# None if it isn't a library function; with accessor set, the name of
+# the accessor used by an index expression or identifier instead
+def callee(func, accessor = False):
+    parts = []
+    while isinstance(func, expr.QualifiedIdentifier):
+        parts.insert(0, func.name)
+        func = func.expression
+    if not isinstance(func, expr.Identifier):
+        return None
+    parts.insert(0, func.name)
+    # not ns.lookup(), which asserts that the name isn't a namespace
+    # (the leading part of a qualified global variable is one)
+    value = ns.global_ns.index.get(ns.qualified_name(parts))
+    if not isinstance(value, ns.Accessor if accessor else ns.Function):
+        return None
+    return '.'.join(str(part) for part in parts)
+
+def body_calls(body):
+    calls = set()
+    for statement in body:
+        statement_calls(statement, calls)
+    return calls
+
+def statement_calls(statement, calls):
+    if isinstance(statement, stmt.Assignment):
+        expression_calls(statement.lhs, calls)
+        expression_calls(statement.expression, calls)
+    elif isinstance(statement, stmt.ConstantAssignment):
+        datatype_calls(statement.datatype, calls)
+        expression_calls(statement.expression, calls)
+    elif isinstance(statement, stmt.Declaration):
+        datatype_calls(statement.datatype, calls)
+        for lhs, expression in statement.variables:
+            if expression is not None:
+                expression_calls(expression, calls)
+    elif isinstance(statement, stmt.FunctionCall):
+        name = callee(statement.func)
+        if name is not None:
+            calls.add(name)
+        for arg in statement.args:
+            expression_calls(arg, calls)
+    elif isinstance(statement, stmt.If):
+        expression_calls(statement.expression, calls)
+        for s in statement.then_body:
+            statement_calls(s, calls)
+        for s in statement.else_body:
+            statement_calls(s, calls)
+    elif isinstance(statement, stmt.For):
+        expression_calls(statement.start, calls)
+        expression_calls(statement.stop, calls)
+        for s in statement.body:
+            statement_calls(s, calls)
+    elif isinstance(statement, stmt.While) or \
+         isinstance(statement, stmt.Repeat):
+        expression_calls(statement.condition, calls)
+        for s in statement.body:
+            statement_calls(s, calls)
+    elif isinstance(statement, stmt.Case):
+        expression_calls(statement.expression, calls)
+        for clause in statement.clauses:
+            for s in clause.body:
+                statement_calls(s, calls)
+    elif isinstance(statement, stmt.Assert):
+        expression_calls(statement.expression, calls)
+    elif isinstance(statement, stmt.Return):
+        if statement.value is not None:
+            expression_calls(statement.value, calls)
+
+def expression_calls(expression, calls):
+    if isinstance(expression, expr.Arguments):
+        if expression.method == '()':
+            name = callee(expression.func)
+            if name is not None:
+                calls.add(name)
+        else:
+            name = callee(expression.func, True)
+            if name is not None:
+                calls.add(name)
+            else:
+                expression_calls(expression.func, calls)
+        for arg in expression.args:
+            if isinstance(arg, tuple):
+                expression_calls(arg[0], calls)
+                expression_calls(arg[2], calls)
+            else:
+                expression_calls(arg, calls)
+    elif isinstance(expression, expr.Identifier):
+        name = callee(expression, True)
+        if name is not None:
+            calls.add(name)
+    elif isinstance(expression, expr.QualifiedIdentifier):
+        name = callee(expression, True)
+        if name is not None:
+            calls.add(name)
+        else:
+            expression_calls(expression.expression, calls)
+    elif isinstance(expression, expr.Set) or \
+         isinstance(expression, expr.Values):
+        for member in expression.members:
+            expression_calls(member, calls)
+    elif isinstance(expression, expr.Bits):
+        for element in expression.elements:
+            expression_calls(element, calls)
+    elif isinstance(expression, expr.Unary):
+        expression_calls(expression.arg, calls)
+    elif isinstance(expression, expr.Operator):
+        expression_calls(expression.arg0, calls)
+        expression_calls(expression.arg1, calls)
+    elif isinstance(expression, expr.Ternary):
+        expression_calls(expression.condition, calls)
+        expression_calls(expression.arg0, calls)
+        expression_calls(expression.arg1, calls)
+    elif isinstance(expression, expr.Unknown) or \
+         isinstance(expression, expr.ImplementationDefined):
+        datatype_calls(expression.datatype, calls)
+
+def datatype_calls(datatype, calls):
+    if isinstance(datatype, dtype.Bits):
+        expression_calls(datatype.expression, calls)
+    elif isinstance(datatype, dtype.Compound):
+        for partial_type in datatype.partial_types:
+            datatype_calls(partial_type, calls)
+    elif isinstance(datatype, dtype.Array):
+        datatype_calls(datatype.base, calls)
+        expression_calls(datatype.start, calls)
+        expression_calls(datatype.stop, calls)
+
+def usage():
+    sys.stderr.write('''\
+Usage: python3 -m pseudocode.callgraph [OPTIONS] GRAPH NAME...
+
+Options:
+  --callers     list the functions and fragments which can reach NAME
+                (default: list what NAME calls, directly or indirectly)
+  --fragments   with --callers, only list fragments (e.g. instructions)
+''')
+    sys.exit(1)
+
+if __name__ == '__main__':
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], '', ['callers', 'fragments'])
+    except getopt.GetoptError as e:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], e))
+        usage()
+    if len(args) < 2:
+        usage()
+    callers = False
+    functions = True
+    for opt, arg in opts:
+        if opt == '--callers':
+            callers = True
+        elif opt == '--fragments':
+            functions = False
+    graph = load(args[0])
+    for name in args[1:]:
+        if name not in graph.index:
+            sys.stderr.write('%s: %s: no such node\n' % (sys.argv[0], name))
+            sys.exit(1)
+        if callers:
+            result = graph.callers(name, functions)
+        else:
+            result = graph.callees(name)
+        for n in sorted(result):
+            print(n)
@@ -0,0 +1,1307 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import builtins
+import fractions
+import hashlib
+import importlib.util
+import keyword
+import marshal
+import os
+import re
+
+from . import token, expr, stmt, dtype, decl, ns, runtime, cache, bits
+from .bits import Bits
+from .runtime import ExecutionError
+
+# Translating pseudocode to Python source
+#
+# The library functions of a namespace and the decode and execute
+# fragments of the instructions are translated into two Python modules,
+# library.py and instructions.py (which is run in the namespace of
+# library.py), so they can be read, debugged and profiled like any
+# other Python code.  The values are the same as for the evaluator
+# (see runtime.py), and so is the state, which bind() connects to the
+# module.
+#
+# Names are mangled from the qualified names: f_AArch64__TakeException
+# for a function (with the index of the overload appended if there are
+# several), get_X and set_X for accessors, c_ for constants, b_ for
+# primitives, i_ for instructions.  Local variables keep their names
+# unless they would clash with these.
+#
+# Overloads are picked while translating by the shapes of the argument
+# types (see ns.type_shape) where these are known, and at run time
+# otherwise.  A few trivial primitives (UInt, Zeros, ...) are inlined;
+# comparisons of a bitvector with a literal compare the integer values,
+# as the widths match in well-typed code.
+#
+# The compiled modules are cached on disk, keyed by a hash over the
+# specification and the source of this package:
+#
+#     semantics = codegen.load(spec.namespace, spec.instructions(),
+#                              spec.digest(), 'asl-codegen.cache')
+#     semantics.call('AddWithCarry', x, y, Bits(0, 1))
+#     semantics.execute('aarch64/instrs/integer/...', Rd = ..., ...)
+#
+# Not supported: parameters passed by reference aren't written back.
+
+# prefixes of the names defined at module level
+PREFIXES = frozenset(['b', 'bits', 'c', 'd', 'f', 'get', 'i', 'l', 'real',
+                      'set'])
+
+SCALAR_SHAPES = frozenset(['bit', 'bits', 'boolean', 'integer', 'real'])
+
+# primitives which are simple enough to be written out in place
+INLINE = {
+    ('UInt', 1): '%s.value',
+    ('Len', 1): '%s.width',
+    ('IsZero', 1): '(%s.value == 0)',
+    ('Zeros', 1): '_make(0, %s)',
+    ('ZeroExtend', 2): '_Bits(%s.value, %s)',
+}
+
+OPERATORS = {
+    '||': 'or',
+    '&&': 'and',
+    'OR': '|',
+    'EOR': '^',
+    'AND': '&',
+    '==': '==',
+    '!=': '!=',
+    '<': '<',
+    '<=': '<=',
+    '>': '>',
+    '>=': '>=',
+    '<<': '<<',
+    '>>': '>>',
+    '+': '+',
+    '-': '-',
+    '*': '*',
+    'DIV': '//',
+    'MOD': '%',
+}
+
+HELPERS = {
+    ':': '_rt.concat',
+    '/': '_rt.divide',
+    'REM': '_rt.rem',
+    '^': '_rt.power',
+}
+
+def mangle(key):
+    return '__'.join(key)
+
+def local_name(data):
+    prefix, sep, rest = data.partition('_')
+    if keyword.iskeyword(data) or data.startswith('_') or \
+       data == 'range' or sep and prefix in PREFIXES:
+        return 'l_' + data
+    return data
+
+# the tuple of names for an identifier chain, or None
+def qualified_name(expression):
+    if isinstance(expression, expr.Identifier):
+        return expression.name.data,
+    if isinstance(expression, expr.QualifiedIdentifier):
+        prefix = qualified_name(expression.expression)
+        if prefix is not None:
+            return prefix + (expression.name.data, )
+    return None
+
+# whether the source is a name, attribute, call or subscript which
+# needs no parentheses around it
+def is_simple(src):
+    m = re.match(r'[\w.]+', src)
+    if m is None:
+        return False
+    depth = 0
+    for i in range(m.end(), len(src)):
+        ch = src[i]
+        if ch in '([{':
+            depth += 1
+        elif ch in ')]}':
+            depth -= 1
+            if depth == 0 and i != len(src) - 1 and src[i + 1] != '.' and \
+               src[i + 1] not in '([':
+                return False
+        elif depth == 0 and ch != '.' and not ch.isalnum() and ch != '_':
+            return False
+    return depth == 0
+
+def parenthesize(src):
+    return src if is_simple(src) else '(%s)' % src
+
+# the source as the object of an attribute access
+def operand(src):
+    if src[:1].isdigit():
+        return '(%s)' % src
+    return parenthesize(src)
+
+class Context:
+    def __init__(self, inputs = None):
+        # names of the local variables
+        self.locals = {}
+        self.types = {}
+        self.enumerations = set()
+        self.result_type = None
+        # shapes of the values assigned to variables which aren't
+        # declared
+        self.shapes = {}
+        # variables of an instruction which are read before they are
+        # assigned, i.e. the encoding fields
+        self.inputs = inputs
+        self.temporaries = 0
+
+    def local(self, data):
+        try:
+            return self.locals[data]
+        except KeyError:
+            name = self.locals[data] = local_name(data)
+            return name
+
+    def temporary(self):
+        self.temporaries += 1
+        return '_t%d' % (self.temporaries - 1)
+
+class Generator:
+    def __init__(self, namespace = None, prefer_builtins = True):
+        if namespace is None:
+            namespace = ns.global_ns
+        self.namespace = namespace
+        self.prefer_builtins = prefer_builtins
+        self.names = {}
+        self.used_names = set()
+        # module level definitions besides the functions
+        self.literals = {}
+        self.literal_lines = []
+        self.constants = {}
+        self.constant_lines = []
+        self.variables = {}
+        self.variable_lines = []
+        self.builtins = {}
+        self.dispatchers = {}
+        self.dispatcher_lines = []
+        # (name, arity) -> (Python name, keyword for the result width)
+        self.entry_points = {}
+
+    def unique(self, name):
+        while name in self.used_names:
+            name += '_'
+        self.used_names.add(name)
+        return name
+
+    # the Python name of a function, getter or setter declaration
+    def function_name(self, declaration):
+        try:
+            return self.names[id(declaration)]
+        except KeyError:
+            pass
+        key = ns.qualified_name(declaration.name)
+        if declaration.functype == decl.GETTER:
+            name = 'get_' + mangle(key)
+        elif declaration.functype == decl.SETTER:
+            name = 'set_' + mangle(key)
+        else:
+            name = 'f_' + mangle(key)
+            function = self.lookup(key)
+            if len(function.declarations) > 1:
+                name += '_%d' % function.declarations.index(declaration)
+        name = self.names[id(declaration)] = self.unique(name)
+        return name
+
+    # whether the function takes the width of its bits(N) result from
+    # the caller
+    def takes_width(self, declaration):
+        if declaration.functype == decl.SETTER or \
+           not isinstance(declaration.result_type, dtype.Bits) or \
+           not isinstance(declaration.result_type.expression, expr.Identifier):
+            return False
+        data = declaration.result_type.expression.name.data
+        for param_type, param_name, by_reference \
+                in declaration.parameters or []:
+            if param_name.data == data or \
+               isinstance(param_type, dtype.Bits) and \
+               isinstance(param_type.expression, expr.Identifier) and \
+               param_type.expression.name.data == data:
+                return False
+        return True
+
+    # whether values of the shape are structures or arrays which need
+    # to be copied on assignment
+    def needs_copy(self, shape):
+        if shape is None:
+            return True
+        if shape in SCALAR_SHAPES or shape == 'compound':
+            return False
+        return not isinstance(self.lookup(tuple(shape.split('.'))),
+                              ns.Enumeration)
+
+    # Modules
+
+    # Returns the source of library.py and instructions.py.
+    # instructions is a list of (name, bodies) pairs, the bodies being
+    # the decode and execute fragments of an instruction.
+    def generate(self, instructions = (), digest = None):
+        functions = []
+        for key, x in sorted(self.namespace.index.items()):
+            if isinstance(x, ns.Function):
+                self.add_entry_point(key, x)
+                for declaration in x.declarations:
+                    if declaration.body is not None:
+                        functions += self.generate_function(declaration)
+            elif isinstance(x, ns.Accessor):
+                for declaration in [x.getter, x.setter]:
+                    if declaration is not None and \
+                       declaration.body is not None:
+                        functions += self.generate_function(declaration)
+                if x.getter is not None:
+                    self.add_entry_point(key, x)
+
+        code = []
+        table = []
+        for name, bodies in instructions:
+            function_name, inputs, lines = \
+                self.generate_instruction(name, bodies)
+            code += lines
+            table.append('    %r: (%r, %r),' % (
+                name, function_name, tuple(inputs)))
+
+        header = '# Generated by pseudocode/codegen.py%s; do not edit.\n' % (
+            '' if digest is None else ' from specification %s' % digest)
+        library = [
+            header,
+            'from pseudocode import runtime as _rt',
+            'from pseudocode.bits import Bits as _Bits, make as _make',
+            '',
+            '_S = None',
+            '_V = None',
+            '',
+            'def _read(name):',
+            '    try:',
+            '        return _V[name]',
+            '    except KeyError:',
+            '        raise _rt.ExecutionError(\'%s has no value\' % name)',
+            '',
+            'def _fail(message):',
+            '    raise _rt.ExecutionError(message)',
+            '']
+        library += self.literal_lines
+        library.append('')
+        library += functions
+        library += self.generate_bind()
+        library += self.dispatcher_lines
+        library.append('FUNCTIONS = {')
+        for (name, arity), (function_name, width_keyword) \
+                in sorted(self.entry_points.items()):
+            library.append('    (%r, %d): (%r, %r),' % (
+                name, arity, function_name, width_keyword))
+        library.append('}')
+
+        instructions = [header, '# runs in the namespace of library.py', '']
+        instructions += code
+        instructions.append('INSTRUCTIONS = {')
+        instructions += table
+        instructions.append('}')
+        return '\n'.join(library) + '\n', '\n'.join(instructions) + '\n'
+
+    def generate_bind(self):
+        names = ['_S', '_V'] + sorted(self.builtins.values()) + \
+                [name for name, lines in self.constant_lines]
+        lines = ['def bind(state):']
+        for i in range(0, len(names), 6):
+            lines.append('    global ' + ', '.join(names[i:i + 6]))
+        lines.append('    _S = state')
+        lines.append('    _V = state.variables')
+        for (name, arity), builtin in sorted(self.builtins.items()):
+            lines.append('    %s = state.builtins[%r, %d]' % (
+                builtin, name, arity))
+        for name, constant_lines in self.constant_lines:
+            lines += constant_lines
+        lines += self.variable_lines
+        lines.append('')
+        return lines
+
+    def add_entry_point(self, key, x):
+        name = '.'.join(key)
+        if isinstance(x, ns.Accessor):
+            if x.getter.body is not None:
+                self.entry_points[name, len(x.getter.parameters or [])] = \
+                    self.function_name(x.getter), \
+                    '_width' if self.takes_width(x.getter) else None
+            return
+        for arity in sorted(set(len(declaration.parameters)
+                                for declaration in x.declarations)):
+            src, width_keyword = self.callee(key, x, arity, None)
+            if src is not None:
+                self.entry_points[name, arity] = src, width_keyword
+
+    def generate_function(self, declaration):
+        ctx = Context()
+        params = declaration.parameters or []
+        for param_type, param_name, by_reference in params:
+            ctx.types[param_name.data] = param_type
+        if declaration.functype == decl.SETTER:
+            ctx.types[declaration.result_name.data] = \
+                declaration.result_type
+            typed = params + [(declaration.result_type,
+                               declaration.result_name, False)]
+        else:
+            typed = params
+            ctx.result_type = declaration.result_type
+        names = [ctx.local(param_name.data)
+                 for param_type, param_name, by_reference in typed]
+
+        # the width of bits(N) arguments binds N
+        lines = []
+        for param_type, param_name, by_reference in typed:
+            if isinstance(param_type, dtype.Bits) and \
+               isinstance(param_type.expression, expr.Identifier):
+                data = param_type.expression.name.data
+                if data not in ctx.locals:
+                    ctx.types[data] = dtype.Integer()
+                    lines.append('    %s = %s.width' % (
+                        ctx.local(data), ctx.local(param_name.data)))
+        # as does the width the caller expects for a bits(N) result
+        if self.takes_width(declaration):
+            names.append('_width = None')
+            data = declaration.result_type.expression.name.data
+            ctx.types[data] = dtype.Integer()
+            lines.append('    %s = _width' % ctx.local(data))
+
+        try:
+            self.compile_block(declaration.body, ctx, lines, 1)
+        except ExecutionError as e:
+            # fail when called, as the evaluator does
+            lines = ['    _fail(%r)' % str(e)]
+        return ['# %s: %s' % ('.'.join(str(part) for part in declaration.name),
+                             ns.signature(declaration)),
+                'def %s(%s):' % (self.function_name(declaration),
+                                 ', '.join(names))] + lines + ['']
+
+    def generate_instruction(self, name, bodies):
+        function_name = self.unique('i_' + re.sub(r'\W', '_', name))
+        ctx = Context([])
+        lines = []
+        try:
+            for body in bodies:
+                self.compile_block(body, ctx, lines, 1)
+        except ExecutionError as e:
+            lines = ['    _fail(%r)' % str(e)]
+        inputs = ctx.inputs
+        return function_name, inputs, [
+            '# %s' % name,
+            'def %s(%s):' % (function_name, ', '.join(
+                '%s = None' % ctx.locals[data] for data in inputs))
+        ] + lines + ['']
+
+    # Module level names
+
+    def literal(self, value):
+        try:
+            return self.literals[value]
+        except KeyError:
+            pass
+        if isinstance(value, Bits):
+            name = 'bits%d_%d' % (value.width, value.value)
+            src = '_Bits(%d, %d)' % (value.value, value.width)
+        else:
+            name = 'real_%d_%d' % (value.numerator, value.denominator)
+            src = '_rt.fractions.Fraction(%d, %d)' % (
+                value.numerator, value.denominator)
+        name = self.literals[value] = self.unique(name)
+        self.literal_lines.append('%s = %s' % (name, src))
+        return name
+
+    def builtin(self, name, arity):
+        try:
+            return self.builtins[name, arity]
+        except KeyError:
+            builtin = self.builtins[name, arity] = \
+                self.unique('b_%s_%d' % (name, arity))
+            return builtin
+
+    def constant(self, key, x):
+        try:
+            return self.constants[key]
+        except KeyError:
+            pass
+        ctx = Context()
+        src, shape = self.compile_expression(x.expression, ctx)
+        name = self.constants[key] = self.unique('c_' + mangle(key))
+        self.constant_lines.append((name, ['    %s = %s' % (name, src)]))
+        return name
+
+    def variable(self, key, x):
+        k = '.'.join(key)
+        if k in self.variables:
+            return
+        ctx = Context()
+        if isinstance(x, ns.Variable) and x.expression is not None:
+            src, shape = self.compile_expression(x.expression, ctx)
+        else:
+            src = self.compile_default(x.declaration.datatype, ctx)
+        self.variables[k] = x
+        self.variable_lines += [
+            '    if %r not in _V:' % k,
+            '        _V[%r] = %s' % (k, src)]
+
+    # Types
+
+    def lookup(self, key):
+        x = self.namespace.index.get(key)
+        if isinstance(x, ns.Namespace):
+            return None
+        return x
+
+    def shape(self, datatype):
+        if datatype is None:
+            return None
+        return ns.type_shape(datatype)
+
+    # the declared type of a field of a structure, or None
+    def field_type(self, shape, data):
+        if shape is None or shape in SCALAR_SHAPES:
+            return None
+        x = self.lookup(tuple(shape.split('.')))
+        if not isinstance(x, ns.Struct) or x.declaration.fields is None:
+            return None
+        for field_type, field_name in x.declaration.fields:
+            if field_name.data == data:
+                return field_type
+        return None
+
+    # the value of a variable of the given type which hasn't been
+    # assigned yet
+    def compile_default(self, datatype, ctx):
+        if isinstance(datatype, dtype.Bit):
+            return self.literal(Bits(0, 1))
+        if isinstance(datatype, dtype.Bits):
+            if isinstance(datatype.expression, expr.Numeric) and \
+               isinstance(datatype.expression.number_or_bitvector,
+                          token.Number):
+                return self.literal(Bits(0, int(
+                    datatype.expression.number_or_bitvector.data)))
+            src, shape = self.compile_expression(datatype.expression, ctx)
+            return '_Bits(0, %s)' % src
+        if isinstance(datatype, dtype.Boolean):
+            return 'False'
+        if isinstance(datatype, dtype.Integer):
+            return '0'
+        if isinstance(datatype, dtype.Void):
+            return 'None'
+        if isinstance(datatype, dtype.Compound):
+            return '(%s, )' % ', '.join(
+                self.compile_default(partial_type, ctx)
+                for partial_type in datatype.partial_types)
+        if isinstance(datatype, dtype.Array):
+            base = self.compile_default(datatype.base, ctx)
+            start, shape = self.compile_expression(datatype.start, ctx)
+            stop, shape = self.compile_expression(datatype.stop, ctx)
+            return '{_i: %s for _i in range(%s, %s + 1)}' % (
+                base, start, parenthesize(stop))
+        if isinstance(datatype, dtype.Custom):
+            key = tuple(str(part) for part in datatype.name)
+            x = self.lookup(key)
+            if isinstance(x, ns.Struct):
+                if x.declaration.fields is None:
+                    return 'None'
+                return '_rt.Record(%r, {%s})' % ('.'.join(key), ', '.join(
+                    '%r: %s' % (field_name.data,
+                                self.compile_default(field_type, ctx))
+                    for field_type, field_name in x.declaration.fields))
+            if isinstance(x, ns.Type):
+                return self.compile_default(x.declaration.datatype, ctx)
+            if isinstance(x, ns.Enumeration):
+                return repr(x.declaration.values[0].data)
+            if key == ('real', ):
+                return '0'
+            return 'None'
+        assert False
+
+    # Calls
+
+    # The Python source of the function to call for the given number
+    # of arguments and, if known, argument shapes, and the keyword by
+    # which it takes the width of its result (or None); the source is
+    # None if there is no such function.
+    def callee(self, key, x, arity, shapes):
+        name = '.'.join(key)
+        candidates = x.candidates(arity)
+        declarations = [declaration for declaration in candidates
+                        if declaration.body is not None]
+        builtin = (name, arity) in runtime.builtins
+        if not declarations or builtin and self.prefer_builtins:
+            if not builtin:
+                return None, None
+            return self.builtin(name, arity), 'width'
+        if len(declarations) > 1 and shapes is not None:
+            exact = [declaration
+                     for declaration in x.candidates(arity, tuple(shapes))
+                     if declaration.body is not None]
+            if exact:
+                declarations = exact[:1]
+            else:
+                matching = [declaration for declaration in declarations
+                            if all(s == t or s == 'bit' and t == 'bits'
+                                   for s, t in zip(shapes, (
+                                       ns.type_shape(param_type)
+                                       for param_type, param_name,
+                                           by_reference
+                                           in declaration.parameters)))]
+                if matching:
+                    declarations = matching[:1]
+        if len(declarations) == 1:
+            declaration, = declarations
+            return self.function_name(declaration), \
+                   '_width' if self.takes_width(declaration) else None
+        return self.dispatcher(key, arity, declarations), '_width'
+
+    def dispatcher(self, key, arity, declarations):
+        try:
+            return self.dispatchers[key, arity]
+        except KeyError:
+            pass
+        name = self.dispatchers[key, arity] = \
+            self.unique('d_%s_%d' % (mangle(key), arity))
+        lines = ['%s = _rt.dispatcher(%r, (' % (name, '.'.join(key))]
+        for declaration in declarations:
+            lines.append('    (%r, %s, %r),' % (
+                tuple(ns.type_shape(param_type)
+                      for param_type, param_name, by_reference
+                          in declaration.parameters),
+                self.function_name(declaration),
+                self.takes_width(declaration)))
+        lines += ['))', '']
+        self.dispatcher_lines += lines
+        return name
+
+    # The sources of the arguments for a call to one of declarations;
+    # structures and arrays are copied like on assignment, so the callee
+    # can't change the caller's variables.  args is a list of (source,
+    # shape) pairs.
+    def copy_arguments(self, declarations, args):
+        sources = []
+        for i, (src, shape) in enumerate(args):
+            if self.needs_copy(shape):
+                for declaration in declarations:
+                    params = declaration.parameters or []
+                    if i < len(params) and not params[i][2] and \
+                       self.needs_copy(self.shape(params[i][0])):
+                        src = '_rt.copy_value(%s)' % src
+                        break
+            sources.append(src)
+        return sources
+
+    # args is a list of (source, shape) pairs
+    def compile_call(self, key, args, ctx, width = None):
+        name = '.'.join(key)
+        x = self.lookup(key)
+        sources = [src for src, shape in args]
+        if isinstance(x, ns.Accessor):
+            if x.getter is None:
+                return '_fail(%r)' % ('%s has no getter' % name), None
+            sources = self.copy_arguments([x.getter], args)
+            if width is not None and self.takes_width(x.getter):
+                sources.append('_width = %s' % width)
+            return '%s(%s)' % (self.function_name(x.getter),
+                               ', '.join(sources)), \
+                   self.shape(x.getter.result_type)
+        if not isinstance(x, ns.Function):
+            return '_fail(%r)' % ('%s is not a function' % name), None
+
+        candidates = x.candidates(len(args))
+        shape = None
+        if candidates:
+            shape = self.shape(candidates[0].result_type)
+        if self.prefer_builtins and (name, len(args)) in INLINE and \
+           (name, len(args)) in runtime.builtins:
+            if name == 'Zeros' and sources[0].isdigit():
+                return self.literal(Bits(0, int(sources[0]))), shape
+            return INLINE[name, len(args)] % (
+                (operand(sources[0]), ) + tuple(sources[1:])), shape
+
+        shapes = [s for src, s in args]
+        if None in shapes:
+            shapes = None
+        sources = self.copy_arguments(candidates, args)
+        callee, width_keyword = self.callee(key, x, len(args), shapes)
+        if callee is None:
+            return '_fail(%r)' % ('%s with %d arguments has no body' % (
+                name, len(args))), shape
+        if width is not None and width_keyword is not None:
+            sources.append('%s = %s' % (width_keyword, width))
+        return '%s(%s)' % (callee, ', '.join(sources)), shape
+
+    # Expressions
+    #
+    # An expression compiles to a pair of its Python source and its
+    # shape (see ns.type_shape), the latter being None if unknown.
+
+    def compile_name(self, data, ctx):
+        if data in ctx.locals:
+            if data in ctx.types:
+                return ctx.locals[data], self.shape(ctx.types[data])
+            return ctx.locals[data], ctx.shapes.get(data)
+        if data in ctx.enumerations:
+            return repr(data), None
+        x = ns.lookup_single(data, self.namespace)
+        if x is ns.MISSING:
+            if ctx.inputs is not None:
+                ctx.inputs.append(data)
+            return ctx.local(data), None
+        return self.compile_global((data, ), x)
+
+    def compile_global(self, key, x):
+        k = '.'.join(key)
+        if x is None:
+            # implicitly defined, see ns.implicit
+            return '_read(%r)' % k, None
+        if isinstance(x, ns.Enumeration):
+            return repr(key[-1]), str(x.declaration.name)
+        if isinstance(x, ns.Variable):
+            shape = self.shape(x.declaration.datatype)
+            if x.declaration.is_constant:
+                return self.constant(key, x), shape
+            self.variable(key, x)
+            return '_V[%r]' % k, shape
+        if isinstance(x, ns.Array):
+            self.variable(key, x)
+            return '_V[%r]' % k, None
+        if isinstance(x, ns.Accessor):
+            if x.getter is None or x.getter.parameters:
+                return '_fail(%r)' % ('%s can\'t be read like this' % k), \
+                       None
+            return '%s()' % self.function_name(x.getter), \
+                   self.shape(x.getter.result_type)
+        return '_fail(%r)' % ('%s is not a value' % k), None
+
+    def compile_expression(self, expression, ctx, width = None):
+        if isinstance(expression, expr.Identifier):
+            return self.compile_name(expression.name.data, ctx)
+        elif isinstance(expression, expr.QualifiedIdentifier):
+            key = qualified_name(expression)
+            if key is not None and key[0] not in ctx.locals:
+                x = self.lookup(key)
+                if x is not None:
+                    return self.compile_global(key, x)
+            base, shape = self.compile_expression(expression.expression, ctx)
+            data = expression.name.data
+            return '%s.fields[%r]' % (operand(base), data), \
+                   self.shape(self.field_type(shape, data))
+        elif isinstance(expression, expr.Arguments):
+            if expression.method == '()':
+                key = qualified_name(expression.func)
+                if key is None:
+                    raise ExecutionError('can\'t call %s' % expression.func)
+                args = [self.compile_expression(arg, ctx)
+                        for arg in expression.args]
+                return self.compile_call(key, args, ctx, width)
+            if expression.method == '[]':
+                return self.compile_index(expression, ctx, width)
+            return self.compile_slice(expression, ctx), 'bits'
+        elif isinstance(expression, expr.Set):
+            raise ExecutionError('set outside of IN: %s' % expression)
+        elif isinstance(expression, expr.Numeric):
+            t = expression.number_or_bitvector
+            if isinstance(t, token.Number):
+                if '.' in t.data:
+                    value = fractions.Fraction(t.data)
+                    if value.denominator == 1:
+                        return str(value.numerator), 'real'
+                    return self.literal(value), 'real'
+                return str(int(t.data)), 'integer'
+            if isinstance(t, token.HexadecimalNumber):
+                return str(int(t.data, 16)), 'integer'
+            value = bits.literal(t.data)
+            if isinstance(value, bits.Pattern):
+                raise ExecutionError('pattern %s used as a value' % t)
+            return self.literal(value), \
+                   'bit' if value.width == 1 else 'bits'
+        elif isinstance(expression, expr.Unary):
+            a, shape = self.compile_expression(expression.arg, ctx)
+            op = expression.operator.data
+            if op == '!':
+                return 'not %s' % parenthesize(a), 'boolean'
+            if op == '-':
+                return '-%s' % parenthesize(a), shape
+            if op == 'NOT':
+                return '~%s' % parenthesize(a), shape
+            assert False
+        elif isinstance(expression, expr.Operator):
+            return self.compile_operator(expression, ctx)
+        elif isinstance(expression, expr.Ternary):
+            c, shape = self.compile_expression(expression.condition, ctx)
+            a, shape = self.compile_expression(expression.arg0, ctx, width)
+            b, b_shape = self.compile_expression(expression.arg1, ctx, width)
+            return '%s if %s else %s' % (
+                parenthesize(a), parenthesize(c), parenthesize(b)), shape
+        elif isinstance(expression, expr.Bits):
+            src = None
+            for element in expression.elements:
+                e, shape = self.compile_expression(element, ctx)
+                src = e if src is None else '_rt.concat(%s, %s)' % (src, e)
+            return src, 'bits'
+        elif isinstance(expression, expr.Values):
+            return '(%s, )' % ', '.join(
+                self.compile_expression(member, ctx)[0]
+                for member in expression.members), 'compound'
+        elif isinstance(expression, expr.Omitted):
+            raise ExecutionError('"-" can only be used as LHS')
+        elif isinstance(expression, expr.Unknown):
+            return '_S.unknown(%s)' % self.compile_default(
+                       expression.datatype, ctx), \
+                   self.shape(expression.datatype)
+        elif isinstance(expression, expr.ImplementationDefined):
+            return '_S.implementation_defined(%r, %s)' % (
+                       expression.aspect, self.compile_default(
+                           expression.datatype, ctx)), \
+                   self.shape(expression.datatype)
+        elif isinstance(expression, expr.Primitive):
+            data = expression.token.data
+            if data == 'TRUE':
+                return 'True', 'boolean'
+            if data == 'FALSE':
+                return 'False', 'boolean'
+            if data == 'HIGH':
+                return self.literal(Bits(1, 1)), 'bit'
+            return self.literal(Bits(0, 1)), 'bit'
+        else:
+            assert False
+
+    def compile_index(self, expression, ctx, width = None):
+        key = qualified_name(expression.func)
+        args = [self.compile_expression(arg, ctx) for arg in expression.args]
+        if key is not None and (len(key) != 1 or key[0] not in ctx.locals):
+            x = self.lookup(key)
+            if isinstance(x, ns.Accessor):
+                return self.compile_call(key, args, ctx, width)
+            if isinstance(x, ns.Array):
+                if len(args) != 1:
+                    raise ExecutionError('%s: arrays have one index' %
+                                         expression)
+                self.variable(key, x)
+                return '_V[%r][%s]' % ('.'.join(key), args[0][0]), \
+                       self.shape(x.declaration.datatype.base)
+            if x is not None:
+                return '_fail(%r)' % ('%s can\'t be indexed' %
+                                      '.'.join(key)), None
+        if len(args) != 1:
+            raise ExecutionError('%s: arrays have one index' % expression)
+        base, shape = self.compile_expression(expression.func, ctx)
+        return '%s[%s]' % (parenthesize(base), args[0][0]), None
+
+    # the (hi, lo) sources of each bitspec
+    def compile_bitspecs(self, args, ctx):
+        specs = []
+        for arg in args:
+            if isinstance(arg, tuple):
+                a, shape = self.compile_expression(arg[0], ctx)
+                b, shape = self.compile_expression(arg[2], ctx)
+                if arg[1].data == ':':
+                    specs.append((a, b))
+                elif a.isdigit() and b.isdigit():
+                    specs.append((str(int(a) + int(b) - 1), a))
+                else:
+                    specs.append(('%s + %s - 1' % (a, parenthesize(b)), a))
+            else:
+                a, shape = self.compile_expression(arg, ctx)
+                specs.append((a, a))
+        return specs
+
+    def compile_slice(self, expression, ctx):
+        base, shape = self.compile_expression(expression.func, ctx)
+        specs = self.compile_bitspecs(expression.args, ctx)
+        if len(specs) != 1:
+            return '_rt.extract_fields(%s, [%s])' % (base, ', '.join(
+                '(%s, %s)' % spec for spec in specs))
+        (hi, lo), = specs
+        if (shape == 'bits' or shape == 'bit') and \
+           hi.isdigit() and lo.isdigit():
+            width = int(hi) - int(lo) + 1
+            if lo == '0':
+                return '_make(%s.value & %d, %d)' % (
+                    operand(base), bits.mask(width), width)
+            return '_make(%s.value >> %s & %d, %d)' % (
+                operand(base), lo, bits.mask(width), width)
+        return '_rt.extract(%s, %s, %s)' % (base, hi, lo)
+
+    # a test whether the value with the given source (which must be
+    # simple, as it may be used more than once) matches a bitvector
+    # literal or pattern, or None if the expression isn't one
+    def compile_pattern(self, expression, src):
+        if isinstance(expression, expr.Numeric) and \
+           isinstance(expression.number_or_bitvector, token.Bitvector):
+            p = bits.literal(expression.number_or_bitvector.data)
+            if not isinstance(p, bits.Pattern):
+                return '%s.value == %d' % (src, p.value)
+            return '%s.value & %d == %d' % (src, p.mask, p.value)
+        return None
+
+    def compile_operator(self, expression, ctx):
+        op = expression.operator.data
+        if op == 'IN':
+            if not isinstance(expression.arg1, expr.Set):
+                raise ExecutionError('IN needs a set: %s' % expression)
+            a, shape = self.compile_expression(expression.arg0, ctx)
+            members = expression.arg1.members
+            if len(members) == 1 or is_simple(a):
+                tests = [self.compile_membership(member, operand(a), ctx)
+                         for member in members]
+                return ' or '.join(tests), 'boolean'
+            t = ctx.temporary()
+            tests = [self.compile_membership(member, t, ctx)
+                     for member in members]
+            tests[0] = tests[0].replace(t, '(%s := %s)' % (t, a), 1)
+            return ' or '.join(tests), 'boolean'
+        if op == '==' or op == '!=':
+            a, shape = self.compile_expression(expression.arg0, ctx)
+            test = self.compile_pattern(expression.arg1, operand(a))
+            if test is not None:
+                if op == '==':
+                    return test, 'boolean'
+                return 'not (%s)' % test, 'boolean'
+
+        a, a_shape = self.compile_expression(expression.arg0, ctx)
+        b, b_shape = self.compile_expression(expression.arg1, ctx)
+        if op in HELPERS:
+            shape = 'bits' if op == ':' else 'real' if op == '/' else a_shape
+            return '%s(%s, %s)' % (HELPERS[op], a, b), shape
+        if op in {'||', '&&', '==', '!=', '<', '<=', '>', '>='}:
+            shape = 'boolean'
+        elif op == 'DIV' or op == 'MOD':
+            shape = 'integer'
+        else:
+            shape = a_shape
+        return '%s %s %s' % (parenthesize(a), OPERATORS[op],
+                             parenthesize(b)), shape
+
+    def compile_membership(self, member, src, ctx):
+        test = self.compile_pattern(member, src)
+        if test is not None:
+            return '%s' % test
+        c, shape = self.compile_expression(member, ctx)
+        return '%s == %s' % (src, parenthesize(c))
+
+    # the expression to assign, with the width of the target if it is
+    # known (for calls to functions returning bits(N) for any N)
+    def compile_value(self, expression, datatype, ctx):
+        width = None
+        if isinstance(datatype, dtype.Bits) and (
+                isinstance(datatype.expression, expr.Identifier) or
+                isinstance(datatype.expression, expr.Numeric)):
+            width, shape = self.compile_expression(datatype.expression, ctx)
+        src, shape = self.compile_expression(expression, ctx, width)
+        if self.needs_copy(shape) and (
+                isinstance(expression, expr.Identifier) or
+                isinstance(expression, expr.QualifiedIdentifier) or
+                isinstance(expression, expr.Arguments) and
+                    expression.method == '[]'):
+            # don't share structures and arrays with the variable
+            # they come from
+            return '_rt.copy_value(%s)' % src, shape
+        return src, shape
+
+    # Assignments
+    #
+    # Appends the lines storing the value with the given source (which
+    # is used exactly once) to lines.
+
+    def compile_lhs(self, lhs, value, ctx, lines, indent):
+        prefix = '    ' * indent
+        if isinstance(lhs, expr.Identifier):
+            data = lhs.name.data
+            if data not in ctx.locals and data not in ctx.enumerations:
+                x = ns.lookup_single(data, self.namespace)
+                if x is not ns.MISSING:
+                    self.compile_global_lhs((data, ), x, value, lines,
+                                            indent)
+                    return
+            lines.append('%s%s = %s' % (prefix, ctx.local(data), value))
+        elif isinstance(lhs, expr.QualifiedIdentifier):
+            key = qualified_name(lhs)
+            if key is not None and key[0] not in ctx.locals:
+                x = self.lookup(key)
+                if x is not None:
+                    self.compile_global_lhs(key, x, value, lines, indent)
+                    return
+            base, shape = self.compile_expression(lhs.expression, ctx)
+            lines.append('%s%s.fields[%r] = %s' % (
+                prefix, operand(base), lhs.name.data, value))
+        elif isinstance(lhs, expr.Arguments):
+            if lhs.method == '[]':
+                self.compile_index_lhs(lhs, value, ctx, lines, indent)
+                return
+            if lhs.method != '<>':
+                raise ExecutionError('%s is not a valid LHS' % lhs)
+            get, shape = self.compile_expression(lhs.func, ctx)
+            specs = self.compile_bitspecs(lhs.args, ctx)
+            if len(specs) == 1:
+                (hi, lo), = specs
+                value = '_rt.insert(%s, %s, %s, %s)' % (get, hi, lo, value)
+            else:
+                value = '_rt.insert_fields(%s, [%s], %s)' % (
+                    get, ', '.join('(%s, %s)' % spec for spec in specs),
+                    value)
+            self.compile_lhs(lhs.func, value, ctx, lines, indent)
+        elif isinstance(lhs, expr.Bits):
+            t = ctx.temporary()
+            lines.append('%s%s = %s.value' % (prefix, t, operand(value)))
+            for element in reversed(lhs.elements):
+                get, shape = self.compile_expression(element, ctx)
+                w = ctx.temporary()
+                lines.append('%s%s = %s.width' % (
+                    prefix, w, operand(get)))
+                self.compile_lhs(element, '_Bits(%s, %s)' % (t, w), ctx,
+                                 lines, indent)
+                lines.append('%s%s >>= %s' % (prefix, t, w))
+        elif isinstance(lhs, expr.Values):
+            t = ctx.temporary()
+            lines.append('%s%s = %s' % (prefix, t, value))
+            for i, member in enumerate(lhs.members):
+                self.compile_lhs(member, '%s[%d]' % (t, i), ctx, lines,
+                                 indent)
+        elif isinstance(lhs, expr.Omitted):
+            pass
+        else:
+            raise ExecutionError('%s is not a valid LHS' % lhs)
+
+    def compile_global_lhs(self, key, x, value, lines, indent):
+        prefix = '    ' * indent
+        k = '.'.join(key)
+        if x is None or isinstance(x, ns.Variable) and \
+                        not x.declaration.is_constant:
+            if x is not None:
+                self.variable(key, x)
+            lines.append('%s_V[%r] = %s' % (prefix, k, value))
+        elif isinstance(x, ns.Accessor):
+            if x.setter is None or x.setter.parameters:
+                lines.append('%s_fail(%r)' % (
+                    prefix, '%s can\'t be assigned like this' % k))
+            else:
+                lines.append('%s%s(%s)' % (
+                    prefix, self.function_name(x.setter), value))
+        else:
+            lines.append('%s_fail(%r)' % (
+                prefix, '%s can\'t be assigned' % k))
+
+    def compile_index_lhs(self, lhs, value, ctx, lines, indent):
+        prefix = '    ' * indent
+        key = qualified_name(lhs.func)
+        args = [self.compile_expression(arg, ctx) for arg in lhs.args]
+        if key is not None and (len(key) != 1 or key[0] not in ctx.locals):
+            x = self.lookup(key)
+            if isinstance(x, ns.Accessor):
+                if x.setter is None:
+                    lines.append('%s_fail(%r)' % (
+                        prefix, '%s has no setter' % '.'.join(key)))
+                else:
+                    lines.append('%s%s(%s)' % (
+                        prefix, self.function_name(x.setter),
+                        ', '.join(self.copy_arguments([x.setter], args) +
+                                  [value])))
+                return
+        if len(args) != 1:
+            raise ExecutionError('%s: arrays have one index' % lhs)
+        base, shape = self.compile_expression(lhs.func, ctx)
+        lines.append('%s%s[%s] = %s' % (
+            prefix, parenthesize(base), args[0][0], value))
+
+    def compile_declaration(self, datatype, lhs, expression, ctx, lines,
+                            indent):
+        assert isinstance(lhs, expr.Identifier)
+        data = lhs.name.data
+        if expression is None:
+            src = self.compile_default(datatype, ctx)
+        else:
+            src, shape = self.compile_value(expression, datatype, ctx)
+        ctx.types[data] = datatype
+        lines.append('%s%s = %s' % ('    ' * indent, ctx.local(data), src))
+
+    # Statements
+
+    def compile_block(self, body, ctx, lines, indent):
+        n = len(lines)
+        for statement in body:
+            self.compile_statement(statement, ctx, lines, indent)
+        if len(lines) == n:
+            lines.append('    ' * indent + 'pass')
+
+    def compile_statement(self, statement, ctx, lines, indent):
+        prefix = '    ' * indent
+        if isinstance(statement, stmt.Assignment):
+            datatype = None
+            if isinstance(statement.lhs, expr.Identifier):
+                datatype = ctx.types.get(statement.lhs.name.data)
+            value, shape = self.compile_value(statement.expression, datatype,
+                                              ctx)
+            if isinstance(statement.lhs, expr.Identifier) and \
+               datatype is None:
+                data = statement.lhs.name.data
+                if data not in ctx.shapes:
+                    ctx.shapes[data] = shape
+                elif ctx.shapes[data] != shape:
+                    ctx.shapes[data] = None
+            self.compile_lhs(statement.lhs, value, ctx, lines, indent)
+        elif isinstance(statement, stmt.ConstantAssignment):
+            self.compile_declaration(statement.datatype, statement.lhs,
+                                     statement.expression, ctx, lines,
+                                     indent)
+        elif isinstance(statement, stmt.Declaration):
+            for lhs, expression in statement.variables:
+                self.compile_declaration(statement.datatype, lhs,
+                                         expression, ctx, lines, indent)
+        elif isinstance(statement, stmt.FunctionCall):
+            key = qualified_name(statement.func)
+            if key is None:
+                raise ExecutionError('can\'t call %s' % statement.func)
+            src, shape = self.compile_call(
+                key, [self.compile_expression(arg, ctx)
+                      for arg in statement.args], ctx)
+            lines.append(prefix + src)
+        elif isinstance(statement, stmt.See) or \
+             isinstance(statement, stmt.SeeIdentifier):
+            lines.append('%sraise _rt.See(%r)' % (
+                prefix, str(statement.target)))
+        elif isinstance(statement, stmt.Undefined):
+            lines.append(prefix + 'raise _rt.Undefined()')
+        elif isinstance(statement, stmt.Unpredictable):
+            lines.append(prefix + 'raise _rt.Unpredictable()')
+        elif isinstance(statement, stmt.ImplementationDefined):
+            lines.append('%s_S.implementation_defined_statement(%r)' % (
+                prefix, statement.aspect))
+        elif isinstance(statement, stmt.If):
+            keyword = 'if'
+            while True:
+                c, shape = self.compile_expression(statement.expression, ctx)
+                lines.append('%s%s %s:' % (prefix, keyword, c))
+                self.compile_block(statement.then_body, ctx, lines,
+                                   indent + 1)
+                if len(statement.else_body) != 1 or \
+                   not isinstance(statement.else_body[0], stmt.If):
+                    break
+                statement = statement.else_body[0]
+                keyword = 'elif'
+            if statement.else_body:
+                lines.append(prefix + 'else:')
+                self.compile_block(statement.else_body, ctx, lines,
+                                   indent + 1)
+        elif isinstance(statement, stmt.For):
+            var = ctx.local(statement.var.name.data)
+            ctx.types[statement.var.name.data] = dtype.Integer()
+            start, shape = self.compile_expression(statement.start, ctx)
+            stop, shape = self.compile_expression(statement.stop, ctx)
+            if statement.down:
+                lines.append('%sfor %s in range(%s, %s - 1, -1):' % (
+                    prefix, var, start, parenthesize(stop)))
+            else:
+                lines.append('%sfor %s in range(%s, %s + 1):' % (
+                    prefix, var, start, parenthesize(stop)))
+            self.compile_block(statement.body, ctx, lines, indent + 1)
+        elif isinstance(statement, stmt.While):
+            c, shape = self.compile_expression(statement.condition, ctx)
+            lines.append('%swhile %s:' % (prefix, c))
+            self.compile_block(statement.body, ctx, lines, indent + 1)
+        elif isinstance(statement, stmt.Repeat):
+            lines.append(prefix + 'while True:')
+            self.compile_block(statement.body, ctx, lines, indent + 1)
+            c, shape = self.compile_expression(statement.condition, ctx)
+            lines.append('%s    if %s:' % (prefix, c))
+            lines.append('%s        break' % prefix)
+        elif isinstance(statement, stmt.Case):
+            self.compile_case(statement, ctx, lines, indent)
+        elif isinstance(statement, stmt.Assert):
+            c, shape = self.compile_expression(statement.expression, ctx)
+            lines.append('%sif not %s:' % (prefix, parenthesize(c)))
+            lines.append('%s    raise _rt.AssertionFailure(%r)' % (
+                prefix, str(statement.expression)))
+        elif isinstance(statement, stmt.Return):
+            if statement.value is None:
+                lines.append(prefix + 'return')
+            else:
+                lines.append('%sreturn %s' % (prefix, self.compile_value(
+                    statement.value, ctx.result_type, ctx)[0]))
+        elif isinstance(statement, stmt.LocalDeclaration):
+            assert isinstance(statement.decl, decl.Enumeration)
+            for value in statement.decl.values:
+                ctx.enumerations.add(value.data)
+        else:
+            assert False
+
+    # A case statement is an if/elif chain on a temporary; if all
+    # patterns are bitvectors, the temporary holds the integer value.
+    def compile_case(self, statement, ctx, lines, indent):
+        prefix = '    ' * indent
+        c, shape = self.compile_expression(statement.expression, ctx)
+        patterns = [pattern for clause in statement.clauses
+                            if clause.patterns is not None
+                            for pattern in clause.patterns]
+        bitvectors = patterns and all(isinstance(pattern, token.Bitvector)
+                                      for pattern in patterns)
+        t = ctx.temporary()
+        if bitvectors:
+            lines.append('%s%s = %s.value' % (prefix, t, operand(c)))
+        else:
+            lines.append('%s%s = %s' % (prefix, t, c))
+        keyword = 'if'
+        for clause in statement.clauses:
+            if clause.patterns is None:
+                lines.append(prefix + 'else:' if keyword == 'elif'
+                             else prefix + 'if True:')
+            else:
+                tests = [self.compile_case_pattern(pattern, t, bitvectors,
+                                                   ctx)
+                         for pattern in clause.patterns]
+                lines.append('%s%s %s:' % (prefix, keyword,
+                                           ' or '.join(tests)))
+            self.compile_block(clause.body, ctx, lines, indent + 1)
+            keyword = 'elif'
+
+    def compile_case_pattern(self, pattern, t, bitvectors, ctx):
+        if isinstance(pattern, token.Number):
+            return '%s == %d' % (t, int(pattern.data))
+        if isinstance(pattern, token.HexadecimalNumber):
+            return '%s == %d' % (t, int(pattern.data, 16))
+        if isinstance(pattern, token.Bitvector):
+            p = bits.literal(pattern.data)
+            if not isinstance(p, bits.Pattern):
+                if bitvectors:
+                    return '%s == %d' % (t, p.value)
+                return '%s == %s' % (t, self.literal(p))
+            if bitvectors:
+                return '%s & %d == %d' % (t, p.mask, p.value)
+            return '%s.value & %d == %d' % (t, p.mask, p.value)
+        c, shape = self.compile_name(pattern.data, ctx)
+        return '%s == %s' % (t, c)
+
+# Loading
+
+class Semantics:
+    def __init__(self, library_code, instructions_code, state = None):
+        if state is None:
+            state = runtime.State()
+        self.state = state
+        self.globals = {'__name__': 'asl_semantics',
+                        '__builtins__': builtins}
+        exec(library_code, self.globals)
+        exec(instructions_code, self.globals)
+        self.globals['bind'](state)
+        self.functions = self.globals['FUNCTIONS']
+        self.instructions = self.globals['INSTRUCTIONS']
+
+    # call a library function by its qualified name
+    def call(self, name, *args, width = None):
+        try:
+            function_name, width_keyword = self.functions[name, len(args)]
+        except KeyError:
+            raise ExecutionError('no function %s with %d arguments' % (
+                name, len(args)))
+        function = self.globals[function_name]
+        if width is None or width_keyword is None:
+            return function(*args)
+        return function(*args, **{width_keyword: width})
+
+    # the Python function of an instruction and the names of its
+    # inputs (i.e. the encoding fields)
+    def instruction(self, name):
+        function_name, inputs = self.instructions[name]
+        return self.globals[function_name], inputs
+
+    # run an instruction; inputs which it doesn't use are ignored
+    def execute(self, name, **inputs):
+        function, names = self.instruction(name)
+        return function(**{local_name(data): inputs[data]
+                           for data in names if data in inputs})
+
+# Generated modules are stored as source and as compiled code in a
+# directory per key, so they can be read (and show up in tracebacks).
+
+class Cache:
+    def __init__(self, path):
+        self.path = path
+
+    def key(self, digest, prefer_builtins):
+        h = hashlib.sha1()
+        h.update(cache.source_version().encode() + b'\0')
+        h.update(importlib.util.MAGIC_NUMBER)
+        h.update(('%s\0%r' % (digest, prefer_builtins)).encode())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def load(self, key):
+        d = self._entry_path(key)
+        codes = []
+        for name in ['library', 'instructions']:
+            try:
+                with open(os.path.join(d, name + '.pyc'), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            if data[:16] != importlib.util.MAGIC_NUMBER + bytes(12):
+                return None
+            try:
+                codes.append(marshal.loads(data[16:]))
+            except (EOFError, ValueError, TypeError):
+                return None
+        return codes
+
+    # compiles the sources and stores both
+    def store(self, key, sources):
+        d = self._entry_path(key)
+        os.makedirs(d, exist_ok = True)
+        codes = []
+        for name, source in zip(['library', 'instructions'], sources):
+            path = os.path.join(d, name + '.py')
+            code = compile(source, path, 'exec')
+            codes.append(code)
+            for fn, data in [
+                    (path, source.encode()),
+                    (path + 'c', importlib.util.MAGIC_NUMBER + bytes(12) +
+                                 marshal.dumps(code))]:
+                # write to a temporary file first so concurrent readers
+                # never see a partially written entry
+                tmp_path = '%s.%d.tmp' % (fn, os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, fn)
+        return codes
+
+def generate(namespace = None, instructions = (), digest = None,
+             prefer_builtins = True):
+    return Generator(namespace, prefer_builtins).generate(instructions,
+                                                          digest)
+
+# Translates the library functions of the namespace and the given
+# instructions, or loads the result from the cache at path if the
+# digest of the specification matches, and binds it to state.
+def load(namespace = None, instructions = (), digest = None, path = None,
+         state = None, prefer_builtins = True):
+    codes = None
+    if path is not None and digest is not None:
+        c = Cache(path)
+        key = c.key(digest, prefer_builtins)
+        codes = c.load(key)
+    if codes is None:
+        sources = generate(namespace, instructions, digest, prefer_builtins)
+        if path is not None and digest is not None:
+            codes = c.store(key, sources)
+        else:
+            codes = [compile(source, '<%s>' % name, 'exec')
+                     for name, source in zip(['library', 'instructions'],
+                                             sources)]
+    return Semantics(codes[0], codes[1], state)
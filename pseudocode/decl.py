@@ -29,6 +29,8 @@ class Function:
         self.overload = overload
         self.parameters = parameters
         self.body = body
+        # set by the resolver: the binding of each name used in the body
+        self.bindings = None
 
     def dump(self):
         name = '.'.join(str(part) for part in self.name)
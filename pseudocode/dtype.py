@@ -18,6 +18,9 @@ from . import token, expr, dtype
 from . import ParseError
 
 class Bit:
+    def __reduce__(self):
+        return 'dt_bit'
+
     def __str__(self):
         return 'bit'
 
@@ -29,10 +32,16 @@ class Bits:
         return 'bits(%s)' % str(self.expression)
 
 class Boolean:
+    def __reduce__(self):
+        return 'dt_boolean'
+
     def __str__(self):
         return 'boolean'
 
 class Integer:
+    def __reduce__(self):
+        return 'dt_integer'
+
     def __str__(self):
         return 'integer'
 
@@ -51,6 +60,9 @@ class Custom:
         return '.'.join(str(part) for part in self.name)
 
 class Void:
+    def __reduce__(self):
+        return 'dt_void'
+
     def __str__(self):
         return 'void'
 
@@ -14,72 +14,194 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
 import os
 import sys
 import traceback
 
-class LexError(Exception):
+# Error reports show a window of CONTEXT_TOKENS tokens resp.
+# CONTEXT_CHARS characters on either side of the error position, so
+# the cost of reporting doesn't depend on the size of the fragment.
+
+CONTEXT_TOKENS = 8
+CONTEXT_CHARS = 60
+
+# if set, reported errors are also appended to this file as JSON lines
+diagnostics_file = None
+
+def write_traceback():
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+
+    cwd = os.getcwd()
+    if not cwd.endswith('/'):
+        cwd = cwd + '/'
+
+    sys.stderr.write('\n')
+    for fn, lineno, func, text in traceback.extract_tb(exc_traceback):
+        if fn.startswith(cwd):
+            fn = fn[len(cwd):]
+        sys.stderr.write('%-26s%-18s%s\n' % (
+            '%s:%s' % (fn, lineno), func, text[:36]))
+    del exc_traceback  # avoid circular reference
+
+# 1-based column of a position in a text
+def source_column(text, offset):
+    return offset - text.rfind('\n', 0, offset)
+
+# the line around a position, clipped to the context window
+def write_source_line(text, offset):
+    lower = max(0, offset - CONTEXT_CHARS)
+    start = text.rfind('\n', lower, offset) + 1
+    prefix = ''
+    if start == 0 and lower != 0:
+        start = lower
+        prefix = '...'
+    upper = min(len(text), offset + CONTEXT_CHARS)
+    stop = text.find('\n', offset, upper)
+    suffix = ''
+    if stop == -1:
+        stop = upper
+        if upper != len(text):
+            suffix = '...'
+
+    sys.stderr.write('\n')
+    sys.stderr.write(prefix + text[start:stop] + suffix + '\n')
+    sys.stderr.write(' ' * (len(prefix) + offset - start) + '^\n')
+
+# Both errors are raised without knowing where the text came from;
+# whoever catches them can call locate() with the file and fragment
+# name, the fragment text, the offset and line of the error in it and
+# the line and (0-based) column in the file at which the text starts.
+
+class SourceError(Exception):
+    kind = None
+    end = 'end of input'
+
+    def __init__(self):
+        self.fn = None
+        self.fragment = None
+        self.text = None
+        self.offset = None
+        self.line = None
+        self.start = None
+
+    def locate(self, fn, fragment, text, offset, line, start = None):
+        self.fn = fn
+        self.fragment = fragment
+        self.text = text
+        self.offset = offset
+        self.line = line
+        self.start = start
+
+    # texts of the tokens which would have been accepted
+    def expected(self):
+        return []
+
+    # text of the offending token or character, None at the end
+    def found(self):
+        return None
+
+    # machine-readable record of the error
+    def diagnostic(self):
+        line = column = None
+        if self.text is not None and self.offset is not None:
+            line = self.line
+            column = source_column(self.text, self.offset)
+            if self.start is not None:
+                if line == 1:
+                    column += self.start[1]
+                line += self.start[0] - 1
+        return {
+            'kind': self.kind,
+            'file': self.fn,
+            'fragment': self.fragment,
+            'line': line,
+            'column': column,
+            'expected': self.expected(),
+            'found': self.found()
+        }
+
+    def write_header(self):
+        d = self.diagnostic()
+        location = ':'.join(str(x) for x in [d['file'], d['line'],
+                                             d['column']]
+                            if x is not None)
+        msg = '%s error' % self.kind
+        if d['fragment'] is not None:
+            msg += ' in %s' % d['fragment']
+        if d['found'] is not None:
+            found = repr(d['found'])
+        else:
+            found = self.end
+        if d['expected']:
+            msg += ': expected %s, found %s' % (
+                ' or '.join(repr(s) for s in d['expected']), found)
+        else:
+            msg += ': unexpected %s' % found
+        sys.stderr.write('\n%s%s\n' % (
+            location + ': ' if location else '', msg))
+
+        if diagnostics_file is not None:
+            with open(diagnostics_file, 'a') as f:
+                f.write(json.dumps(d, sort_keys = True) + '\n')
+
+class LexError(SourceError):
+    kind = 'lex'
+
     def __init__(self, data, pos):
+        SourceError.__init__(self)
         self.data = data
         self.pos = pos
 
-    def report(self):
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-
-        cwd = os.getcwd()
-        if not cwd.endswith('/'):
-            cwd = cwd + '/'
+    def found(self):
+        if self.pos < len(self.data):
+            return self.data[self.pos]
+        return None
 
-        sys.stderr.write('\n')
-        for fn, lineno, func, text in traceback.extract_tb(exc_traceback):
-            if fn.startswith(cwd):
-                fn = fn[len(cwd):]
-            sys.stderr.write('%-26s%-18s%s\n' % (
-                '%s:%s' % (fn, lineno), func, text[:36]))
-        del exc_traceback  # avoid circular reference
-
-        start = 0
-        while True:
-            try:
-                p = self.data.index('\n', start) + 1
-            except ValueError:
-                break
-            if p >= self.pos:
-                break
-            start = p
-        try:
-            stop = self.data.index('\n', start)
-        except ValueError:
-            stop = len(self.data)
+    def report(self):
+        write_traceback()
+        self.write_header()
+        if self.text is not None and self.offset is not None:
+            write_source_line(self.text, self.offset)
+        else:
+            write_source_line(self.data, self.pos)
 
-        sys.stderr.write('\n')
-        sys.stderr.write(self.data[start:stop] + '\n')
-        sys.stderr.write(' ' * (self.pos - start) + '^\n')
+class ParseError(SourceError):
+    kind = 'parse'
+    end = 'end of statement'
 
-class ParseError(Exception):
-    def __init__(self, ts):
+    def __init__(self, ts, expected = None):
+        SourceError.__init__(self)
         self.ts = ts
+        self.expected_tokens = expected
 
-    def report(self):
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-
-        #sys.stderr.write('Traceback (most recent call last):\n')
-        #traceback.print_tb(exc_traceback)
+    def expected(self):
+        if self.expected_tokens is None:
+            return []
+        return sorted(set(str(t) for t in self.expected_tokens))
 
-        cwd = os.getcwd()
-        if not cwd.endswith('/'):
-            cwd = cwd + '/'
+    def found(self):
+        if self.ts.pos < self.ts.stop:
+            t = self.ts.tokens[self.ts.pos]
+            if isinstance(t, list):
+                return '[...]'
+            return str(t)
+        return None
 
-        sys.stderr.write('\n')
-        for fn, lineno, func, text in traceback.extract_tb(exc_traceback):
-            if fn.startswith(cwd):
-                fn = fn[len(cwd):]
-            sys.stderr.write('%-26s%-18s%s\n' % (
-                '%s:%s' % (fn, lineno), func, text[:36]))
-        del exc_traceback  # avoid circular reference
+    def report(self):
+        write_traceback()
+        self.write_header()
+        if self.text is not None and self.offset is not None:
+            write_source_line(self.text, self.offset)
 
+        tokens = self.ts.tokens
+        start = max(0, self.ts.pos - CONTEXT_TOKENS)
+        stop = min(len(tokens), self.ts.pos + CONTEXT_TOKENS + 1)
         sys.stderr.write('\n')
-        for i, t in enumerate(self.ts.tokens):
+        if start != 0:
+            sys.stderr.write('    ... (%d tokens)\n' % start)
+        for i in range(start, stop):
+            t = tokens[i]
             if i == self.ts.pos:
                 sys.stderr.write('### ')
             else:
@@ -91,3 +213,5 @@ class ParseError(Exception):
                     ' ...' if len(t) > 10 else ''))
             else:
                 sys.stderr.write(str(t) + '\n')
+        if stop != len(tokens):
+            sys.stderr.write('    ... (%d tokens)\n' % (len(tokens) - stop))
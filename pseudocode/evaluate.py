@@ -0,0 +1,1033 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import fractions
+
+from . import token, expr, stmt, dtype, decl, ns, runtime, bits
+from .bits import Bits
+from .runtime import ExecutionError
+
+# Executing pseudocode
+#
+# Each function body is compiled once into a tree of closures: all the
+# isinstance() dispatch on the syntax tree, name lookups and overload
+# resolution happen while compiling, and what is left for run time is
+# a call per node.  Local variables are numbered when they are first
+# seen, and a call gets a frame, a list with one slot per variable, so
+# a variable is read and written by index.
+#
+# An expression compiles to a function taking the frame and returning
+# the value.  A statement compiles to a function taking the frame and
+# returning None, or a 1-tuple with the return value when a 'return'
+# statement has been executed.
+#
+# Functions are compiled when they are first called, so code which is
+# never reached costs nothing and names which can't be resolved only
+# raise an ExecutionError if the code using them is actually run.
+#
+#     evaluator = evaluate.Evaluator(spec.namespace)
+#     evaluator.call('AddWithCarry', x, y, Bits(0, 1))
+#
+# Not supported: parameters passed by reference aren't written back.
+
+class Context:
+    def __init__(self):
+        self.slots = {}
+        # declared types of local variables, for the result width of
+        # calls assigned to them
+        self.types = {}
+        self.enumerations = set()
+        self.result_type = None
+
+    def slot(self, data):
+        try:
+            return self.slots[data]
+        except KeyError:
+            i = self.slots[data] = len(self.slots)
+            return i
+
+def constant(value):
+    def c(f):
+        return value
+    c.value = value
+    return c
+
+def is_constant(c):
+    return hasattr(c, 'value')
+
+def failure(message):
+    def fail(f, *args):
+        raise ExecutionError(message)
+    return fail
+
+# the tuple of names for an identifier chain, or None
+def qualified_name(expression):
+    if isinstance(expression, expr.Identifier):
+        return expression.name.data,
+    if isinstance(expression, expr.QualifiedIdentifier):
+        prefix = qualified_name(expression.expression)
+        if prefix is not None:
+            return prefix + (expression.name.data, )
+    return None
+
+def run_block(statements):
+    if not statements:
+        return lambda f: None
+    if len(statements) == 1:
+        return statements[0]
+    if len(statements) == 2:
+        s0, s1 = statements
+        def block(f):
+            r = s0(f)
+            if r is not None:
+                return r
+            return s1(f)
+        return block
+    def block(f):
+        for s in statements:
+            r = s(f)
+            if r is not None:
+                return r
+    return block
+
+def arguments(args):
+    if not args:
+        return lambda f: []
+    if len(args) == 1:
+        a0, = args
+        return lambda f: [a0(f)]
+    if len(args) == 2:
+        a0, a1 = args
+        return lambda f: [a0(f), a1(f)]
+    if len(args) == 3:
+        a0, a1, a2 = args
+        return lambda f: [a0(f), a1(f), a2(f)]
+    return lambda f: [a(f) for a in args]
+
+# a compiled function; compiled on its first call
+class Function:
+    def __init__(self, evaluator, declaration):
+        self.evaluator = evaluator
+        self.declaration = declaration
+        self.run = self.compile_and_run
+
+    def compile_and_run(self, args, width = None):
+        self.run = self.evaluator.compile_function(self.declaration)
+        return self.run(args, width)
+
+# a compiled instruction (or other piece of code outside a function)
+class Code:
+    def __init__(self, run, slots):
+        self.run = run
+        self.slots = slots
+
+    # the values of the local variables in a frame returned by run()
+    def variables(self, frame):
+        return {data: frame[i] for data, i in self.slots.items()}
+
+class Evaluator:
+    def __init__(self, namespace = None, state = None):
+        if namespace is None:
+            namespace = ns.global_ns
+        if state is None:
+            state = runtime.State()
+        self.namespace = namespace
+        self.state = state
+        self.variables = state.variables
+        self.functions = {}
+        self.constants = {}
+
+    # call a library function by its qualified name
+    def call(self, name, *args, width = None):
+        key = tuple(name.split('.'))
+        c = self.compile_call(key, [constant(arg) for arg in args],
+                              Context(), None if width is None
+                                              else constant(width))
+        return c(None)
+
+    # Compile one or more bodies (e.g. the decode and execute fragments
+    # of an instruction) which share their local variables.  The
+    # returned Code's run() takes the values of the given input
+    # variables (e.g. the encoding fields), runs the bodies in order
+    # and returns the frame.
+    def compile_code(self, bodies, inputs = ()):
+        ctx = Context()
+        for data in inputs:
+            ctx.slot(data)
+        blocks = [self.compile_block(body, ctx) for body in bodies]
+        n = len(ctx.slots)
+        k = len(inputs)
+        def run(*values):
+            if len(values) != k:
+                raise ExecutionError('expected %d inputs, got %d' % (
+                    k, len(values)))
+            f = list(values) + [None] * (n - k)
+            for block in blocks:
+                if block(f) is not None:
+                    break
+            return f
+        return Code(run, ctx.slots)
+
+    def function(self, declaration):
+        try:
+            return self.functions[id(declaration)]
+        except KeyError:
+            function = self.functions[id(declaration)] = \
+                Function(self, declaration)
+            return function
+
+    def compile_function(self, declaration):
+        ctx = Context()
+        params = declaration.parameters or []
+        for param_type, param_name, by_reference in params:
+            ctx.slot(param_name.data)
+            ctx.types[param_name.data] = param_type
+        if declaration.functype == decl.SETTER:
+            ctx.slot(declaration.result_name.data)
+            ctx.types[declaration.result_name.data] = declaration.result_type
+            typed = params + [(declaration.result_type,
+                               declaration.result_name, False)]
+        else:
+            typed = params
+
+        # the width of bits(N) arguments binds N
+        widths = []
+        for i, (param_type, param_name, by_reference) in enumerate(typed):
+            if isinstance(param_type, dtype.Bits) and \
+               isinstance(param_type.expression, expr.Identifier):
+                data = param_type.expression.name.data
+                if data not in ctx.slots:
+                    widths.append((i, ctx.slot(data)))
+        # as does the width the caller expects for a bits(N) result
+        result_slot = None
+        if declaration.functype != decl.SETTER:
+            ctx.result_type = declaration.result_type
+        if declaration.functype != decl.SETTER and \
+           isinstance(declaration.result_type, dtype.Bits) and \
+           isinstance(declaration.result_type.expression, expr.Identifier):
+            data = declaration.result_type.expression.name.data
+            if data not in ctx.slots:
+                result_slot = ctx.slot(data)
+
+        body = self.compile_block(declaration.body, ctx)
+        n = len(ctx.slots)
+        k = len(typed)
+        name = '.'.join(str(part) for part in declaration.name)
+
+        def run(args, width = None):
+            if len(args) != k:
+                raise ExecutionError('%s: expected %d arguments, got %d' % (
+                    name, k, len(args)))
+            f = args + [None] * (n - k)
+            for i, j in widths:
+                f[j] = args[i].width
+            if result_slot is not None:
+                f[result_slot] = width
+            r = body(f)
+            if r is not None:
+                return r[0]
+        return run
+
+    def compile_block(self, body, ctx):
+        return run_block([self.compile_statement(statement, ctx)
+                          for statement in body])
+
+    # Names
+
+    def lookup(self, key):
+        x = self.namespace.index.get(key)
+        if isinstance(x, ns.Namespace):
+            return None
+        return x
+
+    def compile_name(self, data, ctx):
+        try:
+            i = ctx.slots[data]
+        except KeyError:
+            pass
+        else:
+            return lambda f: f[i]
+        if data in ctx.enumerations:
+            return constant(data)
+        x = ns.lookup_single(data, self.namespace)
+        if x is ns.MISSING:
+            # used before it is assigned, e.g. in a loop
+            i = ctx.slot(data)
+            return lambda f: f[i]
+        return self.compile_global((data, ), x)
+
+    def compile_global(self, key, x):
+        k = '.'.join(key)
+        variables = self.variables
+        if x is None:
+            # implicitly defined, see ns.implicit
+            def read(f):
+                try:
+                    return variables[k]
+                except KeyError:
+                    raise ExecutionError('%s has no value' % k)
+            return read
+        if isinstance(x, ns.Enumeration):
+            return constant(key[-1])
+        if isinstance(x, ns.Variable):
+            if x.declaration.is_constant:
+                return constant(self.global_constant(k, x))
+            self.init_variable(k, x)
+            return lambda f: variables[k]
+        if isinstance(x, ns.Array):
+            self.init_array(k, x)
+            return lambda f: variables[k]
+        if isinstance(x, ns.Accessor):
+            if x.getter is None or x.getter.parameters:
+                return failure('%s can\'t be read like this' % k)
+            function = self.function(x.getter)
+            return lambda f: function.run([])
+        return failure('%s is not a value' % k)
+
+    def global_constant(self, k, x):
+        try:
+            return self.constants[k]
+        except KeyError:
+            pass
+        c = self.compile_expression(x.expression, Context())
+        value = self.constants[k] = c([])
+        return value
+
+    def init_variable(self, k, x):
+        if k in self.variables:
+            return
+        ctx = Context()
+        if x.expression is not None:
+            c = self.compile_expression(x.expression, ctx)
+        else:
+            c = self.compile_default(x.declaration.datatype, ctx)
+        self.variables[k] = c([None] * len(ctx.slots))
+
+    def init_array(self, k, x):
+        if k in self.variables:
+            return
+        c = self.compile_default(x.declaration.datatype, Context())
+        self.variables[k] = c([])
+
+    # the value of a variable of the given type which hasn't been
+    # assigned yet
+    def compile_default(self, datatype, ctx):
+        if isinstance(datatype, dtype.Bit):
+            return constant(Bits(0, 1))
+        if isinstance(datatype, dtype.Bits):
+            width = self.compile_expression(datatype.expression, ctx)
+            make = bits.make
+            return lambda f: make(0, width(f))
+        if isinstance(datatype, dtype.Boolean):
+            return constant(False)
+        if isinstance(datatype, dtype.Integer):
+            return constant(0)
+        if isinstance(datatype, dtype.Void):
+            return constant(None)
+        if isinstance(datatype, dtype.Compound):
+            parts = [self.compile_default(partial_type, ctx)
+                     for partial_type in datatype.partial_types]
+            return lambda f: tuple(part(f) for part in parts)
+        if isinstance(datatype, dtype.Array):
+            base = self.compile_default(datatype.base, ctx)
+            start = self.compile_expression(datatype.start, ctx)
+            stop = self.compile_expression(datatype.stop, ctx)
+            return lambda f: {i: base(f)
+                              for i in range(start(f), stop(f) + 1)}
+        if isinstance(datatype, dtype.Custom):
+            key = tuple(str(part) for part in datatype.name)
+            x = self.lookup(key)
+            if isinstance(x, ns.Struct):
+                if x.declaration.fields is None:
+                    return constant(None)
+                name = '.'.join(key)
+                fields = [(field_name.data,
+                           self.compile_default(field_type, ctx))
+                          for field_type, field_name
+                              in x.declaration.fields]
+                return lambda f: runtime.Record(
+                    name, {data: c(f) for data, c in fields})
+            if isinstance(x, ns.Type):
+                return self.compile_default(x.declaration.datatype, ctx)
+            if isinstance(x, ns.Enumeration):
+                return constant(x.declaration.values[0].data)
+            if key == ('real', ):
+                return constant(0)
+            return constant(None)
+        assert False
+
+    # Calls
+
+    def compile_call(self, key, args, ctx, width = None):
+        name = '.'.join(key)
+        x = self.lookup(key)
+        if isinstance(x, ns.Accessor):
+            if x.getter is None:
+                return failure('%s has no getter' % name)
+            return self.compile_invocation(
+                name, [x.getter], args, width)
+        if not isinstance(x, ns.Function):
+            return failure('%s is not a function' % name)
+        candidates = x.candidates(len(args))
+        declarations = [declaration for declaration in candidates
+                        if declaration.body is not None]
+        builtin = self.state.builtins.get((name, len(args)))
+        if not declarations or builtin is not None and \
+                               self.state.prefer_builtins:
+            if builtin is None:
+                return failure('%s with %d arguments has no body' % (
+                    name, len(args)))
+            if width is None and len(args) == 1:
+                a0, = args
+                return lambda f: builtin(a0(f))
+            if width is None and len(args) == 2:
+                a0, a1 = args
+                return lambda f: builtin(a0(f), a1(f))
+            get_args = arguments(args)
+            if width is None:
+                return lambda f: builtin(*get_args(f))
+            return lambda f: builtin(*get_args(f), width = width(f))
+        return self.compile_invocation(name, declarations, args, width)
+
+    # whether arguments for a parameter of the type are structures or
+    # arrays, which are copied on the call like on assignment
+    def needs_copy(self, datatype):
+        if isinstance(datatype, dtype.Array):
+            return True
+        if isinstance(datatype, dtype.Custom):
+            return not isinstance(
+                self.lookup(tuple(str(part) for part in datatype.name)),
+                ns.Enumeration)
+        return False
+
+    def copy_arguments(self, declarations, args):
+        copy_value = runtime.copy_value
+        copied = []
+        for i, a in enumerate(args):
+            for declaration in declarations:
+                params = declaration.parameters or []
+                if i < len(params) and not params[i][2] and \
+                   self.needs_copy(params[i][0]):
+                    a = lambda f, a = a: copy_value(a(f))
+                    break
+            copied.append(a)
+        return copied
+
+    def compile_invocation(self, name, declarations, args, width):
+        get_args = arguments(self.copy_arguments(declarations, args))
+        if len(declarations) == 1:
+            function = self.function(declarations[0])
+            if width is None:
+                return lambda f: function.run(get_args(f))
+            return lambda f: function.run(get_args(f), width(f))
+
+        # pick the overload by the values of the arguments
+        overloads = [(tuple(ns.type_shape(param_type)
+                            for param_type, param_name, by_reference
+                                in declaration.parameters),
+                      self.function(declaration))
+                     for declaration in declarations]
+        def call(f):
+            values = get_args(f)
+            for shape, function in overloads:
+                if all(runtime.shape_matches(value, s)
+                       for value, s in zip(values, shape)):
+                    return function.run(values,
+                                        None if width is None else width(f))
+            raise ExecutionError('no overload of %s matches %r' % (
+                name, values))
+        return call
+
+    # Expressions
+
+    def compile_expression(self, expression, ctx, width = None):
+        if isinstance(expression, expr.Identifier):
+            return self.compile_name(expression.name.data, ctx)
+        elif isinstance(expression, expr.QualifiedIdentifier):
+            key = qualified_name(expression)
+            if key is not None and key[0] not in ctx.slots:
+                x = self.lookup(key)
+                if x is not None:
+                    return self.compile_global(key, x)
+            base = self.compile_expression(expression.expression, ctx)
+            data = expression.name.data
+            return lambda f: base(f).fields[data]
+        elif isinstance(expression, expr.Arguments):
+            if expression.method == '()':
+                key = qualified_name(expression.func)
+                if key is None:
+                    raise ExecutionError('can\'t call %s' % expression.func)
+                args = [self.compile_expression(arg, ctx)
+                        for arg in expression.args]
+                return self.compile_call(key, args, ctx, width)
+            if expression.method == '[]':
+                return self.compile_index(expression, ctx, width)
+            return self.compile_slice(expression, ctx)
+        elif isinstance(expression, expr.Set):
+            raise ExecutionError('set outside of IN: %s' % expression)
+        elif isinstance(expression, expr.Numeric):
+            t = expression.number_or_bitvector
+            if isinstance(t, token.Number):
+                if '.' in t.data:
+                    return constant(fractions.Fraction(t.data))
+                return constant(int(t.data))
+            if isinstance(t, token.HexadecimalNumber):
+                return constant(int(t.data, 16))
+            value = bits.literal(t.data)
+            if isinstance(value, bits.Pattern):
+                raise ExecutionError('pattern %s used as a value' % t)
+            return constant(value)
+        elif isinstance(expression, expr.Unary):
+            a = self.compile_expression(expression.arg, ctx)
+            op = expression.operator.data
+            if is_constant(a):
+                return constant(self.compile_unary(op, a)(None))
+            return self.compile_unary(op, a)
+        elif isinstance(expression, expr.Operator):
+            return self.compile_operator(expression, ctx)
+        elif isinstance(expression, expr.Ternary):
+            c = self.compile_expression(expression.condition, ctx)
+            a = self.compile_expression(expression.arg0, ctx, width)
+            b = self.compile_expression(expression.arg1, ctx, width)
+            return lambda f: a(f) if c(f) else b(f)
+        elif isinstance(expression, expr.Bits):
+            elements = [self.compile_expression(element, ctx)
+                        for element in expression.elements]
+            def concat(f):
+                value = elements[0](f)
+                for element in elements[1:]:
+                    value = runtime.concat(value, element(f))
+                return value
+            return concat
+        elif isinstance(expression, expr.Values):
+            members = [self.compile_expression(member, ctx)
+                       for member in expression.members]
+            return lambda f: tuple(member(f) for member in members)
+        elif isinstance(expression, expr.Omitted):
+            raise ExecutionError('"-" can only be used as LHS')
+        elif isinstance(expression, expr.Unknown):
+            default = self.compile_default(expression.datatype, ctx)
+            unknown = self.state.unknown
+            return lambda f: unknown(default(f))
+        elif isinstance(expression, expr.ImplementationDefined):
+            default = self.compile_default(expression.datatype, ctx)
+            aspect = expression.aspect
+            implementation_defined = self.state.implementation_defined
+            return lambda f: implementation_defined(aspect, default(f))
+        elif isinstance(expression, expr.Primitive):
+            data = expression.token.data
+            if data == 'TRUE':
+                return constant(True)
+            if data == 'FALSE':
+                return constant(False)
+            if data == 'HIGH':
+                return constant(Bits(1, 1))
+            return constant(Bits(0, 1))
+        else:
+            assert False
+
+    def compile_unary(self, op, a):
+        if op == '!':
+            return lambda f: not a(f)
+        if op == '-':
+            return lambda f: -a(f)
+        if op == 'NOT':
+            return lambda f: ~a(f)
+        assert False
+
+    def compile_index(self, expression, ctx, width = None):
+        key = qualified_name(expression.func)
+        args = [self.compile_expression(arg, ctx) for arg in expression.args]
+        if key is not None and (len(key) != 1 or key[0] not in ctx.slots):
+            x = self.lookup(key)
+            if isinstance(x, ns.Accessor):
+                return self.compile_call(key, args, ctx, width)
+            if not isinstance(x, ns.Array) and x is not None:
+                return failure('%s can\'t be indexed' % '.'.join(key))
+        if len(args) != 1:
+            raise ExecutionError('%s: arrays have one index' % expression)
+        base = self.compile_expression(expression.func, ctx)
+        index, = args
+        def read(f):
+            i = index(f)
+            try:
+                return base(f)[i]
+            except KeyError:
+                raise ExecutionError('%s: index %r out of range' % (
+                    expression, i))
+        return read
+
+    # the (hi, lo) closures of each bitspec
+    def compile_bitspecs(self, args, ctx):
+        specs = []
+        for arg in args:
+            if isinstance(arg, tuple):
+                a = self.compile_expression(arg[0], ctx)
+                b = self.compile_expression(arg[2], ctx)
+                if arg[1].data == ':':
+                    specs.append((a, b))
+                elif is_constant(a) and is_constant(b):
+                    specs.append((constant(a.value + b.value - 1), a))
+                else:
+                    specs.append((lambda f, a = a, b = b: a(f) + b(f) - 1, a))
+            else:
+                a = self.compile_expression(arg, ctx)
+                specs.append((a, a))
+        return specs
+
+    def compile_slice(self, expression, ctx):
+        base = self.compile_expression(expression.func, ctx)
+        specs = self.compile_bitspecs(expression.args, ctx)
+        extract = runtime.extract
+        if len(specs) == 1:
+            (hi, lo), = specs
+            if hi is lo:
+                return lambda f: extract(base(f), lo(f), lo(f))
+            return lambda f: extract(base(f), hi(f), lo(f))
+        extract_fields = runtime.extract_fields
+        return lambda f: extract_fields(
+            base(f), [(hi(f), lo(f)) for hi, lo in specs])
+
+    def compile_pattern(self, expression):
+        if isinstance(expression, expr.Numeric) and \
+           isinstance(expression.number_or_bitvector, token.Bitvector):
+            value = bits.literal(expression.number_or_bitvector.data)
+            if isinstance(value, bits.Pattern):
+                return value.matches
+        return None
+
+    # whether the value of a is one of the members; constant members
+    # are looked up in a set, patterns and other members are tried one
+    # after the other
+    def compile_membership(self, a, members, ctx):
+        values = set()
+        patterns = []
+        others = []
+        for member in members:
+            test = self.compile_pattern(member)
+            if test is not None:
+                patterns.append(test)
+                continue
+            c = self.compile_expression(member, ctx)
+            if is_constant(c):
+                values.add(c.value)
+            else:
+                others.append(c)
+        values = frozenset(values)
+        if not patterns and not others:
+            return lambda f: a(f) in values
+        def member(f):
+            x = a(f)
+            if x in values:
+                return True
+            for test in patterns:
+                if test(x):
+                    return True
+            for c in others:
+                if x == c(f):
+                    return True
+            return False
+        return member
+
+    def compile_operator(self, expression, ctx):
+        op = expression.operator.data
+        if op == 'IN':
+            if not isinstance(expression.arg1, expr.Set):
+                raise ExecutionError('IN needs a set: %s' % expression)
+            a = self.compile_expression(expression.arg0, ctx)
+            return self.compile_membership(a, expression.arg1.members, ctx)
+        if op == '==' or op == '!=':
+            test = self.compile_pattern(expression.arg1)
+            if test is not None:
+                a = self.compile_expression(expression.arg0, ctx)
+                if op == '==':
+                    return lambda f: test(a(f))
+                return lambda f: not test(a(f))
+
+        a = self.compile_expression(expression.arg0, ctx)
+        b = self.compile_expression(expression.arg1, ctx)
+        c = self.compile_binary(op, a, b)
+        if is_constant(a) and is_constant(b):
+            return constant(c(None))
+        return c
+
+    def compile_binary(self, op, a, b):
+        if op == '||':
+            return lambda f: a(f) or b(f)
+        if op == '&&':
+            return lambda f: a(f) and b(f)
+        if op == 'OR':
+            return lambda f: a(f) | b(f)
+        if op == 'EOR':
+            return lambda f: a(f) ^ b(f)
+        if op == 'AND':
+            return lambda f: a(f) & b(f)
+        if op == '==':
+            return lambda f: a(f) == b(f)
+        if op == '!=':
+            return lambda f: a(f) != b(f)
+        if op == '<':
+            return lambda f: a(f) < b(f)
+        if op == '<=':
+            return lambda f: a(f) <= b(f)
+        if op == '>':
+            return lambda f: a(f) > b(f)
+        if op == '>=':
+            return lambda f: a(f) >= b(f)
+        if op == '<<':
+            return lambda f: a(f) << b(f)
+        if op == '>>':
+            return lambda f: a(f) >> b(f)
+        if op == ':':
+            concat = runtime.concat
+            return lambda f: concat(a(f), b(f))
+        if op == '+':
+            return lambda f: a(f) + b(f)
+        if op == '-':
+            return lambda f: a(f) - b(f)
+        if op == '*':
+            return lambda f: a(f) * b(f)
+        if op == '/':
+            divide = runtime.divide
+            return lambda f: divide(a(f), b(f))
+        if op == 'DIV':
+            return lambda f: a(f) // b(f)
+        if op == 'MOD':
+            return lambda f: a(f) % b(f)
+        if op == 'REM':
+            rem = runtime.rem
+            return lambda f: rem(a(f), b(f))
+        if op == '^':
+            power = runtime.power
+            return lambda f: power(a(f), b(f))
+        assert False
+
+    # Assignments
+    #
+    # An LHS compiles to a function taking the frame and the value to
+    # store.  Assigning to a slice or a field reads the containing
+    # value, changes it and stores it back.
+
+    def compile_lhs(self, lhs, ctx):
+        if isinstance(lhs, expr.Identifier):
+            data = lhs.name.data
+            if data not in ctx.slots and data not in ctx.enumerations:
+                x = ns.lookup_single(data, self.namespace)
+                if x is not ns.MISSING:
+                    return self.compile_global_lhs((data, ), x)
+            i = ctx.slot(data)
+            def store(f, value):
+                f[i] = value
+            return store
+        elif isinstance(lhs, expr.QualifiedIdentifier):
+            key = qualified_name(lhs)
+            if key is not None and key[0] not in ctx.slots:
+                x = self.lookup(key)
+                if x is not None:
+                    return self.compile_global_lhs(key, x)
+            base = self.compile_expression(lhs.expression, ctx)
+            data = lhs.name.data
+            def store(f, value):
+                base(f).fields[data] = value
+            return store
+        elif isinstance(lhs, expr.Arguments):
+            if lhs.method == '[]':
+                return self.compile_index_lhs(lhs, ctx)
+            if lhs.method != '<>':
+                raise ExecutionError('%s is not a valid LHS' % lhs)
+            get = self.compile_expression(lhs.func, ctx)
+            put = self.compile_lhs(lhs.func, ctx)
+            specs = self.compile_bitspecs(lhs.args, ctx)
+            insert = runtime.insert
+            if len(specs) == 1:
+                (hi, lo), = specs
+                def store(f, value):
+                    put(f, insert(get(f), hi(f), lo(f), value))
+                return store
+            insert_fields = runtime.insert_fields
+            def store(f, value):
+                put(f, insert_fields(
+                    get(f), [(hi(f), lo(f)) for hi, lo in specs], value))
+            return store
+        elif isinstance(lhs, expr.Bits):
+            elements = [(self.compile_expression(element, ctx),
+                         self.compile_lhs(element, ctx))
+                        for element in lhs.elements]
+            def store(f, value):
+                v = value.value
+                for get, put in reversed(elements):
+                    width = get(f).width
+                    put(f, Bits(v, width))
+                    v >>= width
+            return store
+        elif isinstance(lhs, expr.Values):
+            members = [self.compile_lhs(member, ctx)
+                       for member in lhs.members]
+            def store(f, value):
+                for member, v in zip(members, value):
+                    member(f, v)
+            return store
+        elif isinstance(lhs, expr.Omitted):
+            return lambda f, value: None
+        else:
+            raise ExecutionError('%s is not a valid LHS' % lhs)
+
+    def compile_global_lhs(self, key, x):
+        k = '.'.join(key)
+        variables = self.variables
+        if x is None or isinstance(x, ns.Variable) and \
+                        not x.declaration.is_constant:
+            if x is not None:
+                self.init_variable(k, x)
+            def store(f, value):
+                variables[k] = value
+            return store
+        if isinstance(x, ns.Accessor):
+            if x.setter is None or x.setter.parameters:
+                return failure('%s can\'t be assigned like this' % k)
+            function = self.function(x.setter)
+            return lambda f, value: function.run([value])
+        return failure('%s can\'t be assigned' % k)
+
+    def compile_index_lhs(self, lhs, ctx):
+        key = qualified_name(lhs.func)
+        args = [self.compile_expression(arg, ctx) for arg in lhs.args]
+        if key is not None and (len(key) != 1 or key[0] not in ctx.slots):
+            x = self.lookup(key)
+            if isinstance(x, ns.Accessor):
+                if x.setter is None:
+                    return failure('%s has no setter' % '.'.join(key))
+                function = self.function(x.setter)
+                get_args = arguments(self.copy_arguments([x.setter], args))
+                return lambda f, value: function.run(get_args(f) + [value])
+        if len(args) != 1:
+            raise ExecutionError('%s: arrays have one index' % lhs)
+        base = self.compile_expression(lhs.func, ctx)
+        index, = args
+        def store(f, value):
+            a = base(f)
+            i = index(f)
+            if i not in a:
+                raise ExecutionError('%s: index %r out of range' % (lhs, i))
+            a[i] = value
+        return store
+
+    # the expression to assign, with the width of the target if it is
+    # known (for calls to functions returning bits(N) for any N)
+    def compile_value(self, expression, datatype, ctx):
+        width = None
+        if isinstance(datatype, dtype.Bits) and (
+                isinstance(datatype.expression, expr.Identifier) or
+                isinstance(datatype.expression, expr.Numeric)):
+            width = self.compile_expression(datatype.expression, ctx)
+        c = self.compile_expression(expression, ctx, width)
+        if isinstance(expression, expr.Identifier) or \
+           isinstance(expression, expr.QualifiedIdentifier) or \
+           isinstance(expression, expr.Arguments) and \
+               expression.method == '[]':
+            # don't share structures and arrays with the variable
+            # they come from
+            copy_value = runtime.copy_value
+            return lambda f: copy_value(c(f))
+        return c
+
+    def compile_declaration(self, datatype, lhs, expression, ctx):
+        assert isinstance(lhs, expr.Identifier)
+        data = lhs.name.data
+        i = ctx.slot(data)
+        ctx.types[data] = datatype
+        if expression is None:
+            c = self.compile_default(datatype, ctx)
+        else:
+            c = self.compile_value(expression, datatype, ctx)
+        def declare(f):
+            f[i] = c(f)
+        return declare
+
+    # Statements
+
+    def compile_statement(self, statement, ctx):
+        if isinstance(statement, stmt.Assignment):
+            datatype = None
+            if isinstance(statement.lhs, expr.Identifier):
+                datatype = ctx.types.get(statement.lhs.name.data)
+            c = self.compile_value(statement.expression, datatype, ctx)
+            store = self.compile_lhs(statement.lhs, ctx)
+            def assign(f):
+                store(f, c(f))
+            return assign
+        elif isinstance(statement, stmt.ConstantAssignment):
+            return self.compile_declaration(
+                statement.datatype, statement.lhs, statement.expression, ctx)
+        elif isinstance(statement, stmt.Declaration):
+            return run_block([
+                self.compile_declaration(statement.datatype, lhs,
+                                         expression, ctx)
+                for lhs, expression in statement.variables])
+        elif isinstance(statement, stmt.FunctionCall):
+            key = qualified_name(statement.func)
+            if key is None:
+                raise ExecutionError('can\'t call %s' % statement.func)
+            call = self.compile_call(
+                key, [self.compile_expression(arg, ctx)
+                      for arg in statement.args], ctx)
+            def call_statement(f):
+                call(f)
+            return call_statement
+        elif isinstance(statement, stmt.See) or \
+             isinstance(statement, stmt.SeeIdentifier):
+            target = statement.target
+            def see(f):
+                raise runtime.See(target)
+            return see
+        elif isinstance(statement, stmt.Undefined):
+            def undefined(f):
+                raise runtime.Undefined()
+            return undefined
+        elif isinstance(statement, stmt.Unpredictable):
+            def unpredictable(f):
+                raise runtime.Unpredictable()
+            return unpredictable
+        elif isinstance(statement, stmt.ImplementationDefined):
+            aspect = statement.aspect
+            hook = self.state.implementation_defined_statement
+            def implementation_defined(f):
+                hook(aspect)
+            return implementation_defined
+        elif isinstance(statement, stmt.If):
+            c = self.compile_expression(statement.expression, ctx)
+            then_body = self.compile_block(statement.then_body, ctx)
+            else_body = self.compile_block(statement.else_body, ctx)
+            def if_statement(f):
+                if c(f):
+                    return then_body(f)
+                return else_body(f)
+            return if_statement
+        elif isinstance(statement, stmt.For):
+            i = ctx.slot(statement.var.name.data)
+            start = self.compile_expression(statement.start, ctx)
+            stop = self.compile_expression(statement.stop, ctx)
+            body = self.compile_block(statement.body, ctx)
+            down = statement.down
+            def for_statement(f):
+                if down:
+                    values = range(start(f), stop(f) - 1, -1)
+                else:
+                    values = range(start(f), stop(f) + 1)
+                for value in values:
+                    f[i] = value
+                    r = body(f)
+                    if r is not None:
+                        return r
+            return for_statement
+        elif isinstance(statement, stmt.While):
+            c = self.compile_expression(statement.condition, ctx)
+            body = self.compile_block(statement.body, ctx)
+            def while_statement(f):
+                while c(f):
+                    r = body(f)
+                    if r is not None:
+                        return r
+            return while_statement
+        elif isinstance(statement, stmt.Repeat):
+            body = self.compile_block(statement.body, ctx)
+            c = self.compile_expression(statement.condition, ctx)
+            def repeat_statement(f):
+                while True:
+                    r = body(f)
+                    if r is not None:
+                        return r
+                    if c(f):
+                        break
+            return repeat_statement
+        elif isinstance(statement, stmt.Case):
+            return self.compile_case(statement, ctx)
+        elif isinstance(statement, stmt.Assert):
+            c = self.compile_expression(statement.expression, ctx)
+            text = str(statement.expression)
+            def assert_statement(f):
+                if not c(f):
+                    raise runtime.AssertionFailure(text)
+            return assert_statement
+        elif isinstance(statement, stmt.Return):
+            if statement.value is None:
+                return constant((None, ))
+            c = self.compile_value(statement.value, ctx.result_type, ctx)
+            return lambda f: (c(f), )
+        elif isinstance(statement, stmt.LocalDeclaration):
+            assert isinstance(statement.decl, decl.Enumeration)
+            for value in statement.decl.values:
+                ctx.enumerations.add(value.data)
+            return lambda f: None
+        else:
+            assert False
+
+    # A case statement whose patterns are all constants looks up the
+    # clause to run in a dict; otherwise, the patterns are tried in
+    # order.
+    def compile_case(self, statement, ctx):
+        c = self.compile_expression(statement.expression, ctx)
+        table = {}
+        tests = []
+        otherwise = None
+        for clause in statement.clauses:
+            body = self.compile_block(clause.body, ctx)
+            if clause.patterns is None:
+                otherwise = body
+                continue
+            for pattern in clause.patterns:
+                test = self.compile_case_pattern(pattern, ctx)
+                if not is_constant(test):
+                    tests.append((test, body))
+                elif not tests:
+                    table.setdefault(test.value, body)
+                else:
+                    value = test.value
+                    tests.append((lambda f, x, value = value: x == value,
+                                  body))
+        if otherwise is None:
+            otherwise = lambda f: None
+
+        if not tests:
+            def case_statement(f):
+                return table.get(c(f), otherwise)(f)
+            return case_statement
+        def case_statement(f):
+            x = c(f)
+            body = table.get(x)
+            if body is not None:
+                return body(f)
+            for test, body in tests:
+                if test(f, x):
+                    return body(f)
+            return otherwise(f)
+        return case_statement
+
+    # a constant, or a function of the frame and a value testing it
+    def compile_case_pattern(self, pattern, ctx):
+        if isinstance(pattern, token.Number):
+            return constant(int(pattern.data))
+        if isinstance(pattern, token.HexadecimalNumber):
+            return constant(int(pattern.data, 16))
+        if isinstance(pattern, token.Bitvector):
+            value = bits.literal(pattern.data)
+            if isinstance(value, bits.Pattern):
+                return lambda f, x: value.matches(x)
+            return constant(value)
+        c = self.compile_name(pattern.data, ctx)
+        if is_constant(c):
+            return c
+        return lambda f, x: x == c(f)
@@ -20,6 +20,8 @@ from . import ParseError
 class Identifier:
     def __init__(self, name):
         self.name = name
+        # set by the resolver, see scope.py
+        self.binding = None
 
     def __str__(self):
         return str(self.name)
@@ -327,7 +329,8 @@ def parse_operand(ts):
         expression = expr.Numeric(t)
         if ts.maybe_peek() == token.Nonalpha('<'):
             args = expr.parse_bitspec_clause(ts)
-            expression = expr.Arguments(expression, '<>', args)
+            if args is not None:
+                expression = expr.Arguments(expression, '<>', args)
         return expression
     elif isinstance(t, token.Bitvector):
         ts.consume()
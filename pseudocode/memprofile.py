@@ -0,0 +1,125 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gc
+import sys
+import tracemalloc
+
+# Memory profiling at phase boundaries
+#
+# When a profiler is installed as memprofile.profiler, each call to
+# checkpoint() collects garbage, takes a tracemalloc snapshot and counts
+# the live objects of the classes we care about, and notes down
+#
+#   - the memory traced so far and how much it grew since the last
+#     checkpoint,
+#   - the source lines whose allocations grew the most, and
+#   - how many syntax tree nodes, tokens, token lists and expat parsers
+#     are alive and their (shallow) size.
+#
+# for report() to print at the end, so it doesn't get mixed up with
+# the progress messages.  Only the previous snapshot is kept, so the
+# profiler itself doesn't grow much with the number of checkpoints.
+# Worker processes aren't profiled.
+
+profiler = None
+
+# attribute an object to a category, or None if it isn't of interest
+def category(obj):
+    cls = type(obj)
+    module = cls.__module__
+    if module.startswith('pseudocode.'):
+        # syntax tree nodes, namespace entries and tokens
+        return '%s.%s' % (module[11:], cls.__name__)
+    if module == '__main__':
+        return '%s.%s' % (module, cls.__name__)
+    if cls is list:
+        # tokenizer output; nested lists are indented blocks
+        if obj and type(obj[0]).__module__ == 'pseudocode.token':
+            return 'token lists'
+        return None
+    if cls.__name__ == 'xmlparser':
+        return 'expat parsers'
+    return None
+
+def census():
+    counts = {}
+    for obj in gc.get_objects():
+        name = category(obj)
+        if name is not None:
+            n, size = counts.get(name, (0, 0))
+            counts[name] = n + 1, size + sys.getsizeof(obj)
+    return counts
+
+def format_size(size):
+    return '%8.2f MB' % (size / 1e6)
+
+class Profiler:
+    def __init__(self, top = 10):
+        self.top = top
+        self.snapshot = None
+        self.counts = {}
+        self.traced = 0
+        self.lines = []
+        tracemalloc.start()
+
+    def checkpoint(self, label):
+        gc.collect()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)])
+        counts = census()
+        traced, peak = tracemalloc.get_traced_memory()
+
+        self.lines.append('memprofile: %s: %s traced (%+.2f MB), '
+                          'peak %s' % (
+            label, format_size(traced).strip(),
+            (traced - self.traced) / 1e6, format_size(peak).strip()))
+
+        if self.snapshot is None:
+            stats = snapshot.statistics('lineno')
+        else:
+            stats = snapshot.compare_to(self.snapshot, 'lineno')
+        stats = [stat for stat in stats if getattr(stat, 'size_diff',
+                                                   stat.size) > 0]
+        if stats:
+            self.lines.append('  largest growth by allocation site:')
+        for stat in stats[:self.top]:
+            frame = stat.traceback[0]
+            self.lines.append('    %s %+9d blocks  %s:%d' % (
+                format_size(getattr(stat, 'size_diff', stat.size)),
+                getattr(stat, 'count_diff', stat.count),
+                frame.filename, frame.lineno))
+
+        top = sorted(counts.items(), key = lambda item: -item[1][1])
+        if top:
+            self.lines.append('  largest object categories (shallow):')
+        for name, (n, size) in top[:self.top]:
+            old_n, old_size = self.counts.get(name, (0, 0))
+            self.lines.append('    %s %9d objects (%+d)  %s' % (
+                format_size(size), n, n - old_n, name))
+
+        self.snapshot = snapshot
+        self.counts = counts
+        self.traced = traced
+
+    def report(self):
+        for l in self.lines:
+            sys.stderr.write(l + '\n')
+
+def checkpoint(label):
+    if profiler is not None:
+        profiler.checkpoint(label)
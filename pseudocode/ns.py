@@ -14,11 +14,32 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from . import decl, ns
+import sys
+
+from . import decl, dtype, ns, trigram
+
+# The namespace is kept twice: as a tree of Namespace objects, which
+# dump() and the resolver walk, and as a flat index in the root
+# namespace which maps each qualified name (a tuple of interned
+# strings) to its value, so lookup() is a single dict access.
+#
+# The resolver looks up the same unqualified names over and over, most
+# of them local variables which aren't global names at all.  Results of
+# lookup_single(), including misses, are kept in a cache in the root
+# namespace which define() clears.
+#
+# The functions below work on global_ns unless they are given another
+# root namespace, so more than one specification can be loaded at the
+# same time (see Spec in main.py).
 
 class Namespace:
     def __init__(self):
         self.members = {}
+        self.index = {}
+        self.cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.names = None
 
     def dump(self):
         lines = []
@@ -29,15 +50,41 @@ class Namespace:
                 lines.append('    ' + l)
         return lines
 
+# The overloads of a function are indexed by their number of parameters
+# and by the shape of their parameter types (in the same dict, as the
+# former are ints and the latter tuples), so a call site can find its
+# candidates without looking at each overload.
+
 class Function:
     def __init__(self):
-        self.signatures = []
+        self.declarations = []
+        self.overloads = {}
+
+    def add(self, declaration):
+        shape = tuple(type_shape(param_type)
+                      for param_type, param_name, by_reference
+                          in declaration.parameters)
+        self.declarations.append(declaration)
+        self.overloads.setdefault(len(shape), []).append(declaration)
+        self.overloads.setdefault(shape, []).append(declaration)
+
+    # the overloads which can be called with the given number of
+    # arguments or, if known, argument type shapes
+    def candidates(self, arity, shape = None):
+        if shape is not None:
+            return self.overloads.get(shape, [])
+        return self.overloads.get(arity, [])
 
     def dump(self):
         lines = []
         lines.append('function')
-        for signature, decl in self.signatures:
-            lines.append(signature)
+        for declaration in self.declarations:
+            lines.append(signature(declaration))
+        return lines
+
+# The other kinds of names keep the declaration which defines them
+# (for accessors, the getter and setter declaration), so their type and
+# initial value can be found when the code is executed.
 
 class Accessor:
     def __init__(self):
@@ -48,26 +95,42 @@ class Accessor:
         return ['accessor']
 
 class Variable:
+    def __init__(self, declaration = None, expression = None):
+        self.declaration = declaration
+        self.expression = expression
+
     def dump(self):
         return ['variable']
 
 class Array:
+    def __init__(self, declaration = None):
+        self.declaration = declaration
+
     def dump(self):
         return ['array']
 
 class Enumeration:
+    def __init__(self, declaration = None):
+        self.declaration = declaration
+
     def dump(self):
         return ['enumeration']
 
 class Struct:
+    def __init__(self, declaration = None):
+        self.declaration = declaration
+
     def dump(self):
         return ['struct']
 
 class Type:
+    def __init__(self, declaration = None):
+        self.declaration = declaration
+
     def dump(self):
         return ['type']
 
-implicit = [
+implicit = frozenset([
     'CONTEXTIDR_EL2',
     'DLR',
     'DLR_EL0',
@@ -91,91 +154,153 @@ implicit = [
     'ReservedEncoding',
     'Sqrt',
     'UndefinedFault'
-]
+])
 
 global_ns = ns.Namespace()
 
+# returned by lookup_single() for names which aren't defined
+MISSING = object()
+
 class LookupError(Exception):
     def __init__(self, name):
         self.name = name
 
-def lookup(name):
-    x = global_ns
-    if len(name) == 1 and name[0].data in implicit:
-        return None
-    for part in name:
-        assert isinstance(x, ns.Namespace)
+# bits(N) for any N is one shape, as are all custom types of a name
+def type_shape(datatype):
+    if isinstance(datatype, dtype.Bits):
+        return 'bits'
+    if isinstance(datatype, dtype.Custom):
+        return '.'.join(str(part) for part in datatype.name)
+    return datatype.__class__.__name__.lower()
+
+def signature(declaration):
+    params = ', '.join('%s %s%s' % (
+                         str(pt), '&' if by_reference else '', str(pi))
+                       for pt, pi, by_reference in declaration.parameters)
+    return '%s (%s)' % (str(declaration.result_type), params)
+
+def qualified_name(name):
+    return tuple(part if isinstance(part, str) else part.data
+                 for part in name)
+
+def lookup(name, namespace = None):
+    if namespace is None:
+        namespace = global_ns
+    if len(name) == 1:
+        part = name[0]
         if not isinstance(part, str):
             part = part.data
-        try:
-            x = x.members[part]
-        except KeyError:
-            raise LookupError(name)
+        if part in implicit:
+            return None
+        key = part,
+    else:
+        key = qualified_name(name)
+    try:
+        x = namespace.index[key]
+    except KeyError:
+        raise LookupError(name)
     assert not isinstance(x, ns.Namespace)
     return x
 
-def define(name, value):
-    x = global_ns
-    for i, part in enumerate(name):
+# look up an unqualified name given as a string; returns MISSING
+# instead of raising LookupError
+def lookup_single(data, namespace = None):
+    if namespace is None:
+        namespace = global_ns
+    try:
+        x = namespace.cache[data]
+    except KeyError:
+        pass
+    else:
+        namespace.cache_hits += 1
+        return x
+    namespace.cache_misses += 1
+    if data in implicit:
+        x = None
+    else:
+        x = namespace.index.get((data, ), MISSING)
+        assert not isinstance(x, ns.Namespace)
+    namespace.cache[data] = x
+    return x
+
+def define(name, value, namespace = None):
+    if namespace is None:
+        namespace = global_ns
+    namespace.cache.clear()
+    namespace.names = None
+    key = tuple(sys.intern(part) for part in qualified_name(name))
+    x = namespace
+    for i, part in enumerate(key):
         assert isinstance(x, ns.Namespace)
-        if not isinstance(part, str):
-            part = part.data
-        if i == len(name) - 1:
+        if i == len(key) - 1:
             assert part not in x.members
             x.members[part] = value
+            namespace.index[key] = value
             return
         try:
             x = x.members[part]
         except KeyError:
             x.members[part] = ns.Namespace()
             x = x.members[part]
+            namespace.index[key[:i + 1]] = x
+
+# Build the trigram index over all qualified names once the namespace
+# is complete; similar_names() builds it itself if necessary, and
+# define() drops it again.
+def finalize(namespace = None):
+    if namespace is None:
+        namespace = global_ns
+    if namespace.names is None:
+        namespace.names = trigram.TrigramIndex(
+            '.'.join(key) for key, value in namespace.index.items()
+                          if not isinstance(value, ns.Namespace))
+    return namespace.names
+
+# names which look like the one given, for "did you mean" messages and
+# completion
+def similar_names(data, k = 5, namespace = None):
+    return finalize(namespace).similar(data, k)
 
-def process(declaration):
+def process(declaration, namespace = None):
     if isinstance(declaration, decl.Function):
         if declaration.functype == decl.FUNCTION:
             try:
-                function = ns.lookup(declaration.name)
+                function = ns.lookup(declaration.name, namespace)
             except LookupError:
                 function = ns.Function()
-                ns.define(declaration.name, function)
+                ns.define(declaration.name, function, namespace)
             assert isinstance(function, ns.Function)
-            params = ', '.join('%s %s%s' % (
-                                 str(pt), '&' if by_reference else '', str(pi))
-                               for pt, pi, by_reference
-                                   in declaration.parameters)
-            function.signatures.append(
-                ('%s (%s)' % (str(declaration.result_type), params),
-                 declaration))
+            function.add(declaration)
         else:
             try:
-                accessor = ns.lookup(declaration.name)
+                accessor = ns.lookup(declaration.name, namespace)
             except LookupError:
                 accessor = ns.Accessor()
-                ns.define(declaration.name, accessor)
+                ns.define(declaration.name, accessor, namespace)
             assert isinstance(accessor, ns.Accessor)
 
             if declaration.functype == decl.GETTER:
                 #print('.'.join(str(part) for part in declaration.name))
                 #assert accessor.getter is None
-                accessor.getter = 1
+                accessor.getter = declaration
             elif declaration.functype == decl.SETTER:
                 #assert accessor.setter is None
-                accessor.setter = 1
+                accessor.setter = declaration
             else:
                 assert False
     elif isinstance(declaration, decl.Variable):
         for name, expression in declaration.variables:
-            ns.define(name, ns.Variable())
+            ns.define(name, ns.Variable(declaration, expression), namespace)
             # + (' = ' + str(expression) if expression is not None else '')
     elif isinstance(declaration, decl.Array):
-        ns.define(declaration.name, ns.Array())
+        ns.define(declaration.name, ns.Array(declaration), namespace)
     elif isinstance(declaration, decl.Enumeration):
-        ns.define([declaration.name], ns.Enumeration())
+        ns.define([declaration.name], ns.Enumeration(declaration), namespace)
         for value in declaration.values:
-            ns.define([value], ns.Enumeration())
+            ns.define([value], ns.Enumeration(declaration), namespace)
     elif isinstance(declaration, decl.Type):
-        ns.define(declaration.name, ns.Struct())
+        ns.define(declaration.name, ns.Struct(declaration), namespace)
     elif isinstance(declaration, decl.TypeEquals):
-        ns.define(declaration.name, ns.Type())
+        ns.define(declaration.name, ns.Type(declaration), namespace)
     else:
         assert False
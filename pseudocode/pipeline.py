@@ -0,0 +1,138 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import queue
+import sys
+import threading
+import time
+
+# A chain of stages connected by bounded queues, each stage running in
+# one or more threads.  Items are numbered on the way in and handed out
+# in their original order at the end, no matter how many workers a
+# stage has.  For each stage, the time spent working, waiting for input
+# ("starved") and waiting for room in the next queue ("blocked") is
+# recorded.
+
+DONE = None
+
+# an exception raised by a stage, passed on to the consumer
+class Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+class Stage:
+    def __init__(self, name, func, input, output, workers = 1):
+        self.name = name
+        self.func = func
+        self.input = input
+        self.output = output
+        self.workers = workers
+
+        self.lock = threading.Lock()
+        self.remaining = workers
+        self.items = 0
+        self.busy = 0.
+        self.starved = 0.
+        self.blocked = 0.
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target = self.run, daemon = True).start()
+
+    def run(self):
+        busy = starved = blocked = 0.
+        items = 0
+        while True:
+            t0 = time.perf_counter()
+            item = self.input.get()
+            t1 = time.perf_counter()
+            starved += t1 - t0
+            if item is DONE:
+                # let the other workers of this stage see it, too
+                self.input.put(DONE)
+                break
+            index, value = item
+            if not isinstance(value, Failure):
+                try:
+                    value = self.func(value)
+                except BaseException as e:
+                    value = Failure(e)
+                items += 1
+            t2 = time.perf_counter()
+            busy += t2 - t1
+            self.output.put((index, value))
+            blocked += time.perf_counter() - t2
+
+        with self.lock:
+            self.items += items
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.output.put(DONE)
+
+class Pipeline:
+    # stages is a list of (name, func, queue size, workers) tuples
+    def __init__(self, items, stages):
+        self.items = items
+        self.queues = [queue.Queue(maxsize) for name, func, maxsize, workers
+                                            in stages]
+        self.queues.append(queue.Queue())
+        self.stages = [Stage(name, func, self.queues[i], self.queues[i + 1],
+                             workers)
+                       for i, (name, func, maxsize, workers)
+                           in enumerate(stages)]
+        self.wall = None
+
+    def feed(self):
+        for index, item in enumerate(self.items):
+            self.queues[0].put((index, item))
+        self.queues[0].put(DONE)
+
+    def __iter__(self):
+        start = time.perf_counter()
+        for stage in self.stages:
+            stage.start()
+        threading.Thread(target = self.feed, daemon = True).start()
+
+        pending = {}
+        next_index = 0
+        while True:
+            item = self.queues[-1].get()
+            if item is DONE:
+                break
+            index, value = item
+            pending[index] = value
+            while next_index in pending:
+                value = pending.pop(next_index)
+                next_index += 1
+                if isinstance(value, Failure):
+                    raise value.exc
+                yield value
+        assert not pending
+        self.wall = time.perf_counter() - start
+
+    def report(self):
+        sys.stderr.write('pipeline: %.2fs\n' % self.wall)
+        for stage in self.stages:
+            sys.stderr.write(
+                '  %-8s %5d items  busy %7.2fs (%3d%%)  '
+                'starved %7.2fs  blocked %7.2fs\n' % (
+                    stage.name, stage.items, stage.busy,
+                    100 * stage.busy / (self.wall * stage.workers)
+                        if self.wall else 0,
+                    stage.starved, stage.blocked))
@@ -0,0 +1,186 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import fractions
+
+from .bits import Bits, make, extract, insert, concat
+from . import bits
+
+# Values and state used when executing pseudocode (see evaluate.py)
+#
+# integer is a Python int, boolean a bool, real a Fraction (or an int
+# where the value happens to be integral), bit and bits(N) are Bits
+# (see bits.py), enumeration values are their names as strings,
+# structures are Record objects, arrays are dicts from index to element
+# and tuples are tuples.
+
+class ExecutionError(Exception):
+    pass
+
+# raised by the corresponding statements
+class Undefined(Exception):
+    pass
+
+class Unpredictable(Exception):
+    pass
+
+class See(Exception):
+    def __init__(self, target):
+        Exception.__init__(self, target)
+        self.target = target
+
+class AssertionFailure(Exception):
+    pass
+
+# x<hi0:lo0, hi1:lo1, ...> for a list of (hi, lo) pairs
+def extract_fields(x, specs):
+    value = None
+    for hi, lo in specs:
+        part = extract(x, hi, lo)
+        value = part if value is None else concat(value, part)
+    return value
+
+# x<hi0:lo0, hi1:lo1, ...> = y; the last pair gets the lowest bits of y
+def insert_fields(x, specs, y):
+    v = y.value
+    for hi, lo in reversed(specs):
+        x = insert(x, hi, lo, Bits(v, hi - lo + 1))
+        v >>= hi - lo + 1
+    return x
+
+def divide(x, y):
+    q = fractions.Fraction(x, y)
+    return q.numerator if q.denominator == 1 else q
+
+def power(x, y):
+    if y < 0:
+        return fractions.Fraction(1, x ** -y)
+    return x ** y
+
+# remainder of the division rounding towards zero
+def rem(x, y):
+    return x - y * int(fractions.Fraction(x, y))
+
+class Record:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def copy(self):
+        return Record(self.name, {key: copy_value(value)
+                                  for key, value in self.fields.items()})
+
+    def __repr__(self):
+        return '%s(%s)' % (self.name, ', '.join(
+            '%s=%r' % item for item in self.fields.items()))
+
+# structures and arrays are values, not references
+def copy_value(x):
+    if isinstance(x, Record):
+        return x.copy()
+    if isinstance(x, dict):
+        return {key: copy_value(value) for key, value in x.items()}
+    return x
+
+# the shape of a value, to pick an overload (see ns.type_shape)
+def shape_matches(x, shape):
+    if isinstance(x, Bits):
+        return shape == 'bits' or shape == 'bit' and x.width == 1
+    if isinstance(x, bool):
+        return shape == 'boolean'
+    if isinstance(x, int):
+        return shape == 'integer'
+    if isinstance(x, fractions.Fraction):
+        return shape == 'real'
+    if isinstance(x, Record):
+        return shape == x.name
+    return shape not in {'bits', 'bit', 'boolean', 'integer', 'real'}
+
+# a function which calls the first of several overloads whose
+# parameter shapes match the arguments; overloads is a sequence of
+# (shape, function, takes_width) tuples
+def dispatcher(name, overloads):
+    def dispatch(*args, _width = None):
+        for shape, function, takes_width in overloads:
+            if all(shape_matches(value, s) for value, s in zip(args, shape)):
+                if takes_width:
+                    return function(*args, _width = _width)
+                return function(*args)
+        raise ExecutionError('no overload of %s matches %r' % (name, args))
+    return dispatch
+
+# Primitive functions, keyed by name and number of arguments; width is
+# the width of the result if the caller knows it.  They are used for
+# the functions which the specification declares without a body, and
+# in place of the specification's own definition (which, e.g. for
+# UInt(), loops over the bits) for the others.
+
+def round_down(x, width = None):
+    return x.numerator // x.denominator \
+        if isinstance(x, fractions.Fraction) else x
+
+def round_up(x, width = None):
+    return -(-x.numerator // x.denominator) \
+        if isinstance(x, fractions.Fraction) else x
+
+def round_towards_zero(x, width = None):
+    return int(x)
+
+builtins = {
+    ('Replicate', 2): lambda x, n, width = None: bits.replicate(x, n),
+    ('RoundDown', 1): round_down,
+    ('RoundUp', 1): round_up,
+    ('RoundTowardsZero', 1): round_towards_zero,
+    ('Real', 1): lambda x, width = None: x,
+    ('Abs', 1): lambda x, width = None: abs(x),
+    ('Min', 2): lambda x, y, width = None: min(x, y),
+    ('Max', 2): lambda x, y, width = None: max(x, y),
+    ('UInt', 1): lambda x, width = None: x.value,
+    ('SInt', 1): lambda x, width = None: bits.sint(x),
+    ('Zeros', 1): lambda n, width = None: make(0, n),
+    ('Ones', 1): lambda n, width = None: make(bits.mask(n), n),
+    ('ZeroExtend', 2): lambda x, n, width = None: bits.zero_extend(x, n),
+    ('SignExtend', 2): lambda x, n, width = None: bits.sign_extend(x, n),
+    ('Len', 1): lambda x, width = None: x.width,
+    ('IsZero', 1): lambda x, width = None: x.value == 0,
+    ('LSL', 2): lambda x, n, width = None: x << n,
+    ('LSR', 2): lambda x, n, width = None: x >> n,
+    ('ASR', 2): lambda x, n, width = None: Bits(bits.sint(x) >> n,
+                                                x.width),
+    ('ROR', 2): lambda x, n, width = None: bits.ror(x, n),
+}
+
+# The state of the machine: global variables and arrays by qualified
+# name, plus the primitive functions and what to do for UNKNOWN and
+# IMPLEMENTATION_DEFINED values.  Subclass it to give these a meaning
+# other than zero.  Clear prefer_builtins to only use the primitives
+# for functions without a body.
+
+class State:
+    def __init__(self):
+        self.variables = {}
+        self.builtins = dict(builtins)
+        self.prefer_builtins = True
+
+    def unknown(self, default):
+        return default
+
+    def implementation_defined(self, aspect, default):
+        return default
+
+    # an IMPLEMENTATION_DEFINED statement
+    def implementation_defined_statement(self, aspect):
+        pass
@@ -19,20 +19,60 @@ from . import expr, stmt, dtype, decl, ns, scope
 class SemanticError(Exception):
     pass
 
+# if set, "can't lookup" messages list up to this many similar global
+# names (see ns.similar_names)
+suggestions = 0
+
+# What a name used in a function body refers to.  The resolver stores a
+# binding (kind, value) in each expr.Identifier it resolves; value is
+# the ns object for names defined in the global namespace (including
+# global enumeration values) and None otherwise.  Identifiers which
+# can't be resolved keep the binding None.
+
+LOCAL, PARAMETER, ENUMERATION, GLOBAL, IMPLICIT = range(5)
+
+KIND_NAMES = ['local', 'parameter', 'enumeration', 'global', 'implicit']
+
+# shared bindings for the kinds which don't have a value
+PLAIN_BINDINGS = [(kind, None) for kind in range(len(KIND_NAMES))]
+
+def global_binding(value):
+    if value is None:
+        return PLAIN_BINDINGS[IMPLICIT]
+    if isinstance(value, ns.Enumeration):
+        return ENUMERATION, value
+    return GLOBAL, value
+
+# Locals are collected and uses are resolved in a single walk over the
+# function body.  Since a name may be used before the statement which
+# makes it a local variable, uses which aren't known locals yet are
+# only resolved at the end, when all locals are known.
+
+# Names which can't be looked up are reported to out (by default,
+# sys.stdout).
+
 class Scope:
-    def __init__(self, declaration):
+    def __init__(self, declaration, namespace = None, out = None):
         assert isinstance(declaration, decl.Function)
+        self.namespace = namespace
+        self.out = out
+        # maps local names to their kind
         self.local_dict = {}
+        # maps each name used in the body to its binding
+        self.bindings = {}
+        # global names looked up while resolving this function,
+        # whether or not they were found
+        self.dependencies = set()
+        # identifiers used before their names were known to be local
+        self.deferred = []
         if declaration.result_type is not None:
             self.process_signature_type(declaration.result_type)
         if declaration.result_name is not None:
             self.add_local_variable(declaration.result_type,
-                                    declaration.result_name)
+                                    declaration.result_name, LOCAL)
         for param_type, param_name, by_reference in declaration.parameters:
             self.process_signature_type(param_type)
-            self.add_local_variable(param_type, param_name)
-        if declaration.body is not None:
-            self.crawl_body(declaration.body)
+            self.add_local_variable(param_type, param_name, PARAMETER)
 
     # type is mentioned in function signature -> extract templating parameters
     def process_signature_type(self, datatype):
@@ -61,64 +101,89 @@ class Scope:
     # expression is mentioned in function signature -> templating parameter
     def process_signature_expr(self, expression):
         if isinstance(expression, expr.Identifier):
-            self.local_dict[expression.name.data] = None
+            self.local_dict[expression.name.data] = PARAMETER
+            expression.binding = PLAIN_BINDINGS[PARAMETER]
         elif isinstance(expression, expr.Operator):
             self.process_signature_expr(expression.arg0)
             self.process_signature_expr(expression.arg1)
         else:
             assert isinstance(expression, expr.Numeric)
 
-    def add_local_variable(self, datatype, name):
-        self.local_dict[name.data] = None
+    def add_local_variable(self, datatype, name, kind):
+        self.local_dict[name.data] = kind
+
+    # returns ns.MISSING if the name isn't defined
+    def find(self, single_name):
+        self.dependencies.add(single_name.data)
+        return ns.lookup_single(single_name.data, self.namespace)
 
+    def lookup(self, single_name):
+        x = self.find(single_name)
+        if x is ns.MISSING:
+            raise ns.LookupError([single_name])
+        return x
+
+    # returns the binding of a name
     def resolve(self, single_name):
         try:
-            return self.local_dict[single_name.data]
+            return self.bindings[single_name.data]
         except KeyError:
             pass
-        return ns.lookup([single_name])
-
-    # find local variables/constants and add them to the scope
-    def crawl_body(self, body):
-        for statement in body:
-            self.crawl_statement(statement)
-
-    def crawl_statement(self, statement):
-        if isinstance(statement, stmt.Assignment):
-            self.crawl_lhs(statement.lhs)
-        elif isinstance(statement, stmt.ConstantAssignment):
-            self.plain_lhs(statement.lhs)
-        elif isinstance(statement, stmt.Declaration):
-            for lhs, expression in statement.variables:
-                self.plain_lhs(lhs)
-        elif isinstance(statement, stmt.If):
-            self.crawl_body(statement.then_body)
-            if True: # statement.else_body is not None:
-                self.crawl_body(statement.else_body)
-        elif isinstance(statement, stmt.For):
-            self.plain_lhs(statement.var)
-            self.crawl_body(statement.body)
-        elif isinstance(statement, stmt.While):
-            self.crawl_body(statement.body)
-        elif isinstance(statement, stmt.Repeat):
-            self.crawl_body(statement.body)
-        elif isinstance(statement, stmt.Case):
-            for clause in statement.clauses:
-                if True: # clause.body is not None:
-                    self.crawl_body(clause.body)
-        elif isinstance(statement, stmt.LocalDeclaration):
-            assert isinstance(statement.declaration, decl.Enumeration)
-            for value in statement.declaration.values:
-                assert value.data not in self.local_dict
-                self.local_dict[value.data] = None
+        try:
+            binding = PLAIN_BINDINGS[self.local_dict[single_name.data]]
+        except KeyError:
+            binding = global_binding(self.lookup(single_name))
+        self.bindings[single_name.data] = binding
+        return binding
 
+    # an identifier is used in the body
+    def use(self, identifier):
+        data = identifier.name.data
+        try:
+            identifier.binding = self.bindings[data]
+            return
+        except KeyError:
+            pass
+        kind = self.local_dict.get(data)
+        if kind is None:
+            self.deferred.append(identifier)
+            return
+        identifier.binding = self.bindings[data] = PLAIN_BINDINGS[kind]
+
+    # resolve the uses which had to wait for the end of the body
+    def finish(self):
+        # names which can't be looked up are only recorded afterwards,
+        # so every use of them is reported
+        missing = []
+        for identifier in self.deferred:
+            try:
+                identifier.binding = self.resolve(identifier.name)
+            except ns.LookupError:
+                missing.append(identifier.name.data)
+                names = []
+                if suggestions:
+                    names = ns.similar_names(identifier.name.data,
+                                             suggestions, self.namespace)
+                if names:
+                    print("can't lookup", str(identifier.name),
+                          '(did you mean %s?)' % ', '.join(names),
+                          file = self.out)
+                else:
+                    print("can't lookup", str(identifier.name),
+                          file = self.out)
+            else:
+                pass#print "OK", str(identifier.name)
+        for data in missing:
+            self.bindings[data] = None
+        self.deferred = []
+
+    # an assignment to a name which is neither local nor global
+    # defines a local variable
     def crawl_lhs(self, lhs):
         if isinstance(lhs, expr.Identifier):
-            if lhs.name.data not in self.local_dict:
-                try:
-                    ns.lookup([lhs.name])
-                except ns.LookupError:
-                    self.local_dict[lhs.name.data] = None
+            if lhs.name.data not in self.local_dict and \
+                   self.find(lhs.name) is ns.MISSING:
+                self.local_dict[lhs.name.data] = LOCAL
         elif isinstance(lhs, expr.Values):
             for member in lhs.members:
                 self.crawl_lhs(member)
@@ -129,32 +194,113 @@ class Scope:
         assert isinstance(lhs, expr.Identifier)
         #TODO: handle nested scopes
         #assert lhs.name.data not in self.local_dict
-        try:
-            ns.lookup([lhs.name])
-        except ns.LookupError:
-            pass
-        else:
+        if self.find(lhs.name) is not ns.MISSING:
             pass # print 'OVERRIDING "%s"' % str(lhs.name)
-        self.local_dict[lhs.name.data] = None
+        # a parameter which is redeclared becomes a local variable, so
+        # a binding cached by an earlier use is no longer valid
+        if self.local_dict.get(lhs.name.data, LOCAL) != LOCAL:
+            self.bindings.pop(lhs.name.data, None)
+        self.local_dict[lhs.name.data] = LOCAL
+
+    def add_enumeration(self, declaration):
+        for value in declaration.values:
+            assert value.data not in self.local_dict
+            self.local_dict[value.data] = ENUMERATION
+
+# a scope whose bindings have already been determined elsewhere, e.g.
+# in a worker process; it only attaches them to the identifiers
+class BoundScope(Scope):
+    def __init__(self, declaration, bindings):
+        Scope.__init__(self, declaration)
+        self.bindings = bindings
 
+    def use(self, identifier):
+        identifier.binding = self.bindings[identifier.name.data]
 
-def process_namespace(namespace):
+    def finish(self):
+        pass
+
+    def crawl_lhs(self, lhs):
+        pass
+
+    def plain_lhs(self, lhs):
+        pass
+
+    def add_enumeration(self, declaration):
+        pass
+
+# The bindings of a function body in a form which can be sent to
+# another process: the ns objects are replaced by a flag, as they can
+# be found again by name.
+
+def pack_bindings(bindings):
+    if bindings is None:
+        return None
+    return {name: binding if binding is None else
+                  (binding[0], binding[1] is not None)
+            for name, binding in bindings.items()}
+
+def unpack_bindings(packed, namespace = None):
+    if namespace is None:
+        namespace = ns.global_ns
+    if packed is None:
+        return None
+    return {name: binding if binding is None else
+                  (binding[0], namespace.index[name, ]) if binding[1] else
+                  PLAIN_BINDINGS[binding[0]]
+            for name, binding in packed.items()}
+
+def attach_bindings(declaration, bindings):
+    if declaration.body is not None:
+        process_body(declaration.body, BoundScope(declaration, bindings))
+    declaration.bindings = bindings
+
+def describe_binding(binding):
+    if binding is None:
+        return 'unresolved'
+    kind, value = binding
+    if kind == GLOBAL:
+        return value.__class__.__name__.lower()
+    return KIND_NAMES[kind]
+
+# for each library function, the signatures and for each signature,
+# what the names used in its body refer to
+def binding_table(namespace):
+    table = {}
+    for name, value in sorted(namespace.members.items()):
+        if not isinstance(value, ns.Function):
+            continue
+        table[name] = [[ns.signature(declaration),
+                        None if declaration.bindings is None else
+                        {n: describe_binding(binding) for n, binding
+                             in sorted(declaration.bindings.items())}]
+                       for declaration in value.declarations]
+    return table
+
+
+def process_namespace(namespace, out = None):
     for name, value in sorted(namespace.members.items()):
         #print()
         #print('###', name)
-        process_declaration(value)
+        process_declaration(value, namespace, out)
 
-def process_declaration(declaration):
+# returns the set of global names the declaration depends on
+def process_declaration(declaration, namespace = None, out = None):
+    dependencies = set()
     if not isinstance(declaration, ns.Function):
-        return
-    for signature, declaration in declaration.signatures:
+        return dependencies
+    for declaration in declaration.declarations:
         #print(name)
-        #print(signature)
+        #print(ns.signature(declaration))
         #print(declaration.__class__.__name__)
         if declaration.body is None:
             continue
-        scope = Scope(declaration)
+        scope = Scope(declaration, namespace, out)
         process_body(declaration.body, scope)
+        scope.finish()
+        declaration.bindings = scope.bindings
+        dependencies |= scope.dependencies
+    return dependencies
 
 def process_body(body, scope):
     for statement in body:
@@ -162,13 +308,16 @@ def process_body(body, scope):
 
 def process_statement(statement, scope):
     if isinstance(statement, stmt.Assignment):
+        scope.crawl_lhs(statement.lhs)
         process_lhs(statement.lhs, scope)
         process_expression(statement.expression, scope)
     elif isinstance(statement, stmt.ConstantAssignment):
+        scope.plain_lhs(statement.lhs)
         process_lhs(statement.lhs, scope)
         process_expression(statement.expression, scope)
     elif isinstance(statement, stmt.Declaration):
         for lhs, expression in statement.variables:
+            scope.plain_lhs(lhs)
             process_lhs(lhs, scope)
             if expression is not None:
                 process_expression(expression, scope)
@@ -192,6 +341,7 @@ def process_statement(statement, scope):
         #if statement.else_body is not None:
         process_body(statement.else_body, scope)
     elif isinstance(statement, stmt.For):
+        scope.plain_lhs(statement.var)
         process_expression(statement.start, scope)
         process_expression(statement.stop, scope)
         process_body(statement.body, scope)
@@ -213,17 +363,13 @@ def process_statement(statement, scope):
             process_expression(statement.value, scope)
     elif isinstance(statement, stmt.LocalDeclaration):
         assert isinstance(statement.declaration, decl.Enumeration)
+        scope.add_enumeration(statement.declaration)
     else:
         assert False
 
 def process_lhs(expression, scope):
     if isinstance(expression, expr.Identifier):
-        try:
-            scope.resolve(expression.name)
-        except ns.LookupError:
-            print("can't lookup", str(expression.name))
-        else:
-            pass#print "OK", str(expression.name)
+        scope.use(expression)
     elif isinstance(expression, expr.QualifiedIdentifier):
         pass
     elif isinstance(expression, expr.Arguments):
@@ -259,12 +405,7 @@ def process_lhs(expression, scope):
 
 def process_expression(expression, scope):
     if isinstance(expression, expr.Identifier):
-        try:
-            scope.resolve(expression.name)
-        except ns.LookupError:
-            print("can't lookup", str(expression.name))
-        else:
-            pass#print "OK", str(expression.name)
+        scope.use(expression)
     elif isinstance(expression, expr.QualifiedIdentifier):
         pass
     elif isinstance(expression, expr.Arguments):
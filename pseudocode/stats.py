@@ -0,0 +1,177 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import sys
+import threading
+import time
+
+from . import stmt
+
+# Per-phase and per-file metrics
+#
+# Code that wants to be measured wraps the work in
+#
+#     with stats.phase('tokenize', fn) as ph:
+#         ...
+#         ph.count('tokens', n)
+#
+# which does nothing unless a recorder has been installed as
+# stats.recorder.  Each phase records its wall time, the CPU time of
+# the current thread, the change in sys.getallocatedblocks() as
+# allocated_blocks (a number of blocks, not of bytes; process-wide, so
+# it is only meaningful when nothing else runs at the same time) and any
+# counters the code adds.  Use --memprofile to see memory in bytes.
+#
+# Records are plain tuples so they can be sent back from worker
+# processes; time.perf_counter() is system-wide on Linux, so the time
+# stamps of different processes can be put on one timeline.
+
+recorder = None
+
+class Recorder:
+    def __init__(self):
+        self.records = []
+        self.start = time.perf_counter()
+
+    def take(self):
+        records = self.records
+        self.records = []
+        return records
+
+    # sum up the records per phase, and per file and phase
+    # (fn is None for phases which concern the whole specification)
+    def totals(self):
+        files = {}
+        phases = {}
+        for name, fn, start, wall, cpu, blocks, counts, pid, tid \
+                in self.records:
+            targets = [phases]
+            if fn is not None:
+                targets.append(files.setdefault(fn, {}))
+            for d in targets:
+                entry = d.setdefault(name, {
+                    'count': 0,
+                    'wall': 0.,
+                    'cpu': 0.,
+                    'allocated_blocks': 0
+                })
+                entry['count'] += 1
+                entry['wall'] += wall
+                entry['cpu'] += cpu
+                entry['allocated_blocks'] += blocks
+                for key, value in counts.items():
+                    entry[key] = entry.get(key, 0) + value
+        return files, phases
+
+    def write_json(self, path):
+        files, phases = self.totals()
+        with open(path, 'w') as f:
+            json.dump({
+                'wall': time.perf_counter() - self.start,
+                'phases': phases,
+                'files': files
+            }, f, indent = 1, sort_keys = True)
+            f.write('\n')
+
+    # Chrome trace event format, see chrome://tracing or ui.perfetto.dev
+    def write_trace(self, path):
+        events = []
+        for name, fn, start, wall, cpu, blocks, counts, pid, tid \
+                in self.records:
+            args = dict(counts)
+            args['cpu'] = cpu
+            args['allocated_blocks'] = blocks
+            if fn is not None:
+                args['file'] = fn
+            events.append({
+                'name': name,
+                'cat': 'phase',
+                'ph': 'X',
+                'ts': (start - self.start) * 1e6,
+                'dur': wall * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+            f.write('\n')
+
+class Phase:
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self.counts = {}
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        blocks = sys.getallocatedblocks() - self.blocks
+        # list.append is atomic, so threads can share the recorder
+        recorder.records.append((
+            self.name, self.fn, self.start, wall, cpu, blocks, self.counts,
+            os.getpid(), threading.get_ident()))
+
+    def count(self, key, n):
+        self.counts[key] = self.counts.get(key, 0) + n
+
+class NoPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def count(self, key, n):
+        pass
+
+no_phase = NoPhase()
+
+def phase(name, fn = None):
+    if recorder is None:
+        return no_phase
+    return Phase(name, fn)
+
+def count_tokens(tokens):
+    n = len(tokens)
+    for t in tokens:
+        if isinstance(t, list):
+            n += count_tokens(t) - 1
+    return n
+
+# the number of statements in a body, including nested ones
+def count_statements(body):
+    n = len(body)
+    for statement in body:
+        if isinstance(statement, stmt.If):
+            n += count_statements(statement.then_body)
+            n += count_statements(statement.else_body)
+        elif isinstance(statement, stmt.For) or \
+             isinstance(statement, stmt.While) or \
+             isinstance(statement, stmt.Repeat):
+            n += count_statements(statement.body)
+        elif isinstance(statement, stmt.Case):
+            for clause in statement.clauses:
+                n += count_statements(clause.body)
+    return n
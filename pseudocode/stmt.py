@@ -500,7 +500,8 @@ def parse_block(tokens, parse_func):
                 if tokens[0] == token.ReservedWord('when'):
                     # empty case clause
                     break
-                raise ParseError(tstream.TokenStream(tokens, pos, pos))
+                raise ParseError(tstream.TokenStream(tokens, pos - 1, pos - 1),
+                                 [token.Nonalpha(';')])
 
             if t == token.Nonalpha(';'):
                 if tokens[start] == token.ReservedWord('when') or \
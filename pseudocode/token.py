@@ -16,6 +16,7 @@
 
 import functools
 import sys
+import threading
 import weakref
 
 from . import token
@@ -46,32 +47,48 @@ NONALPHA = {
 # time is about 2.5x higher as with interned strings), but I think the
 # improved readability is worth it.
 
+#
+# Tokens are created from several threads when parsing in threads, so
+# new instances are only created while holding a lock; otherwise, two
+# threads could create different instances for the same token.
+
+singleton_lock = threading.RLock()
+
 def singleton(x):
     actual_new = x.__new__
 
     @functools.wraps(actual_new)
     def new(cls, *args):
+        d = cls._instances
         try:
-            d = cls._instances
-        except AttributeError:
-            d = cls._instances = weakref.WeakValueDictionary()
-        try:
-            inst = d[args]
+            return d[args]
         except KeyError:
-            inst = d[args] = actual_new(cls)
-            inst.args = args
+            pass
+        with singleton_lock:
             try:
+                inst = d[args]
+            except KeyError:
+                inst = actual_new(cls)
+                inst.args = args
                 inst.__init_singleton__(*args)
-            except:
-                del d[args]
-                raise
+                d[args] = inst
         return inst
 
+    # each subclass has its own instances
+    def init_subclass(cls):
+        cls._instances = weakref.WeakValueDictionary()
+
     x.__new__ = new
+    x.__init_subclass__ = classmethod(init_subclass)
+    x._instances = weakref.WeakValueDictionary()
     return x
 
 @singleton
 class Token:
+    # make sure unpickled tokens are re-interned
+    def __reduce__(self):
+        return self.__class__, self.args
+
     def __repr__(self):
         try:
             data = repr(self.data)
@@ -90,11 +107,14 @@ class ReservedWord(Token):
     def __str__(self):
         return self.data # 'rw:' + self.data
 
+# Identifier strings are interned, so the namespace index mostly
+# compares them by identity.
+
 class Identifier(Token):
     def __init_singleton__(self, data):
         if data in RESERVED_WORDS:
             raise ValueError
-        self.data = data
+        self.data = sys.intern(data)
 
     def __str__(self):
         return self.data # 'id:' + self.data
@@ -103,7 +123,7 @@ class LinkedIdentifier(Token):
     def __init_singleton__(self, data):
         if data in RESERVED_WORDS:
             raise ValueError
-        self.data = data
+        self.data = sys.intern(data)
 
     def __str__(self):
         return self.data # 'a:' + self.data
@@ -112,7 +132,7 @@ class DeclarationIdentifier(Token):
     def __init_singleton__(self, data):
         if data in RESERVED_WORDS:
             raise ValueError
-        self.data = data
+        self.data = sys.intern(data)
 
     def __str__(self):
         return self.data # 'decl:' + self.data
@@ -155,9 +175,22 @@ class Nonalpha(Token):
         return self.data
 
 NEWLINE = token.Nonalpha('\\n')
+
+# keep the reserved words and operators alive so looking them up never
+# has to take the lock in singleton()
+PERMANENT = [token.ReservedWord(data) for data in sorted(RESERVED_WORDS |
+                                                  MAYBE_RESERVED_WORDS)] + \
+            [token.Nonalpha(data) for data in sorted(NONALPHA)]
 # '\t', '\r', ' ': whitespace
 
 
+# For error messages, the tokenizer keeps track of where it is in the
+# source text: start is the offset of the data currently processed and
+# line the current line (both counted from the start of the text), and
+# positions maps each token list (by id) to a list of (index, offset,
+# line) tuples which give the position of the token at index in that
+# list after each line break.
+
 class Tokenizer:
     def __init__(self):
         self.tokens = []
@@ -165,8 +198,16 @@ class Tokenizer:
         self.parentheses = []
         self.inside_string = None
 
+        self.start = 0
+        self.end = 0
+        self.line = 1
+        self.positions = {id(self.tokens): [(0, 0, 1)]}
+
     def process(self, data):
+        self.start = self.end
+        self.end += len(data)
         if self.inside_string is not None:
+            self.start -= len(self.inside_string)
             data = self.inside_string + data
             self.inside_string = None
 
@@ -191,6 +232,7 @@ class Tokenizer:
                 pos += n
             elif ch == '\n':
                 pos += 1
+                self.line += 1
                 if self.parentheses:
                     continue
                 # skip empty and comment-only lines
@@ -202,6 +244,7 @@ class Tokenizer:
                     else:
                         if data[pos:p] == ' ' * (p - pos):
                             pos = p + 1
+                            self.line += 1
                             continue
                     try:
                         p = data.index('//', pos)
@@ -210,6 +253,7 @@ class Tokenizer:
                     else:
                         if data[pos:p] == ' ' * (p - pos):
                             pos = data.index('\n', pos) + 1
+                            self.line += 1
                             continue
                     break
                 indent = 0
@@ -237,8 +281,11 @@ class Tokenizer:
                     indented_tokens = []
                     self.tokens.append(indented_tokens)
                     self.tokens = indented_tokens
+                    self.positions[id(indented_tokens)] = []
                 while len(self.stack) > indent:
                     self.tokens = self.stack.pop()
+                self.positions[id(self.tokens)].append(
+                    (len(self.tokens), self.start + pos, self.line))
             elif ch == ' ':
                 pos += 1
             elif ch == '!':
@@ -317,9 +364,11 @@ class Tokenizer:
             elif ch == '/':
                 if pos + 1 < len(data) and data[pos + 1] == '*':
                     try:
-                        pos = data.index('*/', pos) + 2
+                        p = data.index('*/', pos) + 2
                     except ValueError:
                         raise LexError(data, pos)
+                    self.line += data.count('\n', pos, p)
+                    pos = p
                 elif pos + 1 < len(data) and data[pos + 1] == '/':
                     try:
                         pos = data.index('\n', pos)
@@ -436,23 +485,33 @@ class Tokenizer:
 
         #print('Character data: ', repr(data))
 
+    # split a dotted name in data[start:stop] into its parts; error
+    # positions are relative to data
+    def split_name(self, data, start, stop):
+        parts = data[start:stop].split('.')
+        pos = start
+        for part in parts:
+            if not part:
+                raise LexError(data, pos)
+            for i, ch in enumerate(part):
+                if not (ch >= 'A' and ch <= 'Z' or ch >= 'a' and ch <= 'z'
+                          or ch == '_' or i > 0 and ch >= '0' and ch <= '9'):
+                    raise LexError(data, pos + i)
+            pos += len(part) + 1
+        return parts
+
     def process_a(self, data):
+        self.start = self.end
+        self.end += len(data)
         if self.inside_string is not None:
             self.inside_string += data
             return
 
         is_see = data[:4] == 'SEE(' and data[-1:] == ')'
         if is_see:
-            data = data[4:-1]
-
-        parts = data.split('.')
-        for part in parts:
-            if not part:
-                raise LexError(part, 0)
-            for i, ch in enumerate(part):
-                if not (ch >= 'A' and ch <= 'Z' or ch >= 'a' and ch <= 'z'
-                          or ch == '_' or i > 0 and ch >= '0' and ch <= '9'):
-                    raise LexError(part, i)
+            parts = self.split_name(data, 4, len(data) - 1)
+        else:
+            parts = self.split_name(data, 0, len(data))
 
         if is_see:
             self.tokens.append(token.ReservedWord('SEE'))
@@ -465,17 +524,13 @@ class Tokenizer:
             self.tokens.append(token.Nonalpha(')'))
 
     def process_anchor(self, data):
+        self.start = self.end
+        self.end += len(data)
         if self.inside_string is not None:
+            self.start -= len(self.inside_string)
             raise LexError(self.inside_string, 0)
 
-        parts = data.split('.')
-        for part in parts:
-            if not part:
-                raise LexError(part, 0)
-            for i, ch in enumerate(part):
-                if not (ch >= 'A' and ch <= 'Z' or ch >= 'a' and ch <= 'z'
-                          or ch == '_' or i > 0 and ch >= '0' and ch <= '9'):
-                    raise LexError(part, i)
+        parts = self.split_name(data, 0, len(data))
 
         for part in parts[:-1]:
             self.tokens.append(token.Identifier(part))
@@ -484,6 +539,7 @@ class Tokenizer:
 
     def process_end(self):
         if self.inside_string is not None:
+            self.start = self.end - len(self.inside_string)
             raise LexError(self.inside_string, 0)
 
         if self.tokens \
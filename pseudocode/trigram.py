@@ -0,0 +1,122 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+
+# Fuzzy name lookup
+#
+# Each name is split into its dot-separated parts, and each part is
+# broken into the trigrams of its lower-case form, padded with two
+# blanks in front and one behind so short parts and the start of a
+# part count, too.  Names are ranked by the Dice coefficient of their
+# trigram set and that of the query, 2c / (n + m) for c shared
+# trigrams.
+#
+# For each trigram, the index keeps the set of names containing it as
+# a bit mask (bit i for the i-th name).  A query adds up the masks of
+# its trigrams in a bit-sliced counter, so counting costs a few big
+# integer operations per trigram rather than one step per name.  The
+# names are then taken level by level, starting with those sharing all
+# n trigrams; a name sharing c trigrams can't score better than
+# 2c / (n + c), so the search stops as soon as that bound drops below
+# the k-th best score found so far.  Within a level, names with more
+# than 2c / score - n trigrams can't reach the score either and are
+# masked out by their size.
+
+def trigrams(name):
+    grams = set()
+    for part in name.split('.'):
+        s = '  ' + part.lower() + ' '
+        for i in range(len(s) - 2):
+            grams.add(s[i:i + 3])
+    return grams
+
+# bit mask of the names whose counter in planes is exactly c (c > 0)
+def count_mask(planes, c):
+    if c >> len(planes):
+        return 0
+    mask = -1
+    for j, plane in enumerate(planes):
+        if c >> j & 1:
+            mask &= plane
+        else:
+            mask &= ~plane
+    return mask
+
+class TrigramIndex:
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.sizes = []
+        postings = {}
+        for i, name in enumerate(self.names):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.masks = {}
+        for gram, ids in postings.items():
+            bits = bytearray(ids[-1] // 8 + 1)
+            for i in ids:
+                bits[i >> 3] |= 1 << (i & 7)
+            self.masks[gram] = int.from_bytes(bits, 'little')
+        # at_most[m] is the mask of the names with at most m trigrams
+        self.at_most = [0] * (max(self.sizes, default = 0) + 1)
+        for i, m in enumerate(self.sizes):
+            self.at_most[m] |= 1 << i
+        for m in range(1, len(self.at_most)):
+            self.at_most[m] |= self.at_most[m - 1]
+
+    # the (at most) k names most similar to query whose score is at
+    # least min_score, best first; ties are broken alphabetically
+    def similar(self, query, k = 5, min_score = .3):
+        if k <= 0:
+            return []
+        grams = trigrams(query)
+        n = len(grams)
+
+        # bit i of planes[j] is bit j of the number of trigrams the
+        # i-th name shares with the query
+        planes = []
+        for gram in grams:
+            carry = self.masks.get(gram, 0)
+            j = 0
+            while carry and j < len(planes):
+                planes[j], carry = planes[j] ^ carry, planes[j] & carry
+                j += 1
+            if carry:
+                planes.append(carry)
+
+        best = []  # heap of (score, -i)
+        for c in range(n, 0, -1):
+            score = best[0][0] if len(best) == k else min_score
+            if 2 * c / (n + c) < score:
+                break
+            # allow for rounding, the exact comparison is done below
+            m = int(2 * c / score - n + 1e-9)
+            mask = count_mask(planes, c) & \
+                   self.at_most[min(m, len(self.at_most) - 1)]
+            while mask:
+                low = mask & -mask
+                mask ^= low
+                i = low.bit_length() - 1
+                item = 2 * c / (n + self.sizes[i]), -i
+                if item[0] < min_score:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+        return [self.names[-i] for score, i in sorted(best, reverse = True)]
@@ -14,7 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
+
 from . import ParseError
+from . import token
 
 class TokenStream:
     def __init__(self, tokens, start, stop):
@@ -41,9 +44,9 @@ class TokenStream:
 
     def consume_assert(self, expected):
         if self.pos == self.stop:
-            raise ParseError(self)
+            raise ParseError(self, [expected])
         if self.tokens[self.pos] != expected:
-            raise ParseError(self)
+            raise ParseError(self, [expected])
         self.pos += 1
 
     def peek(self):
@@ -76,3 +79,58 @@ def parse(tokens, start, stop, parse_func):
     if ts.forks:
         raise ParseError(ts)
     return result
+
+# Tokens don't know where they came from, so for error messages, find
+# the position of the token a stream stopped at by searching for the
+# text of each token in turn, skipping comments.  The search starts at
+# the last position recorded by the tokenizer (see token.Tokenizer)
+# before that token, so only the current line has to be searched.
+# Returns the offset and line, or (None, None) if the text doesn't
+# match up.
+
+def find_token_text(text, s, start):
+    while True:
+        p = text.find(s, start)
+        if p == -1:
+            return -1
+        comment = text.find('//', start, p)
+        if comment == -1:
+            return p
+        start = text.find('\n', comment)
+        if start == -1:
+            return -1
+
+def source_offset(text, positions, ts):
+    checkpoints = positions.get(id(ts.tokens))
+    i = bisect.bisect_left(checkpoints or [], (ts.pos + 1,)) - 1
+    if i == -1:
+        return None, None
+    i, start, line = checkpoints[i]
+    offset = start
+    stack = []
+    l = ts.tokens
+    while True:
+        if l is ts.tokens and i == ts.pos:
+            if i < len(l) and not isinstance(l[i], list) \
+                          and l[i] != token.NEWLINE:
+                p = find_token_text(text, str(l[i]), offset)
+                if p != -1:
+                    offset = p
+            return offset, line + text.count('\n', start, offset)
+        if i == len(l):
+            if not stack:
+                return None, None
+            l, i = stack.pop()
+            continue
+        t = l[i]
+        i += 1
+        if isinstance(t, list):
+            stack.append((l, i))
+            l = t
+            i = 0
+        elif t != token.NEWLINE:
+            s = str(t)
+            p = find_token_text(text, s, offset)
+            if p == -1:
+                return None, None
+            offset = p + len(s)
@@ -0,0 +1,297 @@
+# Parser and resolver for ARM ASL pseudocode
+# Copyright (C) 2019, 2021-2022 Roland Lutz
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+
+from . import expr, stmt, dtype, decl
+
+# Cross-reference index
+#
+# An SQLite database which maps each name used or defined anywhere in
+# the specification to its occurrences: the file, the fragment (name
+# and section) and the path of the statement within the fragment, e.g.
+# "3.then.0" for the first statement in the then branch of the fourth
+# statement, or "12.body.3" for the fourth statement of the thirteenth
+# declaration in a library fragment.  Qualified names are stored with
+# all their parts ("PSTATE.N", "AArch64.TakeException").
+#
+# Each file is stored along with the digest of its contents, so the
+# caller only needs to reparse and replace the files which changed.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fragments (
+    id INTEGER PRIMARY KEY,
+    file INTEGER NOT NULL,
+    name TEXT,
+    section TEXT
+);
+CREATE INDEX IF NOT EXISTS fragments_file ON fragments (file);
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    name INTEGER NOT NULL,
+    fragment INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    is_definition INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_name ON refs (name);
+CREATE INDEX IF NOT EXISTS refs_fragment ON refs (fragment);
+'''
+
+class Index:
+    # the index is emptied if it was built by a different parser version
+    def __init__(self, path, version):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            for table in ['files', 'fragments', 'names', 'refs']:
+                self.db.execute('DELETE FROM %s' % table)
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (version, ))
+        self.names = None
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    # maps file names to the digest they were indexed with
+    def files(self):
+        return dict(self.db.execute('SELECT name, digest FROM files'))
+
+    def remove_file(self, fn):
+        row = self.db.execute('SELECT id FROM files WHERE name = ?',
+                              (fn, )).fetchone()
+        if row is None:
+            return
+        self.db.execute('DELETE FROM refs WHERE fragment IN '
+                        '(SELECT id FROM fragments WHERE file = ?)', row)
+        self.db.execute('DELETE FROM fragments WHERE file = ?', row)
+        self.db.execute('DELETE FROM files WHERE id = ?', row)
+
+    # fragments is a list of (name, section, body, expression) tuples
+    def update_file(self, fn, digest, fragments, is_shared_pseudocode):
+        self.remove_file(fn)
+        if self.names is None:
+            self.names = dict(self.db.execute('SELECT name, id FROM names'))
+        file_id = self.db.execute(
+            'INSERT INTO files (name, digest) VALUES (?, ?)',
+            (fn, digest)).lastrowid
+        rows = []
+        for name, section, body, expression in fragments:
+            fragment_id = self.db.execute(
+                'INSERT INTO fragments (file, name, section) '
+                'VALUES (?, ?, ?)', (file_id, name, section)).lastrowid
+            refs = []
+            if body is not None and is_shared_pseudocode:
+                for i, declaration in enumerate(body):
+                    declaration_refs(declaration, str(i), refs)
+            elif body is not None:
+                body_refs(body, '', refs)
+            elif expression is not None:
+                expression_refs(expression, '', refs)
+            for ref_name, path, is_definition in refs:
+                try:
+                    name_id = self.names[ref_name]
+                except KeyError:
+                    name_id = self.db.execute(
+                        'INSERT INTO names (name) VALUES (?)',
+                        (ref_name, )).lastrowid
+                    self.names[ref_name] = name_id
+                rows.append((name_id, fragment_id, path, is_definition))
+        self.db.executemany('INSERT INTO refs VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    # Returns (name, file, fragment name, section, path, is_definition)
+    # tuples for the given name and, unless exact is set, all names
+    # qualified by it (e.g. "PSTATE.N" for "PSTATE").
+    def lookup(self, name, exact = False, definitions_only = False):
+        query = '''
+            SELECT names.name, files.name, fragments.name, fragments.section,
+                   refs.path, refs.is_definition
+            FROM names
+            JOIN refs ON refs.name = names.id
+            JOIN fragments ON fragments.id = refs.fragment
+            JOIN files ON files.id = fragments.file
+            WHERE (names.name = ?%s)%s
+            ORDER BY files.name, fragments.id, refs.rowid
+        ''' % ('' if exact else ' OR names.name >= ? AND names.name < ?',
+               ' AND refs.is_definition' if definitions_only else '')
+        params = [name]
+        if not exact:
+            params += [name + '.', name + chr(ord('.') + 1)]
+        return [row[:5] + (bool(row[5]), )
+                for row in self.db.execute(query, params)]
+
+def dotted(name):
+    return '.'.join(str(part) for part in name)
+
+# the name of an identifier or qualified identifier, or None if the
+# expression is something else
+def qualified(expression):
+    parts = []
+    while isinstance(expression, expr.QualifiedIdentifier):
+        parts.insert(0, expression.name)
+        expression = expression.expression
+    if not isinstance(expression, expr.Identifier):
+        return None
+    parts.insert(0, expression.name)
+    return dotted(parts)
+
+def join(path, *parts):
+    if path:
+        return '.'.join((path, ) + parts)
+    return '.'.join(parts)
+
+def declaration_refs(declaration, path, refs):
+    if isinstance(declaration, decl.Function):
+        refs.append((dotted(declaration.name), path, True))
+        if declaration.result_type is not None:
+            datatype_refs(declaration.result_type, path, refs)
+        if declaration.parameters is not None:
+            for param_type, param_name, by_reference \
+                    in declaration.parameters:
+                datatype_refs(param_type, path, refs)
+        if declaration.body is not None:
+            body_refs(declaration.body, join(path, 'body'), refs)
+    elif isinstance(declaration, decl.Variable):
+        datatype_refs(declaration.datatype, path, refs)
+        for name, expression in declaration.variables:
+            refs.append((dotted(name), path, True))
+            if expression is not None:
+                expression_refs(expression, path, refs)
+    elif isinstance(declaration, decl.Array):
+        refs.append((dotted(declaration.name), path, True))
+        datatype_refs(declaration.datatype, path, refs)
+    elif isinstance(declaration, decl.Enumeration):
+        refs.append((str(declaration.name), path, True))
+        for value in declaration.values:
+            refs.append((str(value), path, True))
+    elif isinstance(declaration, decl.Type):
+        refs.append((dotted(declaration.name), path, True))
+        if declaration.fields is not None:
+            for field_type, field_identifier in declaration.fields:
+                datatype_refs(field_type, path, refs)
+    elif isinstance(declaration, decl.TypeEquals):
+        refs.append((dotted(declaration.name), path, True))
+        datatype_refs(declaration.datatype, path, refs)
+
+def body_refs(body, path, refs):
+    for i, statement in enumerate(body):
+        statement_refs(statement, join(path, str(i)), refs)
+
+def statement_refs(statement, path, refs):
+    if isinstance(statement, stmt.Assignment):
+        expression_refs(statement.lhs, path, refs)
+        expression_refs(statement.expression, path, refs)
+    elif isinstance(statement, stmt.ConstantAssignment):
+        datatype_refs(statement.datatype, path, refs)
+        expression_refs(statement.lhs, path, refs)
+        expression_refs(statement.expression, path, refs)
+    elif isinstance(statement, stmt.Declaration):
+        datatype_refs(statement.datatype, path, refs)
+        for lhs, expression in statement.variables:
+            expression_refs(lhs, path, refs)
+            if expression is not None:
+                expression_refs(expression, path, refs)
+    elif isinstance(statement, stmt.FunctionCall):
+        expression_refs(statement.func, path, refs)
+        for arg in statement.args:
+            expression_refs(arg, path, refs)
+    elif isinstance(statement, stmt.If):
+        expression_refs(statement.expression, path, refs)
+        body_refs(statement.then_body, join(path, 'then'), refs)
+        body_refs(statement.else_body, join(path, 'else'), refs)
+    elif isinstance(statement, stmt.For):
+        expression_refs(statement.var, path, refs)
+        expression_refs(statement.start, path, refs)
+        expression_refs(statement.stop, path, refs)
+        body_refs(statement.body, join(path, 'body'), refs)
+    elif isinstance(statement, stmt.While) or \
+         isinstance(statement, stmt.Repeat):
+        expression_refs(statement.condition, path, refs)
+        body_refs(statement.body, join(path, 'body'), refs)
+    elif isinstance(statement, stmt.Case):
+        expression_refs(statement.expression, path, refs)
+        for i, clause in enumerate(statement.clauses):
+            body_refs(clause.body, join(path, 'when%d' % i), refs)
+    elif isinstance(statement, stmt.Assert):
+        expression_refs(statement.expression, path, refs)
+    elif isinstance(statement, stmt.Return):
+        if statement.value is not None:
+            expression_refs(statement.value, path, refs)
+
+def expression_refs(expression, path, refs):
+    if isinstance(expression, expr.Identifier) or \
+       isinstance(expression, expr.QualifiedIdentifier):
+        name = qualified(expression)
+        if name is not None:
+            refs.append((name, path, False))
+        else:
+            expression_refs(expression.expression, path, refs)
+    elif isinstance(expression, expr.Arguments):
+        expression_refs(expression.func, path, refs)
+        for arg in expression.args:
+            if isinstance(arg, tuple):
+                expression_refs(arg[0], path, refs)
+                expression_refs(arg[2], path, refs)
+            else:
+                expression_refs(arg, path, refs)
+    elif isinstance(expression, expr.Set) or \
+         isinstance(expression, expr.Values):
+        for member in expression.members:
+            expression_refs(member, path, refs)
+    elif isinstance(expression, expr.Bits):
+        for element in expression.elements:
+            expression_refs(element, path, refs)
+    elif isinstance(expression, expr.Unary):
+        expression_refs(expression.arg, path, refs)
+    elif isinstance(expression, expr.Operator):
+        expression_refs(expression.arg0, path, refs)
+        expression_refs(expression.arg1, path, refs)
+    elif isinstance(expression, expr.Ternary):
+        expression_refs(expression.condition, path, refs)
+        expression_refs(expression.arg0, path, refs)
+        expression_refs(expression.arg1, path, refs)
+    elif isinstance(expression, expr.Unknown) or \
+         isinstance(expression, expr.ImplementationDefined):
+        datatype_refs(expression.datatype, path, refs)
+
+def datatype_refs(datatype, path, refs):
+    if isinstance(datatype, dtype.Bits):
+        expression_refs(datatype.expression, path, refs)
+    elif isinstance(datatype, dtype.Compound):
+        for partial_type in datatype.partial_types:
+            datatype_refs(partial_type, path, refs)
+    elif isinstance(datatype, dtype.Custom):
+        refs.append((dotted(datatype.name), path, False))
+    elif isinstance(datatype, dtype.Array):
+        datatype_refs(datatype.base, path, refs)
+        expression_refs(datatype.start, path, refs)
+        expression_refs(datatype.stop, path, refs)